@@ -0,0 +1,43 @@
+import re
+import unicodedata
+
+# Spelled-out street words and their usual abbreviations, so "12 Oak Street"
+# and "12 oak st." normalize to the same key
+ABBREVIATIONS = {
+    "street": "st",
+    "avenue": "ave",
+    "road": "rd",
+    "drive": "dr",
+    "lane": "ln",
+    "boulevard": "blvd",
+    "court": "ct",
+    "place": "pl",
+    "terrace": "ter",
+    "circle": "cir",
+    "highway": "hwy",
+    "parkway": "pkwy",
+    "square": "sq",
+    "apartment": "apt",
+    "unit": "apt",
+    "suite": "ste",
+    "north": "n",
+    "south": "s",
+    "east": "e",
+    "west": "w",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|#")
+
+
+def normalize_address(address: str | None) -> str | None:
+    """Reduce an address to a key that differently written copies of it share.
+
+    Lowercases, drops accents and punctuation, collapses whitespace and
+    abbreviates common street words. Returns None for a blank address.
+    """
+    if not address:
+        return None
+    text = unicodedata.normalize("NFKD", address).encode("ascii", "ignore").decode().lower()
+    tokens = [ABBREVIATIONS.get(token, token) for token in TOKEN_PATTERN.findall(text)]
+    key = " ".join("apt" if token == "#" else token for token in tokens)
+    return key or None
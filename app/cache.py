@@ -0,0 +1,318 @@
+"""Read-through cache of serialized responses for the hottest read endpoints.
+
+Handlers decorated with ``cached`` are answered from the cache after one
+lookup of their current ETag, which an entry must still carry; on a miss
+the handler runs and its response is serialized once and stored. Handlers
+decorated with ``invalidates`` drop the keys they affect once they have
+committed.
+
+The backend is chosen with ``CACHE_BACKEND``: ``memory`` (the default, one
+LRU per process), ``redis`` (shared between processes, needs the ``redis``
+package and ``CACHE_REDIS_URL``) or ``none``. On SQLite each worker's memory
+cache also drops what other workers' writes changed, as the change log
+announces them (see ``invalidate_change``).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Callable
+
+from fastapi import Request, Response
+from pydantic import BaseModel, TypeAdapter
+
+from app.database import reads_current_data, reads_own_writes, run_in_session
+from app.etags import etag_matches
+
+DEFAULT_CACHE_TTL = 30  # Seconds
+DEFAULT_CACHE_MAX_ENTRIES = 10_000
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+LISTS_KEY = "lists"
+
+
+def household_key(household_id: int) -> str:
+    return f"household:{household_id}"
+
+
+def contact_key(contact_id: int) -> str:
+    return f"contact:{contact_id}"
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str | None = None
+
+
+class CacheStats(BaseModel):
+    backend: str
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    entries: int | None = None
+    size_bytes: int | None = None
+
+
+class MemoryCache:
+    """An LRU of entries bounded by count, total size and age.
+
+    Every invalidation bumps ``epoch``. A response computed before an
+    invalidation may already be stale, so ``set`` drops it unless the epoch
+    it was read under is still current.
+    """
+
+    name = "memory"
+    enabled = True
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_CACHE_TTL,
+        max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, tuple[float, CacheEntry]] = OrderedDict()
+        self.size_bytes = 0
+        self.current_epoch = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    async def epoch(self) -> int:
+        return self.current_epoch
+
+    async def get(self, key: str) -> CacheEntry | None:
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires, entry = item
+        if expires <= time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def set(self, key: str, entry: CacheEntry, epoch: int):
+        if epoch != self.current_epoch or len(entry.body) > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, entry)
+        self.size_bytes += len(entry.body)
+        while len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    async def invalidate(self, keys: list[str]):
+        self.current_epoch += 1
+        for key in keys:
+            self.remove(key)
+
+    async def clear(self):
+        await self.invalidate(list(self.entries))
+
+    def remove(self, key: str):
+        item = self.entries.pop(key, None)
+        if item is not None:
+            self.size_bytes -= len(item[1].body)
+
+    async def stats(self) -> CacheStats:
+        return CacheStats(
+            backend=self.name,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            entries=len(self.entries),
+            size_bytes=self.size_bytes,
+        )
+
+
+class RedisCache:
+    """Entries kept in Redis, shared by every worker, expired by Redis itself.
+
+    Size bounds and eviction are left to the server's ``maxmemory`` policy,
+    so only hits and misses are counted here.
+    """
+
+    name = "redis"
+    enabled = True
+
+    def __init__(self, url: str, ttl: float = DEFAULT_CACHE_TTL, prefix: str = "address-book:"):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package installed")
+
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = 0
+
+    async def epoch(self) -> int:
+        return int(await self.client.get(f"{self.prefix}epoch") or 0)
+
+    async def get(self, key: str) -> CacheEntry | None:
+        data = await self.client.get(self.prefix + key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, _, body = data.partition(b"\n")
+        return CacheEntry(body, etag.decode() or None)
+
+    async def set(self, key: str, entry: CacheEntry, epoch: int):
+        if epoch != await self.epoch():
+            return
+        data = (entry.etag or "").encode() + b"\n" + entry.body
+        await self.client.set(self.prefix + key, data, px=int(self.ttl * 1000))
+
+    async def invalidate(self, keys: list[str]):
+        async with self.client.pipeline() as pipeline:
+            pipeline.incr(f"{self.prefix}epoch")
+            if keys:
+                pipeline.delete(*(self.prefix + key for key in keys))
+            await pipeline.execute()
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(f"{self.prefix}*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    async def stats(self) -> CacheStats:
+        return CacheStats(
+            backend=self.name, hits=self.hits, misses=self.misses, evictions=0, expirations=0
+        )
+
+
+class NullCache:
+    """Caching switched off: handlers always run."""
+
+    name = "none"
+    enabled = False
+
+    async def invalidate(self, keys: list[str]):
+        pass
+
+    async def clear(self):
+        pass
+
+    async def stats(self) -> CacheStats:
+        return CacheStats(backend=self.name, hits=0, misses=0, evictions=0, expirations=0)
+
+
+def create_cache():
+    """Create the cache backend configured by the ``CACHE_*`` environment variables."""
+    backend = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+    ttl = float(os.getenv("CACHE_TTL", str(DEFAULT_CACHE_TTL)))
+    if backend == "none":
+        return NullCache()
+    if backend == "redis":
+        return RedisCache(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"), ttl)
+    if backend == "memory":
+        return MemoryCache(
+            ttl,
+            int(os.getenv("CACHE_MAX_ENTRIES", str(DEFAULT_CACHE_MAX_ENTRIES))),
+            int(os.getenv("CACHE_MAX_BYTES", str(DEFAULT_CACHE_MAX_BYTES))),
+        )
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
+
+
+cache = create_cache()
+
+
+async def invalidate_change(kind: str, ids: list[int]):
+    """Drop the entries a write announced on ``/events`` may have made stale.
+
+    Only a per-process cache needs this, for writes other workers made; no
+    IDs means any of that kind.
+    """
+    if cache.name != "memory":
+        return
+    if kind == "list":
+        await cache.invalidate([LISTS_KEY])
+    elif ids:
+        await cache.invalidate([household_key(household_id) for household_id in ids])
+    else:
+        await cache.clear()
+
+
+async def cache_stats() -> CacheStats:
+    return await cache.stats()
+
+
+def cache_response(entry: CacheEntry, request: Request) -> Response:
+    headers = {"Cache-Control": "no-cache"}
+    if entry.etag:
+        headers["ETag"] = entry.etag
+        if etag_matches(request.headers.get("if-none-match"), entry.etag, weak=True):
+            return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+def cached(key: str | Callable[..., str], model, etag: Callable[..., str | None]):
+    """Serve a read endpoint from the cache, storing its serialized response on a miss.
+
+    ``key`` is the cache key, or a function of the endpoint's arguments that
+    returns it. ``model`` is the endpoint's response model. ``etag`` is
+    called with a session and the other arguments and returns the response's
+    current ETag; an entry stored under another one is out of date, even if
+    no invalidation reached it, and is read again. The endpoint must take
+    the ``request``, ``response`` and ``session`` parameters.
+    """
+    adapter = TypeAdapter(model)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(**kwargs):
+            # Entries may have been read from a replica that lacks the client's writes
+            if not cache.enabled or reads_own_writes(kwargs["request"]):
+                return await handler(**kwargs)
+
+            cache_key = key(**kwargs) if callable(key) else key
+            entry = await cache.get(cache_key)
+            if entry is not None:
+                arguments = {name: value for name, value in kwargs.items() if name != "session"}
+                if entry.etag != await run_in_session(kwargs["session"], etag, **arguments):
+                    entry = None
+            if entry is None:
+                epoch = await cache.epoch()
+                # A replica still behind the last invalidation would cache what it replaced
+                current = await reads_current_data(kwargs["request"])
+                result = await handler(**kwargs)
+                if isinstance(result, Response):  # e.g. 304 Not Modified
+                    return result
+                body = adapter.dump_json(adapter.validate_python(result, from_attributes=True))
+                entry = CacheEntry(body, kwargs["response"].headers.get("etag"))
+                if current:
+                    await cache.set(cache_key, entry, epoch)
+            return cache_response(entry, kwargs["request"])
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(keys: Callable[..., list[str]]):
+    """Drop the cache keys a write endpoint affects, once it has succeeded.
+
+    ``keys`` is called with the endpoint's arguments and returns the keys.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(**kwargs):
+            result = await handler(**kwargs)
+            await cache.invalidate(keys(**kwargs))
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,231 @@
+"""Change feed for delta sync.
+
+Triggers append an entry to ``changelog`` for every insert, update and
+delete of a household, member, list or list link, in the same transaction
+as the write. SQLite allows one writer at a time, so sequence numbers
+follow commit order and a reader never sees a later number before an
+earlier one. Writes made by foreign key cascades are logged too.
+
+``GET /changes?since=`` returns the entries after ``since``, compacted to
+the latest per row: an upsert carrying the row as it is now, or a
+tombstone. Clients start from a full load taken after reading ``latest``
+and then apply pages of changes. Replaying an upsert is harmless, so an
+overlap with the full load does no damage.
+
+The log is pruned to its newest ``CHANGE_LOG_RETENTION`` entries with::
+
+    python -m app.changes prune
+
+Clients further behind than that are told to reload in full.
+"""
+
+import argparse
+import os
+import sys
+from itertools import batched
+from typing import Literal
+
+from pydantic import BaseModel
+from sqlalchemy import Engine, event, func, text, tuple_
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel, select
+
+from app.database import engine
+from app.models import ChangeLog, Household, List, ListHouseholdLink, Member
+
+# Tables whose writes are logged, and the models their rows are read from
+SYNCED_MODELS = {
+    "household": Household,
+    "member": Member,
+    "list": List,
+    "listhouseholdlink": ListHouseholdLink,
+}
+
+# Derived columns left out of the rows sent to clients
+INTERNAL_COLUMNS = {"address_key", "version"}
+
+# Rows read per statement, well under SQLite's bound-parameter limit
+FETCH_CHUNK_SIZE = 500
+
+# Newest entries kept by pruning
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "1000000"))
+# Entries deleted per transaction when pruning
+PRUNE_BATCH_SIZE = 10_000
+
+
+def synced_columns(table: str) -> list[str]:
+    """The columns of ``table`` sent to clients, whose updates are logged."""
+    return [
+        column.name
+        for column in SYNCED_MODELS[table].__table__.columns
+        if column.name not in INTERNAL_COLUMNS
+    ]
+
+
+def change_ddl(table: str) -> list[str]:
+    if table == "listhouseholdlink":
+        key = "{row}.list_id, {row}.household_id"
+    else:
+        key = "{row}.id, NULL"
+    # Updates that only touch internal columns change nothing clients see
+    update = f"UPDATE OF {', '.join(synced_columns(table))}"
+    statements = []
+    for action, row, deleted in [("insert", "NEW", 0), ("update", "NEW", 0), ("delete", "OLD", 1)]:
+        timing = update if action == "update" else action.upper()
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_change_{action} AFTER {timing} "
+            f"ON {table} BEGIN "
+            "INSERT INTO changelog (table_name, row_id, household_id, deleted) "
+            f"VALUES ('{table}', {key.format(row=row)}, {deleted}); END"
+        )
+    return statements
+
+
+def create_change_triggers(connection: Connection):
+    for table in SYNCED_MODELS:
+        for statement in change_ddl(table):
+            connection.execute(text(statement))
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def create_change_log(target, connection: Connection, **kw):
+    """Create the triggers that fill the change log."""
+    if connection.dialect.name == "sqlite":
+        create_change_triggers(connection)
+
+
+class Change(BaseModel):
+    seq: int
+    table: str
+    op: Literal["upsert", "delete"]
+    # {"id": ...}, or {"list_id": ..., "household_id": ...} for a list link
+    key: dict[str, int]
+    # The row's columns, for an upsert
+    data: dict | None = None
+
+
+class ChangeFeed(BaseModel):
+    changes: list[Change]
+    # Pass as ``since`` for the next page
+    next: int
+    more: bool
+    # The newest sequence number when the page was read
+    latest: int
+
+
+def latest_seq(session: Session) -> int:
+    return session.exec(select(func.max(ChangeLog.seq))).one() or 0
+
+
+def oldest_seq(session: Session) -> int | None:
+    return session.exec(select(func.min(ChangeLog.seq))).one()
+
+
+def change_key(entry: ChangeLog) -> dict[str, int]:
+    if entry.table_name == "listhouseholdlink":
+        return {"list_id": entry.row_id, "household_id": entry.household_id}
+    return {"id": entry.row_id}
+
+
+def current_rows(session: Session, table: str, entries: list[ChangeLog]) -> dict[tuple, dict]:
+    """The rows behind ``entries`` as they are now, by key. Deleted rows are missing."""
+    model = SYNCED_MODELS[table]
+    columns = [column for column in model.__table__.columns if column.name not in INTERNAL_COLUMNS]
+    rows = {}
+    if table == "listhouseholdlink":
+        keys = [(entry.row_id, entry.household_id) for entry in entries]
+        for chunk in batched(keys, FETCH_CHUNK_SIZE // 2):
+            statement = select(*columns).where(
+                tuple_(ListHouseholdLink.list_id, ListHouseholdLink.household_id).in_(chunk)
+            )
+            for row in session.exec(statement):
+                rows[(row.list_id, row.household_id)] = dict(row._mapping)
+    else:
+        ids = [entry.row_id for entry in entries]
+        for chunk in batched(ids, FETCH_CHUNK_SIZE):
+            for row in session.exec(select(*columns).where(model.id.in_(chunk))):
+                rows[(row.id, None)] = dict(row._mapping)
+    return rows
+
+
+def read_changes(session: Session, since: int, limit: int) -> ChangeFeed:
+    """Read up to ``limit`` log entries after ``since``, compacted to one change per row."""
+    latest = latest_seq(session)
+    entries = session.exec(
+        select(ChangeLog).where(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit + 1)
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Only the newest entry for each row matters
+    newest: dict[tuple, ChangeLog] = {}
+    for entry in entries:
+        newest[(entry.table_name, entry.row_id, entry.household_id)] = entry
+
+    by_table: dict[str, list[ChangeLog]] = {}
+    for entry in newest.values():
+        if not entry.deleted:
+            by_table.setdefault(entry.table_name, []).append(entry)
+    rows = {table: current_rows(session, table, found) for table, found in by_table.items()}
+
+    changes = []
+    for entry in sorted(newest.values(), key=lambda entry: entry.seq):
+        # A row deleted after this page's entries gets its tombstone now
+        data = None if entry.deleted else rows[entry.table_name].get(
+            (entry.row_id, entry.household_id)
+        )
+        changes.append(
+            Change(
+                seq=entry.seq,
+                table=entry.table_name,
+                op="upsert" if data is not None else "delete",
+                key=change_key(entry),
+                data=data,
+            )
+        )
+    return ChangeFeed(
+        changes=changes,
+        next=entries[-1].seq if entries else since,
+        more=more,
+        latest=latest,
+    )
+
+
+def prune_change_log(engine: Engine, keep: int = CHANGE_LOG_RETENTION) -> int:
+    """Delete all but the newest ``keep`` entries, a batch per transaction.
+
+    Returns how many were deleted. At least one entry is kept, so the feed
+    can still tell how far it has been pruned.
+    """
+    with Session(engine) as session:
+        cutoff = latest_seq(session) - max(keep, 1)
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            count = connection.execute(
+                text(
+                    "DELETE FROM changelog WHERE seq IN ("
+                    "SELECT seq FROM changelog WHERE seq <= :cutoff ORDER BY seq LIMIT :limit)"
+                ),
+                {"cutoff": cutoff, "limit": PRUNE_BATCH_SIZE},
+            ).rowcount
+        deleted += count
+        if count < PRUNE_BATCH_SIZE:
+            return deleted
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Prune the change log behind GET /changes.")
+    parser.add_argument("command", choices=["prune"])
+    parser.add_argument(
+        "--keep", type=int, default=CHANGE_LOG_RETENTION, help="Newest entries to keep"
+    )
+    args = parser.parse_args(argv)
+
+    deleted = prune_change_log(engine, args.keep)
+    print(f"✓ Pruned {deleted} change log entries")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
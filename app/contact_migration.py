@@ -0,0 +1,231 @@
+"""Move legacy contacts into households.
+
+Contacts are read in ID order, a batch at a time. Contacts with the same
+normalized address become members of one household; a contact without an
+address gets a household of its own. Each batch inserts its households and
+members, marks its contacts with the household and member they became, so
+``/contacts`` keeps serving each contact under its old ID, and advances
+the job's checkpoint, all in one transaction. An interrupted job picks up
+after the last committed batch. Contacts at the address of a household
+that already exists, whether an earlier batch made it or not, join it.
+
+Run it with ``python -m app.contact_migration`` or start it in the
+background with ``POST /admin/contact-migration``.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import batched
+
+from pydantic import BaseModel
+from sqlalchemy import Engine, func, insert, update
+from sqlmodel import Session, select
+
+from app.addresses import normalize_address
+from app.database import engine
+from app.migrations import prepare_database
+from app.models import Contact, Household, JobCheckpoint, Member
+
+JOB_NAME = "contact-migration"
+
+# Contacts moved per transaction
+CONTACT_MIGRATION_BATCH_SIZE = int(os.getenv("CONTACT_MIGRATION_BATCH_SIZE", "5000"))
+
+# Addresses looked up per statement, well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+class ContactMigrationStatus(BaseModel):
+    total: int
+    processed: int
+    remaining: int
+    households: int
+    running: bool
+    finished: bool
+    rows_per_second: float
+    started_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+def household_name(last_names: list[str]) -> str:
+    """Name a household after its members' distinct last names, e.g. "The Lee & Park Household"."""
+    names = list(dict.fromkeys(name for name in last_names if name)) or ["Unnamed"]
+    return f"The {' & '.join(names)} Household"
+
+
+def migrate_batch(session: Session, batch_size: int = CONTACT_MIGRATION_BATCH_SIZE) -> int:
+    """Move the next batch of contacts into households, commit, and return how many moved."""
+    started = time.perf_counter()
+    checkpoint = session.get(JobCheckpoint, JOB_NAME) or JobCheckpoint(name=JOB_NAME)
+    contacts = session.exec(
+        select(
+            Contact.id,
+            Contact.first_name,
+            Contact.last_name,
+            Contact.email,
+            Contact.phone,
+            Contact.address,
+        )
+        # Contacts created through /contacts are made members right away
+        .where(Contact.id > checkpoint.last_id, Contact.household_id.is_(None))
+        .order_by(Contact.id)
+        .limit(batch_size)
+    ).all()
+    if not contacts:
+        checkpoint.finished_at = checkpoint.finished_at or datetime.now(timezone.utc)
+        session.add(checkpoint)
+        session.commit()
+        return 0
+
+    keys = [normalize_address(contact.address) for contact in contacts]
+
+    # Households already at these addresses, made by earlier batches or not
+    household_ids: dict[str, int] = {}
+    for chunk in batched({key for key in keys if key is not None}, LOOKUP_CHUNK_SIZE):
+        household_ids.update(
+            session.exec(
+                select(Household.address_key, func.min(Household.id))
+                .where(Household.address_key.in_(chunk))
+                .group_by(Household.address_key)
+            ).all()
+        )
+
+    # The rest get a household each: one per new address, or per contact
+    # without an address
+    groups: dict[str | int, list] = {}
+    for contact, key in zip(contacts, keys):
+        if key not in household_ids:
+            groups.setdefault(key if key is not None else contact.id, []).append(contact)
+    if groups:
+        new_ids = session.exec(
+            insert(Household.__table__).returning(
+                Household.__table__.c.id, sort_by_parameter_order=True
+            ),
+            params=[
+                {
+                    "name": household_name([contact.last_name for contact in group]),
+                    "address": (group[0].address or "").strip(),
+                }
+                for group in groups.values()
+            ],
+        ).scalars().all()
+        group_ids = dict(zip(groups, new_ids))
+    else:
+        group_ids = {}
+
+    placements = []
+    for contact, key in zip(contacts, keys):
+        household_id = household_ids.get(key) or group_ids[key if key is not None else contact.id]
+        placements.append({"id": contact.id, "address_key": key, "household_id": household_id})
+    member_ids = session.exec(
+        insert(Member.__table__).returning(Member.__table__.c.id, sort_by_parameter_order=True),
+        params=[
+            {
+                "household_id": placement["household_id"],
+                "first_name": contact.first_name,
+                "last_name": contact.last_name,
+                "email": contact.email,
+                "phone": contact.phone,
+            }
+            for contact, placement in zip(contacts, placements)
+        ],
+    ).scalars().all()
+    for placement, member_id in zip(placements, member_ids):
+        placement["member_id"] = member_id
+    session.exec(update(Contact), params=placements)
+
+    checkpoint.last_id = contacts[-1].id
+    checkpoint.processed += len(contacts)
+    checkpoint.households += len(groups)
+    checkpoint.seconds += time.perf_counter() - started
+    checkpoint.updated_at = datetime.now(timezone.utc)
+    session.add(checkpoint)
+    session.commit()
+    return len(contacts)
+
+
+def migrate_contacts(
+    engine: Engine, batch_size: int = CONTACT_MIGRATION_BATCH_SIZE, progress=None
+) -> ContactMigrationStatus:
+    """Run the job to the end, calling ``progress(status)`` after every batch."""
+    with Session(engine) as session:
+        while migrate_batch(session, batch_size):
+            if progress:
+                progress(migration_status(session))
+        return migration_status(session)
+
+
+def migration_status(session: Session) -> ContactMigrationStatus:
+    checkpoint = session.get(JobCheckpoint, JOB_NAME, populate_existing=True)
+    last_id = checkpoint.last_id if checkpoint else 0
+    total = session.exec(select(func.count()).select_from(Contact)).one()
+    remaining = session.exec(
+        select(func.count())
+        .select_from(Contact)
+        .where(Contact.id > last_id, Contact.household_id.is_(None))
+    ).one()
+    return ContactMigrationStatus(
+        total=total,
+        processed=checkpoint.processed if checkpoint else 0,
+        remaining=remaining,
+        households=checkpoint.households if checkpoint else 0,
+        running=runner is not None and runner.is_alive(),
+        finished=bool(checkpoint and checkpoint.finished_at),
+        rows_per_second=round(checkpoint.processed / checkpoint.seconds, 1)
+        if checkpoint and checkpoint.seconds
+        else 0.0,
+        started_at=checkpoint.started_at if checkpoint else None,
+        updated_at=checkpoint.updated_at if checkpoint else None,
+    )
+
+
+# The background run started from the admin endpoint, if any
+runner: threading.Thread | None = None
+runner_lock = threading.Lock()
+
+
+def start_in_background(engine: Engine, batch_size: int = CONTACT_MIGRATION_BATCH_SIZE) -> bool:
+    """Start the job on a background thread unless it is already running there."""
+    global runner
+    with runner_lock:
+        if runner is not None and runner.is_alive():
+            return False
+        runner = threading.Thread(
+            target=migrate_contacts, args=(engine, batch_size), name=JOB_NAME, daemon=True
+        )
+        runner.start()
+        return True
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Move legacy contacts into households.")
+    parser.add_argument("--batch-size", type=int, default=CONTACT_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--status", action="store_true", help="Show progress and exit")
+    args = parser.parse_args(argv)
+
+    prepare_database(engine)
+    if args.status:
+        with Session(engine) as session:
+            print(migration_status(session).model_dump_json(indent=2))
+        return 0
+
+    def progress(status: ContactMigrationStatus):
+        print(
+            f"{status.processed}/{status.total} contacts, {status.households} households "
+            f"({status.rows_per_second} contacts/s)"
+        )
+
+    status = migrate_contacts(engine, args.batch_size, progress)
+    print(
+        f"✓ Moved {status.processed} contacts into {status.households} households "
+        f"({status.rows_per_second} contacts/s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,445 @@
-from sqlmodel import Session, SQLModel, create_engine
+import logging
+import os
+import re
+import time
+from functools import partial, wraps
+from itertools import count
 
-DATABASE_URL = "sqlite:///./address_book.db"
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import URL, Engine, event, make_url, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-engine = create_engine(DATABASE_URL, echo=True)
+from app.metrics import instrument_engine, mark_handler_done
 
+load_dotenv()
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+logger = logging.getLogger(__name__)
 
+DEFAULT_DATABASE_URL = "sqlite:///./address_book.db"
 
-def get_session():
-    with Session(engine) as session:
+# Async drivers used when DATABASE_ASYNC is on and the URL names no driver
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+# Applied to every new SQLite connection. Each can be overridden with an
+# SQLITE_<NAME> environment variable, e.g. SQLITE_CACHE_SIZE=-131072.
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": "5000",  # Milliseconds to wait on a locked database
+    "cache_size": "-64000",  # Negative values are KiB, so 64 MB
+    "mmap_size": "268435456",  # 256 MB
+    "temp_store": "MEMORY",
+}
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def sqlite_pragmas(read_only: bool = False) -> dict[str, str]:
+    """Return the pragmas for new SQLite connections, with env overrides applied."""
+    pragmas = {
+        name: os.getenv(f"SQLITE_{name.upper()}", default)
+        for name, default in DEFAULT_SQLITE_PRAGMAS.items()
+    }
+    if read_only:
+        pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def apply_sqlite_pragmas(pragmas: dict[str, str], dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def engine_options(url: URL, engine_kwargs: dict, read_only: bool = False) -> dict:
+    options = {"echo": env_flag("DATABASE_ECHO")}
+    if read_only and url.get_backend_name() == "postgresql":
+        options["execution_options"] = {"postgresql_readonly": True}
+
+    is_sqlite = url.get_backend_name() == "sqlite"
+    is_memory = is_sqlite and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if not is_memory and "poolclass" not in engine_kwargs:
+        options["pool_size"] = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+        options["max_overflow"] = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+        options["pool_timeout"] = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+    options.update(engine_kwargs)
+    return options
+
+
+def create_db_engine(
+    url: str | URL | None = None, read_only: bool = False, **engine_kwargs
+) -> Engine:
+    """Create an engine configured from the environment.
+
+    Reads ``DATABASE_URL``, ``DATABASE_ECHO`` and, for pooled connections,
+    ``DATABASE_POOL_SIZE``, ``DATABASE_MAX_OVERFLOW`` and
+    ``DATABASE_POOL_TIMEOUT``. SQLite connections get the pragmas from
+    ``sqlite_pragmas()``. A ``read_only`` engine's connections refuse
+    writes, as suits a replica. Keyword arguments are passed through to
+    ``create_engine`` and take precedence over the environment.
+    """
+    url = make_url(url or os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL))
+    engine = create_engine(url, **engine_options(url, engine_kwargs, read_only))
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", partial(apply_sqlite_pragmas, sqlite_pragmas(read_only)))
+    instrument_engine(engine)
+    return engine
+
+
+def create_async_db_engine(
+    url: str | None = None, read_only: bool = False, **engine_kwargs
+) -> AsyncEngine:
+    """Create an async engine configured the same way as ``create_db_engine``.
+
+    A URL without an explicit driver gets the async driver for its backend,
+    e.g. ``sqlite:///./address_book.db`` becomes ``sqlite+aiosqlite:///...``.
+    """
+    url = make_url(url or os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL))
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=f"{url.drivername}+{ASYNC_DRIVERS[url.drivername]}")
+
+    async_engine = create_async_engine(url, **engine_options(url, engine_kwargs, read_only))
+    if url.get_backend_name() == "sqlite":
+        event.listen(
+            async_engine.sync_engine,
+            "connect",
+            partial(apply_sqlite_pragmas, sqlite_pragmas(read_only)),
+        )
+    instrument_engine(async_engine.sync_engine)
+    return async_engine
+
+
+# The sync engine is always available for schema setup and offline tools.
+# With DATABASE_ASYNC on, requests are served through the async engine.
+DATABASE_ASYNC = env_flag("DATABASE_ASYNC")
+
+engine = create_db_engine()
+async_engine = create_async_db_engine() if DATABASE_ASYNC else None
+
+# Read replicas of DATABASE_URL, comma separated. GET requests are spread
+# over them; writes and reads that must see a client's own writes use the
+# primary (see get_session).
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+replica_engines = [
+    create_db_engine(url, read_only=True) for url in DATABASE_REPLICA_URLS if not DATABASE_ASYNC
+]
+async_replica_engines = [
+    create_async_db_engine(url, read_only=True) for url in DATABASE_REPLICA_URLS if DATABASE_ASYNC
+]
+
+
+def drop_inherited_connections():
+    """Give a forked process empty connection pools.
+
+    Connections pooled before a fork are left to the parent without being
+    closed, since closing them would close them for the parent too. The
+    child opens its own, so no SQLite connection is used from two processes.
+    """
+    for each in [engine, *replica_engines]:
+        each.dispose(close=False)
+    for each in [async_engine, *async_replica_engines]:
+        if each is not None:
+            each.sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=drop_inherited_connections)
+
+
+# Read-your-writes
+#
+# After a write, the primary's commit position is sent back in the
+# X-Commit-Position header and a cookie of the same meaning. A read that
+# carries it is only served by a replica that has replayed that far, and by
+# the primary if none has. On SQLite the position is the sum of the table
+# write counters kept for ETags; on PostgreSQL it is the WAL position.
+
+READ_METHODS = {"GET", "HEAD"}
+POSITION_HEADER = "x-commit-position"
+POSITION_COOKIE = "commit_position"
+# Replicas are expected to catch up well within this many seconds
+POSITION_COOKIE_MAX_AGE = 300
+POSITION_PATTERN = re.compile(r"[0-9]+|[0-9A-Fa-f]+/[0-9A-Fa-f]+")
+# Seconds a replica that failed to connect is left out before it is tried again
+DATABASE_REPLICA_RETRY_AFTER = float(os.getenv("DATABASE_REPLICA_RETRY_AFTER", "30"))
+
+replica_turn = count()
+# When each replica that failed is tried again
+replica_down_until: dict[Engine, float] = {}
+# The furthest position each replica is known to have reached, so reads
+# that need less don't have to ask it again
+replica_reached: dict[Engine, int] = {}
+
+
+def commit_position(connection: Connection) -> str | None:
+    """How far the database behind ``connection`` has got with writes, if known."""
+    if connection.dialect.name == "sqlite":
+        return str(
+            connection.execute(text("SELECT coalesce(sum(version), 0) FROM tableversion")).one()[0]
+        )
+    if connection.dialect.name == "postgresql":
+        return connection.execute(text("SELECT pg_current_wal_lsn()::text")).one()[0]
+    return None
+
+
+def position_value(position: str) -> int:
+    """A position as a number, for comparing; a WAL position ``X/Y`` is 64 bits."""
+    if "/" in position:
+        high, low = position.split("/")
+        return int(high, 16) << 32 | int(low, 16)
+    return int(position)
+
+
+def has_reached(connection: Connection, position: str) -> bool:
+    """Whether the database behind ``connection`` has all writes up to ``position``."""
+    if connection.dialect.name == "sqlite":
+        return position.isdigit() and int(commit_position(connection)) >= int(position)
+    if connection.dialect.name == "postgresql" and "/" in position:
+        # Not in recovery means this is a primary, which has everything
+        return connection.execute(
+            text("SELECT coalesce(pg_last_wal_replay_lsn() >= CAST(:position AS pg_lsn), true)"),
+            {"position": position},
+        ).one()[0]
+    return False
+
+
+def request_position(request: Request) -> str | None:
+    """The commit position a read must see, from its header or cookie."""
+    position = request.headers.get(POSITION_HEADER) or request.cookies.get(POSITION_COOKIE)
+    if position and POSITION_PATTERN.fullmatch(position):
+        return position
+    return None
+
+
+def reads_own_writes(request: Request) -> bool:
+    """Whether ``request`` must see writes that replicas might not have yet."""
+    return bool(replica_engines or async_replica_engines) and request_position(request) is not None
+
+
+def mark_replica_down(replica: Engine):
+    if replica not in replica_down_until:
+        logger.warning("Replica %s is unreachable; reading from the primary", replica.url)
+    replica_down_until[replica] = time.monotonic() + DATABASE_REPLICA_RETRY_AFTER
+
+
+def available_replicas(replicas: list) -> list:
+    """Replicas to try, in turn, leaving out those that failed recently."""
+    now = time.monotonic()
+    up = [
+        replica
+        for replica in replicas
+        if replica_down_until.get(getattr(replica, "sync_engine", replica), 0) <= now
+    ]
+    if not up:
+        return []
+    start = next(replica_turn) % len(up)
+    return up[start:] + up[:start]
+
+
+def replica_failed(exception_context):
+    """Leave a replica out once it can't be connected to, even mid-request."""
+    if exception_context.is_disconnect or exception_context.connection is None:
+        mark_replica_down(exception_context.engine)
+
+
+for replica in [*replica_engines, *(each.sync_engine for each in async_replica_engines)]:
+    event.listen(replica, "handle_error", replica_failed)
+
+
+def known_to_reach(replica: Engine, position: str) -> bool:
+    return replica_reached.get(replica, -1) >= position_value(position)
+
+
+def note_reached(replica: Engine, position: str):
+    replica_reached[replica] = max(replica_reached.get(replica, -1), position_value(position))
+
+
+def read_engine(request: Request) -> Engine:
+    """The engine to serve ``request`` from: a replica that has the client's writes, if any.
+
+    At most one replica is asked how far it has got; if it is behind or
+    can't be reached, the primary serves the read.
+    """
+    if request.method not in READ_METHODS or not replica_engines:
+        return engine
+    position = request_position(request)
+    replicas = available_replicas(replica_engines)
+    for replica in replicas:
+        if position is None or known_to_reach(replica, position):
+            return replica
+    if replicas:
+        replica = replicas[0]
+        try:
+            with replica.connect() as connection:
+                reached = has_reached(connection, position)
+        except DBAPIError:
+            mark_replica_down(replica)
+            return engine
+        if reached:
+            note_reached(replica, position)
+            return replica
+    return engine
+
+
+async def async_read_engine(request: Request) -> AsyncEngine:
+    if request.method not in READ_METHODS or not async_replica_engines:
+        return async_engine
+    position = request_position(request)
+    replicas = available_replicas(async_replica_engines)
+    for replica in replicas:
+        if position is None or known_to_reach(replica.sync_engine, position):
+            return replica
+    if replicas:
+        replica = replicas[0]
+        try:
+            async with replica.connect() as connection:
+                reached = await connection.run_sync(has_reached, position)
+        except DBAPIError:
+            mark_replica_down(replica.sync_engine)
+            return async_engine
+        if reached:
+            note_reached(replica.sync_engine, position)
+            return replica
+    return async_engine
+
+
+def primary_position() -> str | None:
+    with engine.connect() as connection:
+        return commit_position(connection)
+
+
+def replica_is_current(replica: Engine) -> bool:
+    """Whether ``replica`` has every write the primary has committed so far."""
+    position = primary_position()
+    try:
+        with replica.connect() as connection:
+            return position is not None and has_reached(connection, position)
+    except DBAPIError:
+        return False
+
+
+async def async_replica_is_current(replica: AsyncEngine) -> bool:
+    async with async_engine.connect() as connection:
+        position = await connection.run_sync(commit_position)
+    try:
+        async with replica.connect() as connection:
+            return position is not None and await connection.run_sync(has_reached, position)
+    except DBAPIError:
+        return False
+
+
+async def reads_current_data(request: Request) -> bool:
+    """Whether what ``request`` reads from here on is as fresh as the primary's data now.
+
+    Reads from the primary always are. A replica read is only if the replica
+    has caught up, which is checked with a query on each.
+    """
+    replica = getattr(request.state, "replica", None)
+    if replica is None:
+        return True
+    if isinstance(replica, AsyncEngine):
+        return await async_replica_is_current(replica)
+    return await run_in_threadpool(replica_is_current, replica)
+
+
+def get_sync_session(request: Request):
+    bind = read_engine(request)
+    request.state.replica = bind if bind is not engine else None
+    with Session(bind) as session:
+        yield session
+
+
+async def get_async_session(request: Request):
+    bind = await async_read_engine(request)
+    request.state.replica = bind if bind is not async_engine else None
+    async with AsyncSession(bind) as session:
         yield session
+
+
+get_session = get_async_session if DATABASE_ASYNC else get_sync_session
+
+
+async def run_in_session(session: Session | AsyncSession, fn, *args, **kwargs):
+    """Call ``fn(sync_session, *args, **kwargs)`` without blocking the event loop.
+
+    Given a ``Session`` the call runs in the threadpool. Given an
+    ``AsyncSession`` it runs through ``run_sync`` on the event loop, so no
+    thread is held while the database works.
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, session, *args, **kwargs)
+
+
+class CommitPositionMiddleware:
+    """Send the primary's commit position with each successful write, when replicas are used."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        replicated = replica_engines or async_replica_engines
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or not replicated:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_position(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                if async_engine is not None:
+                    async with async_engine.connect() as connection:
+                        position = await connection.run_sync(commit_position)
+                else:
+                    position = await run_in_threadpool(primary_position)
+                if position is not None:
+                    cookie = (
+                        f"{POSITION_COOKIE}={position}; Max-Age={POSITION_COOKIE_MAX_AGE}; "
+                        "Path=/; HttpOnly; SameSite=Lax"
+                    )
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (POSITION_HEADER.encode(), position.encode()),
+                            (b"set-cookie", cookie.encode()),
+                        ],
+                    }
+            await send(message)
+
+        await self.app(scope, receive, send_with_position)
+
+
+def db_endpoint(handler):
+    """Serve a sync handler that takes a ``session`` from an async endpoint.
+
+    The handler runs through ``run_in_session``. It must return objects with
+    everything the response needs already loaded, since nothing can
+    lazy-load once it returns.
+    """
+
+    @wraps(handler)
+    async def endpoint(*args, session: Session | AsyncSession, **kwargs):
+        result = await run_in_session(
+            session, lambda sync_session: handler(*args, session=sync_session, **kwargs)
+        )
+        mark_handler_done()
+        return result
+
+    return endpoint
@@ -0,0 +1,191 @@
+"""Find households that share an address.
+
+Households are read in order of their normalized address key, through its
+index, so the scan is one ordered pass over the table however large it is.
+Keys that start with the same house number and street word form a block,
+and only households in the same block are compared: identical keys are
+duplicates, and distinct keys are duplicates when they are at least
+``threshold`` similar ("12 oak st" and "12 oak st n"). Pairwise comparison
+is skipped for blocks with more than ``MAX_BLOCK_KEYS`` distinct keys,
+which keeps the work per block bounded; their exact duplicates are still
+reported.
+
+Run it with ``python -m app.duplicates`` or ``GET /households/duplicates``.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections.abc import Iterator
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+from typing import Literal, get_args
+
+from pydantic import BaseModel
+from sqlmodel import Session, select
+
+from app.addresses import normalize_address
+from app.database import engine
+from app.migrations import prepare_database
+from app.models import Household
+
+DEFAULT_THRESHOLD = 0.9
+
+# What creating a household does when its address is already taken
+DuplicateCheck = Literal["allow", "flag", "reject"]
+DUPLICATE_HOUSEHOLDS = os.getenv("DUPLICATE_HOUSEHOLDS", "allow").strip().lower()
+if DUPLICATE_HOUSEHOLDS not in get_args(DuplicateCheck):
+    raise ValueError(f"Unknown DUPLICATE_HOUSEHOLDS {DUPLICATE_HOUSEHOLDS!r}")
+
+# Distinct keys in a block beyond which keys are only compared for equality
+MAX_BLOCK_KEYS = 200
+
+# Rows fetched from the database at a time
+FETCH_SIZE = 5000
+
+
+class DuplicateHousehold(BaseModel):
+    id: int
+    name: str
+    address: str
+
+
+class DuplicateGroup(BaseModel):
+    # The lowest address key in the group
+    address_key: str
+    exact: bool
+    households: list[DuplicateHousehold]
+
+
+def block_key(address_key: str) -> str:
+    """The first two words of a key, typically the house number and street."""
+    return " ".join(address_key.split(" ", 2)[:2])
+
+
+def similar(a: str, b: str, threshold: float) -> bool:
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    # The cheap upper bounds rule out most pairs before the real ratio
+    return (
+        matcher.real_quick_ratio() >= threshold
+        and matcher.quick_ratio() >= threshold
+        and matcher.ratio() >= threshold
+    )
+
+
+def block_groups(rows: list, threshold: float) -> list[DuplicateGroup]:
+    """Cluster one block's rows, ordered by address key, into groups of duplicates."""
+    by_key = {key: list(group) for key, group in groupby(rows, key=lambda row: row.address_key)}
+    keys = list(by_key)
+
+    # Union-find over the block's distinct keys
+    parent = {key: key for key in keys}
+
+    def root(key: str) -> str:
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    if threshold < 1 and 1 < len(keys) <= MAX_BLOCK_KEYS:
+        for a, b in combinations(keys, 2):
+            if root(a) != root(b) and similar(a, b, threshold):
+                parent[root(b)] = root(a)
+
+    clusters: dict[str, list[str]] = {}
+    for key in keys:
+        clusters.setdefault(root(key), []).append(key)
+    groups = []
+    for cluster in clusters.values():
+        members = [row for key in cluster for row in by_key[key]]
+        if len(members) > 1:
+            groups.append(
+                DuplicateGroup(
+                    address_key=cluster[0],
+                    exact=len(cluster) == 1,
+                    households=[
+                        DuplicateHousehold(id=row.id, name=row.name, address=row.address)
+                        for row in sorted(members, key=lambda row: row.id)
+                    ],
+                )
+            )
+    return groups
+
+
+def iter_blocks(session: Session, after: str | None = None) -> Iterator[tuple[str, list]]:
+    """Yield ``(last_key, rows)`` for each block, in key order, starting after key ``after``."""
+    statement = (
+        select(Household.id, Household.name, Household.address, Household.address_key)
+        .where(Household.address_key.is_not(None))
+        .order_by(Household.address_key, Household.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    if after is not None:
+        statement = statement.where(Household.address_key > after)
+    # Keys of a block sort next to each other, so blocks arrive whole
+    for _, rows in groupby(session.exec(statement), key=lambda row: block_key(row.address_key)):
+        rows = list(rows)
+        yield rows[-1].address_key, rows
+
+
+def find_duplicates(
+    session: Session,
+    threshold: float = DEFAULT_THRESHOLD,
+    after: str | None = None,
+    limit: int | None = None,
+) -> tuple[list[DuplicateGroup], str | None]:
+    """Return groups of duplicate households, and the cursor to continue from if cut short.
+
+    At most ``limit`` groups are returned, unless the last block holds more.
+    """
+    groups: list[DuplicateGroup] = []
+    for last_key, rows in iter_blocks(session, after):
+        if limit is not None and len(groups) >= limit:
+            return groups, after
+        groups.extend(block_groups(rows, threshold))
+        after = last_key
+    return groups, None
+
+
+def find_address_duplicates(
+    session: Session, address: str, limit: int = 10, exclude: int | None = None
+) -> list[int]:
+    """IDs of households other than ``exclude`` whose address normalizes the same as ``address``."""
+    key = normalize_address(address)
+    if key is None:
+        return []
+    statement = select(Household.id).where(Household.address_key == key)
+    if exclude is not None:
+        statement = statement.where(Household.id != exclude)
+    return session.exec(statement.order_by(Household.id).limit(limit)).all()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Find households that share an address.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Similarity at which distinct addresses count as the same; 1 for exact only",
+    )
+    args = parser.parse_args(argv)
+
+    prepare_database(engine)
+    started = time.perf_counter()
+    groups = households = 0
+    with Session(engine) as session:
+        # Printed block by block, so memory stays flat on large books
+        for _, rows in iter_blocks(session):
+            for group in block_groups(rows, args.threshold):
+                print(f"{'=' if group.exact else '~'} {group.address_key}")
+                for household in group.households:
+                    print(f"    {household.id}: {household.name}, {household.address}")
+                groups += 1
+                households += len(group.households)
+    seconds = time.perf_counter() - started
+    print(f"✓ {groups} groups, {households} households in {seconds:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
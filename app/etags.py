@@ -0,0 +1,185 @@
+from collections.abc import Callable
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import Select, event, inspect, text
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel, select
+
+from app.models import TableVersion
+
+# Tables whose writes are counted in TableVersion. Their counters tag
+# collections; a single resource is tagged with its row's version.
+VERSIONED_TABLES = ["household", "member", "list", "listhouseholdlink", "contact"]
+
+
+def bump(table: str, row_id: str) -> str:
+    return f"UPDATE {table} SET version = version + 1 WHERE id = {row_id};"
+
+
+# Row versions, bumped whenever what a resource's response holds changes:
+# a household with its members, a list with its household count, a contact
+ROW_VERSION_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS household_row_version
+    AFTER UPDATE OF name, address, latitude, longitude ON household
+    BEGIN {bump("household", "new.id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_row_version_insert AFTER INSERT ON member
+    BEGIN {bump("household", "new.household_id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_row_version_update
+    AFTER UPDATE OF first_name, last_name, email, phone, household_id ON member BEGIN
+        {bump("household", "old.household_id")}
+        UPDATE household SET version = version + 1
+        WHERE id = new.household_id AND new.household_id IS NOT old.household_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_row_version_delete AFTER DELETE ON member
+    BEGIN {bump("household", "old.household_id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS list_row_version AFTER UPDATE OF name, description ON list
+    BEGIN {bump("list", "new.id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS listhouseholdlink_row_version_insert
+    AFTER INSERT ON listhouseholdlink BEGIN {bump("list", "new.list_id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS listhouseholdlink_row_version_delete
+    AFTER DELETE ON listhouseholdlink BEGIN {bump("list", "old.list_id")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS contact_row_version
+    AFTER UPDATE OF first_name, last_name, email, phone, address, household_id, member_id
+    ON contact BEGIN {bump("contact", "new.id")} END
+    """,
+]
+
+
+def version_ddl(table: str) -> list[str]:
+    bump = f"UPDATE tableversion SET version = version + 1 WHERE name = '{table}';"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_version_{action} AFTER {action.upper()} ON {table} "
+        f"BEGIN {bump} END"
+        for action in ("insert", "update", "delete")
+    ]
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def create_version_triggers(target, connection: Connection, **kw):
+    """Seed the version counters and create the triggers that bump them."""
+    if connection.dialect.name != "sqlite":
+        return
+
+    for table in VERSIONED_TABLES:
+        connection.execute(
+            text("INSERT OR IGNORE INTO tableversion (name, version) VALUES (:name, 0)"),
+            {"name": table},
+        )
+        for statement in version_ddl(table):
+            connection.execute(text(statement))
+
+
+def create_row_version_triggers(connection: Connection):
+    for statement in ROW_VERSION_DDL:
+        connection.execute(text(statement))
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def create_row_versions(target, connection: Connection, **kw):
+    """Create the row version triggers if they are missing.
+
+    Databases whose tables predate the version columns get them from the
+    migration that adds the columns.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    columns = {column["name"] for column in inspect(connection).get_columns("household")}
+    if "version" in columns:
+        create_row_version_triggers(connection)
+
+
+def table_versions(session: Session, *tables: str) -> list[int]:
+    """Return the current write counters for ``tables``, in the order given."""
+    versions = dict(
+        session.exec(
+            select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(tables))
+        ).all()
+    )
+    return [versions.get(table, 0) for table in tables]
+
+
+def make_etag(session: Session, resource: str, tables: list[str]) -> str | None:
+    """Build a strong ETag for ``resource`` from the versions of the tables it reads.
+
+    Returns None where the version triggers don't exist, so responses go
+    untagged rather than being tagged with counters that never move.
+    """
+    if session.get_bind().dialect.name != "sqlite":
+        return None
+    versions = "-".join(str(version) for version in table_versions(session, *tables))
+    return f'"{resource}-{versions}"'
+
+
+def make_row_etag(session: Session, resource: str, statement: Select) -> str | None:
+    """Build a strong ETag for one resource from the row versions ``statement`` selects.
+
+    Returns None where the version triggers don't exist, or when there is no
+    such resource, which is left to the handler to refuse.
+    """
+    if session.get_bind().dialect.name != "sqlite":
+        return None
+    versions = session.exec(statement).first()
+    if versions is None:
+        return None
+    if len(statement.selected_columns) == 1:
+        versions = [versions]
+    tag = "-".join(str(version) for version in versions)
+    return f'"{resource}-{tag}"'
+
+
+def etag_matches(header: str | None, etag: str, weak: bool = False) -> bool:
+    if header is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def check_not_modified(
+    request: Request,
+    response: Response,
+    etag: str | None,
+    exists: Callable[[], bool] | None = None,
+) -> Response | None:
+    """Tag the response with ``etag``, or return a 304 if the client already has it.
+
+    Collection tags are made from table versions, so one can match for a
+    resource that doesn't exist, as ``*`` always does; ``exists`` is then
+    called before answering 304, and a missing one is left to the handler
+    to refuse.
+    """
+    if etag is None:
+        return None
+    # no-cache lets browsers keep the response but makes them revalidate it
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag, weak=True):
+        if exists is None or exists():
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def check_if_match(request: Request, etag: str | None):
+    """Refuse the write with a 412 if the client's copy is out of date."""
+    header = request.headers.get("if-match")
+    if etag is not None and header is not None and not etag_matches(header, etag):
+        raise HTTPException(status_code=412, detail="Resource has been modified")
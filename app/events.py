@@ -0,0 +1,285 @@
+"""Live updates pushed to browsers as Server-Sent Events.
+
+Write endpoints decorated with ``publishes`` announce what they changed to
+the process's ``hub`` once they have succeeded, and every ``GET /events``
+stream passes the announcement on. An event names what changed, not how,
+and clients reload what they show.
+
+A subscriber is a bounded queue and the coroutine draining it, so an idle
+connection costs a few kilobytes and no thread. Publishing never waits: a
+client whose queue is full has fallen behind, so its queue is emptied and
+replaced by a single ``resync`` event telling it to reload everything. A
+client that reconnects after missing events gets ``resync`` as well.
+
+On SQLite the hub follows the change log instead (see ``follow``), so every
+worker hears about every write, whichever worker made it, and event IDs are
+change log positions, which mean the same in every process and after a
+restart. Without a change log, event IDs carry a token for the process that
+issued them, so a client reconnecting to another process or after a
+restart is always told to resync.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+from collections.abc import AsyncIterator, Awaitable
+from functools import wraps
+from typing import Callable
+
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "64"))
+EVENTS_MAX_CLIENTS = int(os.getenv("EVENTS_MAX_CLIENTS", "10000"))
+# Seconds between comments sent on an idle stream, so proxies keep it open
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+# Seconds between reads of the change log when it has nothing new
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.5"))
+# Milliseconds a browser waits before reconnecting
+EVENTS_RETRY = 3000
+
+# Change log entries read at a time
+EVENTS_LOG_BATCH = 1000
+# An event changing more rows than this carries no IDs, meaning any
+MAX_EVENT_IDS = 100
+
+# The kind of event a write to each logged table makes
+TABLE_KINDS = {
+    "household": "household",
+    "member": "household",
+    "list": "list",
+    "listhouseholdlink": "list",
+}
+
+# Log entries with the household of each member still there, and the list
+# of each list link
+LOG_QUERY = text(
+    """
+    SELECT changelog.seq, changelog.table_name, changelog.row_id, member.household_id
+    FROM changelog
+    LEFT JOIN member ON changelog.table_name = 'member' AND member.id = changelog.row_id
+    WHERE changelog.seq > :after
+    ORDER BY changelog.seq
+    LIMIT :limit
+    """
+)
+
+KEEPALIVE = b": keepalive\n\n"
+CLOSED = None
+
+
+def format_event(event: str, data: dict, id: str | None = None) -> bytes:
+    lines = [f"event: {event}", f"data: {json.dumps(data, separators=(',', ':'))}"]
+    if id is not None:
+        lines.insert(0, f"id: {id}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscriber:
+    __slots__ = ("queue", "loop")
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(queue_size)
+        self.loop = asyncio.get_running_loop()
+
+
+class EventHub:
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, max_clients: int = EVENTS_MAX_CLIENTS):
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.subscribers: set[Subscriber] = set()
+        self.published = self.resyncs = 0
+        # Whether events come from the change log rather than from publishes
+        self.following = False
+        self.new_instance()
+
+    def new_instance(self):
+        """Issue event IDs no earlier process has, e.g. in a forked worker."""
+        self.instance = secrets.token_hex(4)
+        self.count = 0
+        # ID of the last event published
+        self.last_id = f"{self.instance}-0"
+
+    @property
+    def full(self) -> bool:
+        return len(self.subscribers) >= self.max_clients
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: dict, position: int | None = None):
+        """Queue an event for every subscriber. Safe to call from any thread.
+
+        ``position`` is the change log position the event brings clients up
+        to; without one the event gets an ID only this process issues.
+        """
+        if position is None:
+            self.count += 1
+            self.last_id = f"{self.instance}-{self.count}"
+        else:
+            self.last_id = str(position)
+        self.published += 1
+        message = format_event(event, data, self.last_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for subscriber in list(self.subscribers):
+            if subscriber.loop is loop:
+                self.deliver(subscriber, message)
+            else:
+                self.deliver_threadsafe(subscriber, message)
+
+    def deliver_threadsafe(self, subscriber: Subscriber, message: bytes | None):
+        try:
+            subscriber.loop.call_soon_threadsafe(self.deliver, subscriber, message)
+        except RuntimeError:  # Its event loop has shut down
+            self.unsubscribe(subscriber)
+
+    def deliver(self, subscriber: Subscriber, message: bytes | None):
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Whatever is queued is already stale; one resync replaces it all
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(
+                message if message is CLOSED else format_event("resync", {}, self.last_id)
+            )
+            self.resyncs += 1
+
+    def close(self):
+        """End every stream, e.g. on shutdown."""
+        for subscriber in list(self.subscribers):
+            self.deliver_threadsafe(subscriber, CLOSED)
+
+    async def stream(self, last_event_id: str | None = None) -> AsyncIterator[bytes]:
+        """Subscribe and yield events as SSE messages until the hub closes.
+
+        The subscription starts with a ``ready`` event, or with ``resync`` if
+        ``last_event_id`` shows the client missed events while away.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield f"retry: {EVENTS_RETRY}\n\n".encode()
+            if last_event_id is not None and last_event_id != self.last_id:
+                yield format_event("resync", {}, self.last_id)
+            else:
+                yield format_event("ready", {}, self.last_id)
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), EVENTS_HEARTBEAT)
+                except TimeoutError:
+                    message = KEEPALIVE
+                if message is CLOSED:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def publish_log_entries(self, entries: list) -> list[tuple[str, list[int]]]:
+        """Publish one ``change`` event per kind for a run of change log entries.
+
+        Returns the kinds and IDs published.
+        """
+        latest: dict[str, int] = {}
+        ids: dict[str, set[int] | None] = {}
+        for seq, table, row_id, household_id in entries:
+            kind = TABLE_KINDS[table]
+            latest[kind] = seq
+            # A deleted member's household is no longer known
+            changed = household_id if table == "member" else row_id
+            if changed is None:
+                ids[kind] = None
+            elif ids.setdefault(kind, set()) is not None:
+                ids[kind].add(changed)
+        published = []
+        for kind in sorted(latest, key=latest.get):
+            changed = ids[kind]
+            if changed is None or len(changed) > MAX_EVENT_IDS:
+                changed = set()
+            self.publish("change", {"kind": kind, "ids": sorted(changed)}, latest[kind])
+            published.append((kind, sorted(changed)))
+        return published
+
+    async def follow(
+        self,
+        engine: Engine,
+        interval: float = EVENTS_POLL_INTERVAL,
+        on_change: Callable[[str, list[int]], Awaitable] | None = None,
+    ):
+        """Publish the writes in ``engine``'s change log until cancelled.
+
+        Writes are picked up within ``interval`` seconds, from whichever
+        process made them, and ``publishes`` stops publishing on its own.
+        ``on_change(kind, ids)`` is awaited for each event published.
+        """
+        position = await run_in_threadpool(log_position, engine)
+        self.last_id = str(position)
+        self.following = True
+        try:
+            while True:
+                try:
+                    entries = await run_in_threadpool(read_log, engine, position)
+                except SQLAlchemyError:
+                    logger.warning("Could not read the change log", exc_info=True)
+                    entries = []
+                if entries:
+                    for kind, ids in self.publish_log_entries(entries):
+                        if on_change is not None:
+                            await on_change(kind, ids)
+                    position = entries[-1].seq
+                # Catch up on a backlog without waiting
+                if len(entries) < EVENTS_LOG_BATCH:
+                    await asyncio.sleep(interval)
+        finally:
+            self.following = False
+
+
+def log_position(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT coalesce(max(seq), 0) FROM changelog")).scalar()
+
+
+def read_log(engine: Engine, after: int) -> list:
+    with engine.connect() as connection:
+        return connection.execute(LOG_QUERY, {"after": after, "limit": EVENTS_LOG_BATCH}).all()
+
+
+hub = EventHub()
+
+# Workers forked from one process must not issue the same event IDs
+os.register_at_fork(after_in_child=hub.new_instance)
+
+
+def publishes(kind: str, ids: Callable[..., list[int]] | None = None):
+    """Announce a write endpoint's change on ``/events`` once it has succeeded.
+
+    ``kind`` is ``household`` or ``list``. ``ids`` is called with the
+    endpoint's arguments and its ``result`` and returns the IDs changed;
+    without it the event carries no IDs, meaning any of that kind.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(**kwargs):
+            result = await handler(**kwargs)
+            # Otherwise the change log has the write, and the hub publishes it
+            if not hub.following:
+                changed = ids(result=result, **kwargs) if ids else []
+                hub.publish("change", {"kind": kind, "ids": changed})
+            return result
+
+        return wrapper
+
+    return decorator
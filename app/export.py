@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+from typing import Literal
+
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import Household, ListHouseholdLink, Member
+
+ExportFormat = Literal["ndjson", "csv"]
+
+# Rows are pulled from the database cursor this many at a time, and each
+# batch goes out as one chunk of the response body.
+EXPORT_BATCH_SIZE = 1000
+
+CSV_COLUMNS = [
+    "household_id",
+    "household_name",
+    "address",
+    "latitude",
+    "longitude",
+    "member_id",
+    "first_name",
+    "last_name",
+    "email",
+    "phone",
+]
+
+
+def export_statement(list_id: int | None = None):
+    """Select one row per member (or per empty household), grouped by household."""
+    statement = (
+        select(
+            Household.id,
+            Household.name,
+            Household.address,
+            Household.latitude,
+            Household.longitude,
+            Member.id,
+            Member.first_name,
+            Member.last_name,
+            Member.email,
+            Member.phone,
+        )
+        .outerjoin(Member, Member.household_id == Household.id)
+        .order_by(Household.id, Member.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if list_id is not None:
+        statement = statement.join(
+            ListHouseholdLink, ListHouseholdLink.household_id == Household.id
+        ).where(ListHouseholdLink.list_id == list_id)
+    return statement
+
+
+class CsvEncoder:
+    """One CSV line per member, repeating the household columns."""
+
+    media_type = "text/csv"
+
+    def header(self) -> str:
+        return self.encode([CSV_COLUMNS])
+
+    def encode(self, rows) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def finish(self) -> str:
+        return ""
+
+
+class NdjsonEncoder:
+    """One JSON object per household, shaped like ``HouseholdRead``.
+
+    Rows arrive ordered by household, so a household is written out as soon
+    as the first row of the next one is seen.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self):
+        self.household = None
+
+    def header(self) -> str:
+        return ""
+
+    def encode(self, rows) -> str:
+        lines = []
+        for (
+            household_id,
+            name,
+            address,
+            latitude,
+            longitude,
+            member_id,
+            first_name,
+            last_name,
+            email,
+            phone,
+        ) in rows:
+            if self.household is None or self.household["id"] != household_id:
+                if self.household is not None:
+                    lines.append(json.dumps(self.household) + "\n")
+                self.household = {
+                    "name": name,
+                    "address": address,
+                    "id": household_id,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "members": [],
+                }
+            if member_id is not None:
+                self.household["members"].append(
+                    {
+                        "first_name": first_name,
+                        "last_name": last_name,
+                        "email": email,
+                        "phone": phone,
+                        "id": member_id,
+                    }
+                )
+        return "".join(lines)
+
+    def finish(self) -> str:
+        if self.household is None:
+            return ""
+        return json.dumps(self.household) + "\n"
+
+
+ENCODERS = {"ndjson": NdjsonEncoder, "csv": CsvEncoder}
+
+
+def iter_export(session: Session, statement, encoder):
+    yield encoder.header()
+    for rows in session.exec(statement).partitions():
+        yield encoder.encode(rows)
+    yield encoder.finish()
+
+
+async def aiter_export(session: AsyncSession, statement, encoder):
+    yield encoder.header()
+    result = await session.stream(statement)
+    async for rows in result.partitions():
+        yield encoder.encode(rows)
+    yield encoder.finish()
+
+
+def export_response(
+    session: Session | AsyncSession, statement, export_format: ExportFormat, filename: str
+) -> StreamingResponse:
+    """Stream the rows of ``statement`` as an attachment in the requested format."""
+    encoder = ENCODERS[export_format]()
+    if isinstance(session, AsyncSession):
+        body = aiter_export(session, statement, encoder)
+    else:
+        body = iter_export(session, statement, encoder)
+    return StreamingResponse(
+        body,
+        media_type=encoder.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+        },
+    )
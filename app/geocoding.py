@@ -0,0 +1,390 @@
+"""Geocode household addresses, through a cache of results by normalized address.
+
+Households at an address geocoded before get its coordinates as they are
+written (see ``app.spatial``). This job geocodes the rest: it asks the
+geocoder once per distinct normalized address, however many households
+share it, keeps every answer in ``geocodedaddress`` and fills in the
+households' coordinates. Addresses the geocoder can't place are kept too,
+without coordinates, so they aren't asked about again; delete their rows to
+retry them. Addresses are taken in order a batch at a time, each batch
+committed on its own, so the job can be stopped and run again. Addresses
+the geocoder fails to answer are left out of the cache for the next run to
+try again, and a run stops once the geocoder fails many times in a row.
+
+The geocoder is chosen with ``GEOCODER``: ``google`` (the Google Geocoding
+API with ``GOOGLE_API_KEY``, the default when the key is set), ``local`` (a
+CSV file of ``address,latitude,longitude`` rows named by ``GEOCODER_FILE``,
+such as a county's address points) or ``none``.
+
+Run it with ``python -m app.geocoding`` or start it in the background with
+``POST /admin/geocoding``.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from itertools import batched
+from typing import Protocol
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from pydantic import BaseModel
+from sqlalchemy import Engine, bindparam, func, text
+from sqlmodel import Session, select
+
+from app.addresses import normalize_address
+from app.database import engine
+from app.migrations import prepare_database
+from app.models import GeocodedAddress, Household
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "geocoding"
+
+GEOCODER = os.getenv("GEOCODER", "google" if os.getenv("GOOGLE_API_KEY") else "none")
+GEOCODER_FILE = os.getenv("GEOCODER_FILE")
+
+# Distinct addresses geocoded per transaction
+GEOCODING_BATCH_SIZE = int(os.getenv("GEOCODING_BATCH_SIZE", "100"))
+
+# Geocoder errors in a row after which a run stops, taking the geocoder to be down
+GEOCODING_MAX_ERRORS = int(os.getenv("GEOCODING_MAX_ERRORS", "10"))
+
+# Addresses looked up per statement, well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+GEOCODER_TIMEOUT = 10  # Seconds
+
+Coordinates = tuple[float, float]
+
+
+class GeocodingError(RuntimeError):
+    """The geocoder couldn't answer; the address can be tried again later."""
+
+
+class Geocoder(Protocol):
+    # Recorded with each result
+    name: str
+
+    def geocode(self, address: str) -> Coordinates | None:
+        """Return ``(latitude, longitude)``, or None if the address can't be placed."""
+
+
+class GoogleGeocoder:
+    name = "google"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def geocode(self, address: str) -> Coordinates | None:
+        query = urlencode({"address": address, "key": self.api_key})
+        try:
+            with urlopen(f"{GOOGLE_GEOCODE_URL}?{query}", timeout=GEOCODER_TIMEOUT) as response:
+                body = json.load(response)
+        except (OSError, ValueError) as error:
+            raise GeocodingError(f"Geocoding request failed: {error}") from error
+        if body["status"] == "ZERO_RESULTS":
+            return None
+        if body["status"] != "OK":
+            raise GeocodingError(f"Geocoder answered {body['status']}")
+        location = body["results"][0]["geometry"]["location"]
+        return location["lat"], location["lng"]
+
+
+class LocalGeocoder:
+    """Look addresses up in a table of known points, by normalized address."""
+
+    name = "local"
+
+    def __init__(self, places: dict[str, Coordinates]):
+        self.places = {normalize_address(address): point for address, point in places.items()}
+
+    @classmethod
+    def from_csv(cls, path: str) -> "LocalGeocoder":
+        with open(path, newline="", encoding="utf-8") as file:
+            return cls(
+                {
+                    row["address"]: (float(row["latitude"]), float(row["longitude"]))
+                    for row in csv.DictReader(file)
+                }
+            )
+
+    def geocode(self, address: str) -> Coordinates | None:
+        return self.places.get(normalize_address(address))
+
+
+def configured_geocoder() -> Geocoder | None:
+    """The geocoder ``GEOCODER`` names, or None if geocoding is off."""
+    if GEOCODER == "none":
+        return None
+    if GEOCODER == "google":
+        if not os.getenv("GOOGLE_API_KEY"):
+            raise RuntimeError("GEOCODER=google needs GOOGLE_API_KEY")
+        return GoogleGeocoder(os.environ["GOOGLE_API_KEY"])
+    if GEOCODER == "local":
+        if not GEOCODER_FILE:
+            raise RuntimeError("GEOCODER=local needs GEOCODER_FILE")
+        return LocalGeocoder.from_csv(GEOCODER_FILE)
+    raise RuntimeError(f"Unknown GEOCODER {GEOCODER!r}")
+
+
+class GeocodingStatus(BaseModel):
+    # Households with and without coordinates, among those with an address
+    located: int
+    unlocated: int
+    # Distinct addresses in the cache, and those the geocoder couldn't place
+    cached_addresses: int
+    not_found: int
+    # Addresses the geocoder failed on in the last run in this process, left
+    # for the next run, and the last error that run met
+    failed: int = 0
+    last_error: str | None = None
+    running: bool
+
+
+class RunErrors:
+    """The geocoder's failures during one run."""
+
+    def __init__(self):
+        self.failed = 0
+        self.in_a_row = 0
+        self.last_error: str | None = None
+
+    def add(self, address: str, error: Exception):
+        logger.warning("Couldn't geocode %r: %s", address, error)
+        self.failed += 1
+        self.in_a_row += 1
+        self.last_error = str(error)
+
+
+# The errors of the latest run in this process
+last_run = RunErrors()
+
+
+def geocode_addresses(
+    session: Session, geocoder: Geocoder, addresses: list[str], errors: RunErrors | None = None
+) -> dict[str, Coordinates | None]:
+    """Coordinates for ``addresses`` by normalized address, asking the geocoder only on a miss.
+
+    New answers are added to the session's transaction, not committed. With
+    ``errors``, addresses the geocoder fails on are recorded there and left
+    out; without, the ``GeocodingError`` is raised.
+    """
+    wanted = {}
+    for address in addresses:
+        if (key := normalize_address(address)) is not None:
+            wanted.setdefault(key, address)
+
+    found: dict[str, Coordinates | None] = {}
+    for chunk in batched(wanted, LOOKUP_CHUNK_SIZE):
+        for cached in session.exec(
+            select(GeocodedAddress).where(GeocodedAddress.address_key.in_(chunk))
+        ):
+            found[cached.address_key] = (
+                (cached.latitude, cached.longitude) if cached.latitude is not None else None
+            )
+    for key, address in wanted.items():
+        if key in found:
+            continue
+        try:
+            point = geocoder.geocode(address)
+        except GeocodingError as error:
+            if errors is None:
+                raise
+            errors.add(address, error)
+            if errors.in_a_row >= GEOCODING_MAX_ERRORS:
+                break
+            continue
+        if errors is not None:
+            errors.in_a_row = 0
+        found[key] = point
+        session.add(
+            GeocodedAddress(
+                address_key=key,
+                latitude=point[0] if point else None,
+                longitude=point[1] if point else None,
+                geocoder=geocoder.name,
+            )
+        )
+    return found
+
+
+def apply_cached_coordinates(session: Session):
+    """Give households without coordinates those cached for their address, and commit."""
+    cached = "(SELECT {column} FROM geocodedaddress WHERE address_key = household.address_key)"
+    session.exec(
+        text(
+            f"UPDATE household SET latitude = {cached.format(column='latitude')}, "
+            f"longitude = {cached.format(column='longitude')} "
+            "WHERE latitude IS NULL AND address_key IN ("
+            "SELECT address_key FROM geocodedaddress WHERE latitude IS NOT NULL)"
+        )
+    )
+    session.commit()
+
+
+def geocode_batch(
+    session: Session,
+    geocoder: Geocoder,
+    after: str = "",
+    batch_size: int = GEOCODING_BATCH_SIZE,
+    errors: RunErrors | None = None,
+) -> str | None:
+    """Geocode the next addresses after ``after`` whose households have no coordinates.
+
+    Commits, and returns the last address key done, or None once no
+    addresses are left. Failures are recorded in ``errors`` as
+    ``geocode_addresses`` does.
+    """
+    rows = session.exec(
+        select(Household.address_key, func.min(Household.address))
+        .where(
+            Household.latitude.is_(None),
+            Household.address_key > after,
+            Household.address_key.not_in(select(GeocodedAddress.address_key)),
+        )
+        .group_by(Household.address_key)
+        .order_by(Household.address_key)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return None
+
+    found = geocode_addresses(session, geocoder, [address for _, address in rows], errors)
+    located = [
+        {"key": key, "new_latitude": point[0], "new_longitude": point[1]}
+        for key, point in found.items()
+        if point is not None
+    ]
+    if located:
+        table = Household.__table__
+        session.exec(
+            table.update()
+            .where(table.c.address_key == bindparam("key"), table.c.latitude.is_(None))
+            .values(latitude=bindparam("new_latitude"), longitude=bindparam("new_longitude")),
+            params=located,
+        )
+    session.commit()
+    return rows[-1][0]
+
+
+def geocode_households(
+    engine: Engine, geocoder: Geocoder, batch_size: int = GEOCODING_BATCH_SIZE, progress=None
+) -> GeocodingStatus:
+    """Run the job to the end, calling ``progress(status)`` after every batch.
+
+    Stops early once the geocoder has failed ``GEOCODING_MAX_ERRORS`` times in a row.
+    """
+    global last_run
+    last_run = errors = RunErrors()
+    with Session(engine) as session:
+        # Addresses geocoded while a household at them was being written
+        apply_cached_coordinates(session)
+        after = ""
+        while (after := geocode_batch(session, geocoder, after, batch_size, errors)) is not None:
+            if progress:
+                progress(geocoding_status(session))
+            if errors.in_a_row >= GEOCODING_MAX_ERRORS:
+                logger.error("Stopped geocoding after %d errors in a row", errors.in_a_row)
+                break
+        return geocoding_status(session)
+
+
+def run_in_background(engine: Engine, geocoder: Geocoder, batch_size: int):
+    try:
+        geocode_households(engine, geocoder, batch_size)
+    except Exception as error:
+        logger.exception("Geocoding failed")
+        last_run.last_error = str(error)
+
+
+def geocoding_status(session: Session) -> GeocodingStatus:
+    with_address = select(func.count()).select_from(Household).where(
+        Household.address_key.is_not(None)
+    )
+    located = session.exec(with_address.where(Household.latitude.is_not(None))).one()
+    cached = session.exec(select(func.count()).select_from(GeocodedAddress)).one()
+    not_found = session.exec(
+        select(func.count())
+        .select_from(GeocodedAddress)
+        .where(GeocodedAddress.latitude.is_(None))
+    ).one()
+    return GeocodingStatus(
+        located=located,
+        unlocated=session.exec(with_address).one() - located,
+        cached_addresses=cached,
+        not_found=not_found,
+        failed=last_run.failed,
+        last_error=last_run.last_error,
+        running=runner is not None and runner.is_alive(),
+    )
+
+
+# The background run started from the admin endpoint, if any
+runner: threading.Thread | None = None
+runner_lock = threading.Lock()
+
+
+def start_in_background(
+    engine: Engine, geocoder: Geocoder, batch_size: int = GEOCODING_BATCH_SIZE
+) -> bool:
+    """Start the job on a background thread unless it is already running there."""
+    global runner
+    with runner_lock:
+        if runner is not None and runner.is_alive():
+            return False
+        runner = threading.Thread(
+            target=run_in_background,
+            args=(engine, geocoder, batch_size),
+            name=JOB_NAME,
+            daemon=True,
+        )
+        runner.start()
+        return True
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Geocode the addresses of households.")
+    parser.add_argument("--batch-size", type=int, default=GEOCODING_BATCH_SIZE)
+    parser.add_argument("--status", action="store_true", help="Show progress and exit")
+    args = parser.parse_args(argv)
+
+    prepare_database(engine)
+    if args.status:
+        with Session(engine) as session:
+            print(geocoding_status(session).model_dump_json(indent=2))
+        return 0
+
+    geocoder = configured_geocoder()
+    if geocoder is None:
+        print("✗ No geocoder configured; set GEOCODER", file=sys.stderr)
+        return 1
+
+    def progress(status: GeocodingStatus):
+        print(f"{status.located} households located, {status.unlocated} left")
+
+    started = time.perf_counter()
+    status = geocode_households(engine, geocoder, args.batch_size, progress)
+    seconds = time.perf_counter() - started
+    print(
+        f"✓ {status.located} households located, {status.unlocated} without coordinates, "
+        f"{status.not_found} addresses not found ({seconds:.1f} s)"
+    )
+    if status.failed:
+        print(
+            f"✗ {status.failed} addresses failed and are left for the next run: "
+            f"{status.last_error}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""Bulk import of households and members from NDJSON or CSV.
+
+Run offline against the configured database with::
+
+    python -m app.importer households.ndjson
+    python -m app.importer --format csv - < households.csv
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import deque
+from collections.abc import AsyncIterable, Iterable
+from itertools import batched
+from typing import Literal, NotRequired, TypedDict
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from app.database import engine
+from app.migrations import prepare_database
+from app.models import Household, Member
+
+ImportFormat = Literal["ndjson", "csv"]
+
+# Households are inserted and committed this many at a time
+IMPORT_BATCH_SIZE = 1000
+
+# Only the first errors are reported in full; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+# CSV input uses the same columns as the CSV export. Consecutive rows with
+# the same household_id (or, without one, the same name and address) make up
+# one household, with one member per row.
+MEMBER_COLUMNS = ["first_name", "last_name", "email", "phone"]
+
+
+# Same fields as HouseholdWithMembersCreate. Validating plain dicts against
+# TypedDicts is an order of magnitude cheaper than building SQLModel
+# instances, and validation is most of the cost of an import.
+class ImportedMember(TypedDict):
+    first_name: str
+    last_name: str
+    email: NotRequired[str | None]
+    phone: NotRequired[str | None]
+
+
+class ImportedHousehold(TypedDict):
+    name: str
+    address: str
+    members: list[ImportedMember]
+
+
+household_validator = TypeAdapter(ImportedHousehold)
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    households: int
+    members: int
+    error_count: int
+    errors: list[ImportRowError]
+    seconds: float
+    rows_per_second: float
+
+
+class LineQueue(deque):
+    """Lines waiting to be read, as an iterator that can be resumed once empty."""
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self:
+            raise StopIteration
+        return self.popleft()
+
+
+class HouseholdImporter:
+    """Parse households from lines of input and insert them in batches.
+
+    Feed it lines with ``feed()``, call ``flush()`` whenever ``ready`` is
+    true, and ``finish()`` at the end. Parsing never touches the database,
+    so the caller decides how the database calls are run.
+    """
+
+    def __init__(self, format: ImportFormat = "ndjson", batch_size: int | None = None):
+        self.format = format
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.pending: list[ImportedHousehold] = []
+        self.errors: list[ImportRowError] = []
+        self.error_count = 0
+        self.households = 0
+        self.members = 0
+        self.line_number = 0
+        self.started = time.perf_counter()
+
+        # CSV state: one reader for the whole input, so a quoted field can run
+        # over several lines however the input is split into chunks; the
+        # lines it hasn't read; whether they end inside a quoted field; the
+        # header; and the household whose rows are being read
+        self.csv_lines = LineQueue()
+        self.csv_rows = csv.reader(self.csv_lines)
+        self.in_quotes = False
+        self.columns: list[str] | None = None
+        self.group_key = None
+        self.group_line = 0
+        self.group: dict | None = None
+
+    @property
+    def ready(self) -> bool:
+        return len(self.pending) >= self.batch_size
+
+    def add_error(self, line: int, error: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(ImportRowError(line=line, error=error))
+
+    def add(self, data: dict, line: int):
+        """Validate one household and queue it for the next flush."""
+        try:
+            household = household_validator.validate_python(data)
+        except ValidationError as e:
+            messages = [
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                for error in e.errors()
+            ]
+            self.add_error(line, "; ".join(messages))
+            return
+        self.pending.append(household)
+
+    def feed(self, lines: Iterable[str]):
+        if self.format == "csv":
+            self.feed_csv(lines)
+        else:
+            self.feed_ndjson(lines)
+
+    def feed_ndjson(self, lines: Iterable[str]):
+        for line in lines:
+            self.line_number += 1
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.add_error(self.line_number, f"Invalid JSON: {e.msg}")
+                continue
+            if not isinstance(data, dict):
+                self.add_error(self.line_number, "Expected a JSON object")
+                continue
+            self.add(data, self.line_number)
+
+    def feed_csv(self, lines: Iterable[str]):
+        """Read the CSV rows that ``lines`` complete.
+
+        Lines are expected with their line endings. The lines of a quoted
+        field that isn't closed yet are held until the line that closes it.
+        """
+        for line in lines:
+            self.csv_lines.append(line)
+            # Quotes within a field are doubled, so an odd count opens or
+            # closes a quoted field
+            if line.count('"') % 2:
+                self.in_quotes = not self.in_quotes
+            if not self.in_quotes:
+                self.read_csv_rows()
+
+    def read_csv_rows(self):
+        while self.csv_lines:
+            line = self.csv_rows.line_num + 1
+            self.add_csv_row(next(self.csv_rows), line)
+
+    def csv_key(self, row: list[str]):
+        """What identifies the household a row belongs to."""
+        record = dict(zip(self.columns, row))
+        return record.get("household_id") or (
+            record.get("household_name"),
+            record.get("address"),
+        )
+
+    def add_csv_row(self, row: list[str], line: int):
+        if not row:
+            return
+        if self.columns is None:
+            self.columns = [column.strip() for column in row]
+            return
+
+        record = dict(zip(self.columns, row))
+        key = self.csv_key(row)
+        if self.group is None or key != self.group_key:
+            self.end_csv_group()
+            self.group_key = key
+            self.group_line = line
+            self.group = {
+                "name": record.get("household_name"),
+                "address": record.get("address"),
+                "members": [],
+            }
+        member = {column: record.get(column) or None for column in MEMBER_COLUMNS}
+        if member["first_name"] or member["last_name"]:
+            member["first_name"] = member["first_name"] or ""
+            member["last_name"] = member["last_name"] or ""
+            self.group["members"].append(member)
+
+    def end_csv_group(self):
+        if self.group is not None:
+            self.add(self.group, self.group_line)
+            self.group = None
+
+    def flush(self, session: Session):
+        """Insert the queued households and their members, then commit."""
+        if not self.pending:
+            return
+
+        household_ids = session.exec(
+            insert(Household.__table__).returning(
+                Household.__table__.c.id, sort_by_parameter_order=True
+            ),
+            params=[
+                {"name": household["name"], "address": household["address"]}
+                for household in self.pending
+            ],
+        ).scalars().all()
+
+        members = [
+            {
+                "household_id": household_id,
+                "first_name": member["first_name"],
+                "last_name": member["last_name"],
+                "email": member.get("email"),
+                "phone": member.get("phone"),
+            }
+            for household_id, household in zip(household_ids, self.pending)
+            for member in household["members"]
+            if member["first_name"] or member["last_name"]  # Skip empty members
+        ]
+        if members:
+            session.exec(insert(Member.__table__), params=members)
+
+        session.commit()
+        self.households += len(self.pending)
+        self.members += len(members)
+        self.pending = []
+
+    def finish(self, session: Session) -> ImportReport:
+        """Flush whatever is left and report on the whole import."""
+        if self.in_quotes:
+            # The rest of the input was read into the open field. The row is
+            # dropped, with the household it belongs to if it is being read.
+            line = self.csv_rows.line_num + 1
+            row = next(self.csv_rows)
+            if self.columns is not None and self.csv_key(row) == self.group_key:
+                self.group = None
+            self.add_error(line, "Unterminated quoted field")
+        self.end_csv_group()
+        self.flush(session)
+
+        seconds = time.perf_counter() - self.started
+        return ImportReport(
+            households=self.households,
+            members=self.members,
+            error_count=self.error_count,
+            errors=self.errors,
+            seconds=round(seconds, 3),
+            rows_per_second=round(self.households / seconds, 1) if seconds else 0.0,
+        )
+
+
+def import_lines(
+    session: Session,
+    lines: Iterable[str],
+    format: ImportFormat = "ndjson",
+    batch_size: int | None = None,
+) -> ImportReport:
+    """Import households from lines of NDJSON or CSV, committing every batch."""
+    importer = HouseholdImporter(format, batch_size)
+    for chunk in batched(lines, importer.batch_size):
+        importer.feed(chunk)
+        if importer.ready:
+            importer.flush(session)
+    return importer.finish(session)
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]):
+    """Split a stream of bytes into lists of complete lines of text, with their endings."""
+    remainder = b""
+    async for chunk in chunks:
+        *lines, remainder = (remainder + chunk).split(b"\n")
+        if lines:
+            yield [line.decode("utf-8-sig") + "\n" for line in lines]
+    if remainder:
+        yield [remainder.decode("utf-8-sig")]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Import households from NDJSON or CSV.")
+    parser.add_argument("path", help="File to import, or - for standard input")
+    parser.add_argument(
+        "--format", choices=["ndjson", "csv"], help="Input format (default: from the extension)"
+    )
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Rows per commit")
+    args = parser.parse_args(argv)
+
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+
+    prepare_database(engine)
+    source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8-sig")
+    with source, Session(engine) as session:
+        report = import_lines(session, source, format, args.batch_size)
+
+    print(
+        f"✓ Imported {report.households} households and {report.members} members "
+        f"in {report.seconds}s ({report.rows_per_second} households/s)"
+    )
+    for error in report.errors:
+        print(f"✗ Line {error.line}: {error.error}")
+    if report.error_count > len(report.errors):
+        print(f"✗ ...and {report.error_count - len(report.errors)} more errors")
+    return 1 if report.error_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,37 @@
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
-from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from app.database import create_db_and_tables
-from app.routers import contacts, households, lists
-
-load_dotenv()
+from app.cache import CacheStats, cache_stats, invalidate_change
+from app.database import CommitPositionMiddleware, engine
+from app.events import hub
+from app.metrics import MetricsMiddleware, render_metrics
+from app.migrations import MIGRATE_ON_STARTUP, prepare_database
+from app.routers import admin, changes, contacts, households, lists
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    prepare_database(engine, migrate=MIGRATE_ON_STARTUP)
+    # Only SQLite keeps a change log
+    following = None
+    if engine.dialect.name == "sqlite":
+        following = asyncio.create_task(hub.follow(engine, on_change=invalidate_change))
     yield
+    if following is not None:
+        following.cancel()
+    # Open event streams would otherwise hold shutdown up
+    hub.close()
 
 
 app = FastAPI(title="Address Book API", lifespan=lifespan)
+app.add_middleware(CommitPositionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -27,6 +39,8 @@ templates = Jinja2Templates(directory="app/templates")
 app.include_router(contacts.router)
 app.include_router(households.router)
 app.include_router(lists.router)
+app.include_router(changes.router)
+app.include_router(admin.router)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -42,3 +56,35 @@ def read_lists(request: Request):
 @app.get("/api/config")
 def get_config():
     return {"google_api_key": os.getenv("GOOGLE_API_KEY")}
+
+
+@app.get("/api/cache", response_model=CacheStats)
+async def get_cache_stats():
+    """Hit, miss and eviction counters for the response cache."""
+    return await cache_stats()
+
+
+@app.get("/events", response_class=StreamingResponse)
+async def get_events(request: Request):
+    """Stream live updates as Server-Sent Events.
+
+    ``change`` events carry the ``kind`` of thing changed (``household`` or
+    ``list``) and the IDs changed, if known. ``resync`` means events were
+    missed and everything shown should be reloaded.
+    """
+    if hub.full:
+        return PlainTextResponse(
+            "Too many event streams", status_code=503, headers={"Retry-After": "30"}
+        )
+    return StreamingResponse(
+        hub.stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        # Stop proxies such as nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request, SQL and serialization totals per route, in Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,321 @@
+"""Per-request timing and SQL instrumentation.
+
+``MetricsMiddleware`` gives every request a ``RequestMetrics`` in a context
+variable. The engine hooks from ``instrument_engine`` add each statement's
+time, shape and fetched rows to it (on SQLite only with
+``METRICS_COUNT_ROWS``), and ``db_endpoint`` marks when the
+handler returned, so what follows until the response starts is counted as
+serialization.
+
+Every response gets a ``Server-Timing`` header and one JSON line on the
+``app.requests`` logger. A statement shape repeated more than
+``N_PLUS_ONE_THRESHOLD`` times in one request is logged as a likely N+1.
+Totals per route are served in Prometheus text format at ``GET /metrics``.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine, event
+
+logger = logging.getLogger("app.requests")
+
+# Repeats of one statement shape within a request above which it is flagged
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+# Count the rows SQLite returns. SQLite doesn't report them, so this takes a
+# Python call per row fetched; without it only other drivers' rows are counted.
+METRICS_COUNT_ROWS = os.getenv("METRICS_COUNT_ROWS", "").strip().lower() in ("1", "true", "on")
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Expanded IN lists differ only in their number of placeholders
+PLACEHOLDER = r"\s*(?:\?|%\(\w+\)s|:\w+|\$\d+)\s*"
+IN_LIST = re.compile(rf"\((?:{PLACEHOLDER},)+{PLACEHOLDER}\)")
+
+
+def statement_shape(statement: str) -> str:
+    """``statement`` with IN lists collapsed, so their length doesn't matter."""
+    return IN_LIST.sub("(...)", statement)
+
+
+@dataclass
+class RequestMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    db_time: float = 0.0
+    queries: int = 0
+    rows: int = 0
+    handler_done: float | None = None
+    shapes: Counter = field(default_factory=Counter)
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> dict[str, int]:
+        """Statement shapes run more than ``threshold`` times."""
+        return {shape: count for shape, count in self.shapes.items() if count > threshold}
+
+
+current_metrics: ContextVar[RequestMetrics | None] = ContextVar("current_metrics", default=None)
+
+
+def mark_handler_done():
+    """Record that the handler returned; serialization starts now."""
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.handler_done = time.perf_counter()
+
+
+# Engine hooks
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = current_metrics.get()
+    # Rows are counted by the connection's row factory, which may run on
+    # another thread (aiosqlite), so it finds the request through the
+    # connection instead of the context variable
+    conn.info["request_metrics"] = metrics
+    if metrics is not None:
+        conn.info["query_started"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = conn.info.get("request_metrics")
+    if metrics is None:
+        return
+    metrics.db_time += time.perf_counter() - conn.info["query_started"]
+    metrics.queries += 1
+    metrics.shapes[statement_shape(statement)] += 1
+    # Drivers other than SQLite report the rows a SELECT returned up front
+    if cursor.description is not None and cursor.rowcount > 0:
+        metrics.rows += cursor.rowcount
+
+
+def count_sqlite_rows(dbapi_connection, connection_record):
+    info = connection_record.info
+
+    def row_factory(cursor, row):
+        metrics = info.get("request_metrics")
+        if metrics is not None:
+            metrics.rows += 1
+        return row
+
+    # aiosqlite's adapter exposes the aiosqlite connection, which passes the
+    # factory on to its sqlite3 connection
+    getattr(dbapi_connection, "driver_connection", dbapi_connection).row_factory = row_factory
+
+
+def instrument_engine(engine: Engine, count_rows: bool | None = None):
+    """Attribute ``engine``'s statements to the request that runs them.
+
+    SQLite rows are counted with ``count_rows``, which defaults to ``METRICS_COUNT_ROWS``.
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    if count_rows is None:
+        count_rows = METRICS_COUNT_ROWS
+    if count_rows and engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", count_sqlite_rows)
+
+
+# Aggregates
+
+
+@dataclass
+class RouteTotals:
+    requests: Counter = field(default_factory=Counter)  # By status code
+    buckets: list[int] = field(default_factory=lambda: [0] * len(DURATION_BUCKETS))
+    duration: float = 0.0
+    db_time: float = 0.0
+    serialize_time: float = 0.0
+    queries: int = 0
+    rows: int = 0
+    n_plus_one: int = 0
+
+
+# Keyed by (method, route template)
+totals: defaultdict[tuple[str, str], RouteTotals] = defaultdict(RouteTotals)
+
+
+def record(
+    method: str,
+    route: str,
+    status: int,
+    duration: float,
+    metrics: RequestMetrics,
+    serialize_time: float | None,
+    repeated: dict[str, int],
+):
+    route_totals = totals[method, route]
+    route_totals.requests[status] += 1
+    bucket = bisect_left(DURATION_BUCKETS, duration)
+    if bucket < len(DURATION_BUCKETS):
+        route_totals.buckets[bucket] += 1
+    route_totals.duration += duration
+    route_totals.db_time += metrics.db_time
+    route_totals.serialize_time += serialize_time or 0.0
+    route_totals.queries += metrics.queries
+    route_totals.rows += metrics.rows
+    route_totals.n_plus_one += bool(repeated)
+
+
+def labels(**values) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in values.items())
+
+
+def render_metrics() -> str:
+    """All route totals in Prometheus text exposition format."""
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{sample}{{{tags}}} {value}" for sample, tags, value in samples)
+
+    routes = sorted(totals.items())
+    metric(
+        "http_requests_total",
+        "counter",
+        "Requests served.",
+        (
+            ("http_requests_total", labels(method=method, route=route, status=status), count)
+            for (method, route), route_totals in routes
+            for status, count in sorted(route_totals.requests.items())
+        ),
+    )
+
+    def duration_samples():
+        for (method, route), route_totals in routes:
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, route_totals.buckets):
+                cumulative += count
+                yield (
+                    "http_request_duration_seconds_bucket",
+                    labels(method=method, route=route, le=bound),
+                    cumulative,
+                )
+            count = sum(route_totals.requests.values())
+            yield (
+                "http_request_duration_seconds_bucket",
+                labels(method=method, route=route, le="+Inf"),
+                count,
+            )
+            yield (
+                "http_request_duration_seconds_sum",
+                labels(method=method, route=route),
+                round(route_totals.duration, 6),
+            )
+            yield "http_request_duration_seconds_count", labels(method=method, route=route), count
+
+    metric(
+        "http_request_duration_seconds",
+        "histogram",
+        "Time until the response started.",
+        duration_samples(),
+    )
+
+    for name, attribute, help_text in [
+        ("http_request_db_seconds_total", "db_time", "Time spent executing SQL."),
+        ("http_request_serialize_seconds_total", "serialize_time", "Time spent serializing."),
+        ("http_request_queries_total", "queries", "SQL statements executed."),
+        ("http_request_rows_total", "rows", "Rows fetched from the database."),
+        ("http_request_n_plus_one_total", "n_plus_one", "Requests flagged as likely N+1."),
+    ]:
+        metric(
+            name,
+            "counter",
+            help_text,
+            (
+                (name, labels(method=method, route=route), round(getattr(values, attribute), 6))
+                for (method, route), values in routes
+            ),
+        )
+    return "\n".join(lines) + "\n"
+
+
+# Middleware
+
+
+def server_timing(duration: float, metrics: RequestMetrics, serialize_time: float | None) -> str:
+    parts = [
+        f"total;dur={duration * 1000:.2f}",
+        f"db;dur={metrics.db_time * 1000:.2f}"
+        f';desc="{metrics.queries} queries, {metrics.rows} rows"',
+    ]
+    if serialize_time is not None:
+        parts.append(f"serialize;dur={serialize_time * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """Measure each HTTP request and report it as described in the module docstring."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        timings = {}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                timings["duration"] = now - metrics.started
+                if metrics.handler_done is not None:
+                    timings["serialize"] = now - metrics.handler_done
+                timings["status"] = message["status"]
+                header = server_timing(timings["duration"], metrics, timings.get("serialize"))
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (b"server-timing", header.encode())],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_metrics.reset(token)
+            self.report(scope, metrics, timings)
+
+    def report(self, scope, metrics: RequestMetrics, timings: dict):
+        route = scope.get("route")
+        route_path = getattr(route, "path", None) or "<unmatched>"
+        method = scope["method"]
+        status = timings.get("status", 500)
+        duration = timings.get("duration", time.perf_counter() - metrics.started)
+        serialize_time = timings.get("serialize")
+        repeated = metrics.repeated_statements()
+
+        record(method, route_path, status, duration, metrics, serialize_time, repeated)
+        for shape, count in repeated.items():
+            logger.warning(
+                "Likely N+1 in %s %s: statement ran %d times: %s", method, route_path, count, shape
+            )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                json.dumps(
+                    {
+                        "method": method,
+                        "path": scope["path"],
+                        "route": route_path,
+                        "status": status,
+                        "duration_ms": round(duration * 1000, 3),
+                        "db_ms": round(metrics.db_time * 1000, 3),
+                        "queries": metrics.queries,
+                        "rows": metrics.rows,
+                        "serialize_ms": None
+                        if serialize_time is None
+                        else round(serialize_time * 1000, 3),
+                    }
+                )
+            )
@@ -0,0 +1,448 @@
+"""Versioned schema migrations.
+
+A database's schema version is the highest migration recorded in its
+``schemamigration`` table. ``prepare_database`` runs on startup: it creates
+an empty database at the latest version, and refuses to serve one whose
+version doesn't match the code unless ``MIGRATE_ON_STARTUP`` is set.
+Outdated databases are upgraded with::
+
+    python -m app.migrations status
+    python -m app.migrations upgrade
+
+A migration has two parts. ``upgrade`` changes the schema in one
+transaction, and must be safe to run again, since a migration is only
+recorded once its backfill has finished. ``backfill`` then fills in data in
+batches of ``MIGRATION_BATCH_SIZE`` rows, each in its own short transaction,
+so the app can keep using the database while it runs. Backfills only touch
+rows that still need them, so an interrupted upgrade resumes where it
+stopped.
+
+SQLite can't alter a constraint in place; ``rebuild_table`` recreates a
+table from its model instead, like Alembic's batch mode.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from sqlalchemy import Engine, MetaData, Table, bindparam, func, insert, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+from app.etags import create_row_version_triggers
+from app.addresses import normalize_address
+from app.changes import SYNCED_MODELS, create_change_triggers
+from app.database import engine, env_flag
+from app.models import (
+    ChangeLog,
+    Contact,
+    GeocodedAddress,
+    Household,
+    JobCheckpoint,
+    List,
+    SchemaMigration,
+)
+from app.search import SEARCH_BACKFILL
+from app.spatial import create_spatial_triggers
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_ON_STARTUP = env_flag("MIGRATE_ON_STARTUP")
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+# Seconds to wait between backfill batches, so other writers get the lock
+MIGRATION_BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.01"))
+
+
+class SchemaVersionError(RuntimeError):
+    """The database's schema version doesn't match the code."""
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+    backfill: Callable[[Engine], None] | None = None
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str, backfill: Callable[[Engine], None] | None = None):
+    """Register the decorated function as the schema change of migration ``version``."""
+
+    def register(upgrade: Callable[[Connection], None]):
+        if version != len(MIGRATIONS) + 1:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, description, upgrade, backfill))
+        return upgrade
+
+    return register
+
+
+def head() -> int:
+    """The schema version the code expects."""
+    return MIGRATIONS[-1].version
+
+
+# Helpers for writing migrations
+
+
+def backfill_in_batches(engine: Engine, table: str, sql: str, batch_size: int | None = None):
+    """Run ``sql`` over ``table`` one range of IDs at a time, each in its own transaction.
+
+    ``sql`` gets the range as ``:start`` (inclusive) and ``:end`` (exclusive).
+    """
+
+    def run(connection: Connection, start: int, end: int):
+        connection.execute(text(sql), {"start": start, "end": end})
+
+    backfill_rows(engine, table, run, batch_size)
+
+
+def backfill_rows(engine: Engine, table: str, fn: Callable, batch_size: int | None = None):
+    """Like ``backfill_in_batches``, but with the work done in Python.
+
+    ``fn(connection, start, end)`` is called for each range of IDs, in its
+    own transaction.
+    """
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    with engine.connect() as connection:
+        first, last = connection.execute(text(f'SELECT min(id), max(id) FROM "{table}"')).one()
+    if first is None:
+        return
+    for start in range(first, last + 1, batch_size):
+        with engine.begin() as connection:
+            fn(connection, start, start + batch_size)
+        through = min(start + batch_size - 1, last)
+        logger.info("Backfilled %s through ID %d of %d", table, through, last)
+        time.sleep(MIGRATION_BATCH_PAUSE)
+
+
+def add_column(connection: Connection, table: Table, name: str):
+    """Add the model's column ``name`` to ``table`` unless the table already has it."""
+    if name in {column["name"] for column in inspect(connection).get_columns(table.name)}:
+        return
+    column = table.c[name]
+    specification = connection.dialect.ddl_compiler(
+        connection.dialect, None
+    ).get_column_specification(column)
+    connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {specification}'))
+
+
+def missing_cascades(connection: Connection, table: Table) -> bool:
+    """Whether ``table`` lacks an ``ON DELETE CASCADE`` its model declares."""
+    declared = {
+        foreign_key.parent.name
+        for foreign_key in table.foreign_keys
+        if (foreign_key.ondelete or "").upper() == "CASCADE"
+    }
+    if not declared:
+        return False
+    rows = connection.execute(text(f'PRAGMA foreign_key_list("{table.name}")')).mappings()
+    cascading = {row["from"] for row in rows if row["on_delete"].upper() == "CASCADE"}
+    return not declared <= cascading
+
+
+def rebuild_table(connection: Connection, table: Table):
+    """Recreate ``table`` from its model on SQLite, keeping its rows, triggers and indexes.
+
+    Follows https://www.sqlite.org/lang_altertable.html#otheralter. Rows
+    whose parent no longer exists can't satisfy the foreign keys and are
+    dropped.
+    """
+    name = table.name
+    new_name = f"{name}_rebuild"
+    # Triggers and indexes go with the old table; they are put back by name
+    schema_sql = (
+        connection.execute(
+            text(
+                "SELECT sql FROM sqlite_master "
+                "WHERE tbl_name = :name AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+            ),
+            {"name": name},
+        )
+        .scalars()
+        .all()
+    )
+    stored = {row[1] for row in connection.execute(text(f'PRAGMA table_info("{name}")'))}
+    columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in stored)
+    parents_exist = " AND ".join(
+        f'"{foreign_key.parent.name}" IN '
+        f'(SELECT "{foreign_key.column.name}" FROM "{foreign_key.column.table.name}")'
+        for foreign_key in table.foreign_keys
+    )
+
+    preparer = connection.dialect.identifier_preparer
+    create_sql = str(CreateTable(table).compile(dialect=connection.dialect))
+    # Left behind if an earlier attempt failed part way
+    connection.execute(text(f'DROP TABLE IF EXISTS "{new_name}"'))
+    connection.execute(
+        text(
+            create_sql.replace(
+                f"CREATE TABLE {preparer.format_table(table)}",
+                f"CREATE TABLE {preparer.quote(new_name)}",
+                1,
+            )
+        )
+    )
+    connection.execute(
+        text(
+            f'INSERT INTO "{new_name}" ({columns}) '
+            f'SELECT {columns} FROM "{name}" WHERE {parents_exist or "1"}'
+        )
+    )
+    # Dropping the table doesn't fire its triggers, so the search index and
+    # table versions are left as they were
+    connection.execute(text(f'DROP TABLE "{name}"'))
+    connection.execute(text(f'ALTER TABLE "{new_name}" RENAME TO "{name}"'))
+    for statement in schema_sql:
+        connection.execute(text(statement))
+
+
+def create_missing_indexes(connection: Connection, metadata: MetaData):
+    """Create every index declared on ``metadata`` that the database lacks.
+
+    Indexes on columns a later migration adds are left to that migration.
+    """
+    inspector = inspect(connection)
+    created = set()
+    for table in metadata.sorted_tables:
+        stored = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if {column.name for column in index.columns} - stored:
+                continue
+            if not connection.dialect.has_index(connection, table.name, index.name):
+                index.create(connection)
+                created.add(table.name)
+    # Give the planner statistics for the new indexes straight away
+    if created and connection.dialect.name == "sqlite":
+        for name in sorted(created):
+            connection.execute(text(f'ANALYZE "{name}"'))
+
+
+# Migrations, oldest first. Models always describe the latest version, so a
+# new database is created from them directly rather than by replaying these.
+
+
+def backfill_search_index(engine: Engine):
+    if engine.dialect.name == "sqlite":
+        backfill_in_batches(engine, "household", SEARCH_BACKFILL)
+
+
+@migration(
+    1,
+    "Adopt a database created before migrations: cascading foreign keys, indexes, search index",
+    backfill=backfill_search_index,
+)
+def adopt_existing_database(connection: Connection):
+    # Creates missing tables, and the search index and version triggers
+    SQLModel.metadata.create_all(connection)
+    if connection.dialect.name == "sqlite":
+        for table in SQLModel.metadata.sorted_tables:
+            if missing_cascades(connection, table):
+                rebuild_table(connection, table)
+    create_missing_indexes(connection, SQLModel.metadata)
+
+
+@migration(2, "Track legacy contacts moved into households")
+def track_contact_migration(connection: Connection):
+    for name in ("address_key", "household_id"):
+        add_column(connection, Contact.__table__, name)
+    JobCheckpoint.__table__.create(connection, checkfirst=True)
+    create_missing_indexes(connection, SQLModel.metadata)
+
+
+def fill_address_keys(connection: Connection, start: int, end: int):
+    households = connection.execute(
+        text(
+            "SELECT id, address FROM household "
+            "WHERE id >= :start AND id < :end AND address_key IS NULL AND address != ''"
+        ),
+        {"start": start, "end": end},
+    ).all()
+    keys = [
+        {"row_id": id, "address_key": normalize_address(address)} for id, address in households
+    ]
+    if keys:
+        table = Household.__table__
+        connection.execute(
+            table.update().where(table.c.id == bindparam("row_id")),
+            keys,
+        )
+
+
+def backfill_address_keys(engine: Engine):
+    backfill_rows(engine, "household", fill_address_keys)
+
+
+@migration(3, "Store and index normalized household addresses", backfill=backfill_address_keys)
+def add_household_address_key(connection: Connection):
+    add_column(connection, Household.__table__, "address_key")
+    create_missing_indexes(connection, SQLModel.metadata)
+
+
+@migration(4, "Log every household, member, list and list link write for the change feed")
+def add_change_log(connection: Connection):
+    ChangeLog.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        create_change_triggers(connection)
+
+
+@migration(5, "Store household coordinates from a geocoding cache and index them in an R*Tree")
+def add_household_coordinates(connection: Connection):
+    for name in ("latitude", "longitude"):
+        add_column(connection, Household.__table__, name)
+    GeocodedAddress.__table__.create(connection, checkfirst=True)
+    # No household has coordinates yet, so the index starts empty
+    if connection.dialect.name == "sqlite":
+        create_spatial_triggers(connection)
+
+
+# Contacts moved before their member was recorded are matched to the member
+# with their details in the household they went to. Those no member matches
+# any more, having been edited or removed since, can't be served again.
+CONTACT_MEMBER_BACKFILL = """
+    UPDATE contact SET member_id = (
+        SELECT min(member.id) FROM member
+        WHERE member.household_id = contact.household_id
+          AND member.first_name = contact.first_name
+          AND member.last_name = contact.last_name
+          AND member.email IS NOT DISTINCT FROM contact.email
+          AND member.phone IS NOT DISTINCT FROM contact.phone
+    )
+    WHERE id >= :start AND id < :end AND household_id IS NOT NULL AND member_id IS NULL
+"""
+
+
+def backfill_contact_members(engine: Engine):
+    backfill_in_batches(engine, "contact", CONTACT_MEMBER_BACKFILL)
+
+
+@migration(6, "Record the member each legacy contact became", backfill=backfill_contact_members)
+def add_contact_member_id(connection: Connection):
+    add_column(connection, Contact.__table__, "member_id")
+    create_missing_indexes(connection, SQLModel.metadata)
+
+
+@migration(7, "Log updates only when a column the change feed sends changes")
+def narrow_change_update_triggers(connection: Connection):
+    if connection.dialect.name == "sqlite":
+        for table in SYNCED_MODELS:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_change_update"))
+        create_change_triggers(connection)
+        # Rewrote coordinates that hadn't changed
+        connection.execute(text("DROP TRIGGER IF EXISTS household_geocode_update"))
+        create_spatial_triggers(connection)
+
+
+@migration(8, "Version households, lists and contacts for their ETags")
+def add_row_versions(connection: Connection):
+    for model in (Household, List, Contact):
+        add_column(connection, model.__table__, "version")
+    if connection.dialect.name == "sqlite":
+        # The change feed leaves the version out, so updating it isn't logged
+        for table in ("household", "list"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_change_update"))
+        create_change_triggers(connection)
+        create_row_version_triggers(connection)
+
+
+# Running migrations
+
+
+def schema_version(connection: Connection) -> int | None:
+    """The database's schema version: None if it is empty, 0 if it predates migrations."""
+    tables = inspect(connection).get_table_names()
+    if not tables:
+        return None
+    if SchemaMigration.__tablename__ not in tables:
+        return 0
+    return connection.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+
+
+def record(connection: Connection, migrations: list[Migration]):
+    connection.execute(
+        insert(SchemaMigration),
+        [{"version": m.version, "description": m.description} for m in migrations],
+    )
+
+
+def create_schema(engine: Engine):
+    """Create an empty database's tables at the latest version."""
+    with engine.begin() as connection:
+        SQLModel.metadata.create_all(connection)
+        record(connection, MIGRATIONS)
+
+
+def upgrade(engine: Engine) -> list[int]:
+    """Apply the migrations the database is missing, in order, and return their versions."""
+    with engine.connect() as connection:
+        version = schema_version(connection)
+    if version is None:
+        create_schema(engine)
+        return []
+    if version > head():
+        raise SchemaVersionError(
+            f"The database schema is at version {version}, newer than this code ({head()})"
+        )
+
+    applied = []
+    for migration in MIGRATIONS[version:]:
+        logger.info("Applying migration %d: %s", migration.version, migration.description)
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+        if migration.backfill:
+            migration.backfill(engine)
+        with engine.begin() as connection:
+            record(connection, [migration])
+        applied.append(migration.version)
+    return applied
+
+
+def prepare_database(engine: Engine, migrate: bool = False):
+    """Make sure the database can be served: create it if empty, otherwise check its version.
+
+    An outdated database is upgraded if ``migrate`` is set; otherwise, or if
+    the database is newer than the code, ``SchemaVersionError`` is raised.
+    """
+    with engine.connect() as connection:
+        version = schema_version(connection)
+    if version is None:
+        create_schema(engine)
+    elif version < head() and migrate:
+        upgrade(engine)
+    elif version != head():
+        raise SchemaVersionError(
+            f"The database schema is at version {version} but this code needs {head()}. "
+            "Run `python -m app.migrations upgrade`, or set MIGRATE_ON_STARTUP=true."
+        )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Show or upgrade the database schema version.")
+    parser.add_argument("command", nargs="?", choices=["status", "upgrade"], default="status")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "upgrade":
+        applied = upgrade(engine)
+        print(f"✓ Applied migrations {applied}" if applied else "✓ Already up to date")
+        return 0
+
+    with engine.connect() as connection:
+        version = schema_version(connection)
+    print(f"Schema version {version or 0} of {head()}")
+    for m in MIGRATIONS:
+        print(f"{'✓' if version and m.version <= version else ' '} {m.version} {m.description}")
+    return 0 if version == head() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
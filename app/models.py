@@ -1,24 +1,56 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import event
 from sqlmodel import Field, Relationship, SQLModel
 
+from app.addresses import normalize_address
+
 
 # Link table for many-to-many relationship between List and Household
 class ListHouseholdLink(SQLModel, table=True):
-    list_id: int = Field(foreign_key="list.id", primary_key=True)
-    household_id: int = Field(foreign_key="household.id", primary_key=True)
+    list_id: int = Field(foreign_key="list.id", primary_key=True, ondelete="CASCADE")
+    # The primary key serves lookups by list; this index serves lookups by household
+    household_id: int = Field(
+        foreign_key="household.id", primary_key=True, ondelete="CASCADE", index=True
+    )
 
 
 # Household models
 class HouseholdBase(SQLModel):
-    name: str
-    address: str
+    name: str = Field(index=True)
+    address: str = Field(index=True)
+
+
+def household_address_key(context) -> str | None:
+    return normalize_address(context.get_current_parameters().get("address"))
 
 
 class Household(HouseholdBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    members: list["Member"] = Relationship(back_populates="household", cascade_delete=True)
+    # normalize_address(address), kept up to date on every insert and on ORM
+    # updates, so duplicate addresses are found through the index
+    address_key: str | None = Field(
+        default=None, index=True, sa_column_kwargs={"default": household_address_key}
+    )
+    # Taken from the geocoding cache by address_key (see app/spatial.py);
+    # None until the address has been geocoded
+    latitude: float | None = None
+    longitude: float | None = None
+    # Bumped by triggers when the household or one of its members changes,
+    # for its ETag (see app/etags.py)
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    members: list["Member"] = Relationship(
+        back_populates="household", cascade_delete=True, passive_deletes=True
+    )
     lists: list["List"] = Relationship(back_populates="households", link_model=ListHouseholdLink)
 
 
+@event.listens_for(Household, "before_insert")
+@event.listens_for(Household, "before_update")
+def update_address_key(mapper, connection, household: Household):
+    household.address_key = normalize_address(household.address)
+
+
 class HouseholdCreate(HouseholdBase):
     pass
 
@@ -31,14 +63,14 @@ class HouseholdUpdate(SQLModel):
 # Member models
 class MemberBase(SQLModel):
     first_name: str
-    last_name: str
+    last_name: str = Field(index=True)
     email: str | None = None
     phone: str | None = None
 
 
 class Member(MemberBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    household_id: int = Field(foreign_key="household.id")
+    household_id: int = Field(foreign_key="household.id", ondelete="CASCADE", index=True)
     household: Household = Relationship(back_populates="members")
 
 
@@ -62,12 +94,35 @@ class HouseholdWithMembersCreate(HouseholdBase):
     members: list[MemberBase]
 
 
+# Member in a full household update: with an ID it replaces that member,
+# without one it is added
+class MemberUpsert(MemberBase):
+    id: int | None = None
+
+
+# Household with its complete member set, replacing what is stored
+class HouseholdWithMembersUpdate(HouseholdBase):
+    members: list[MemberUpsert]
+
+
+# Bulk operations on households, by ID
+class BulkHouseholdsRequest(SQLModel):
+    household_ids: list[int]
+
+
 # Household read model with members included
 class HouseholdRead(HouseholdBase):
     id: int
+    latitude: float | None = None
+    longitude: float | None = None
     members: list[MemberRead] = []
 
 
+# Household found by a radius search, with its distance in miles
+class HouseholdNearby(HouseholdRead):
+    distance: float
+
+
 # List models
 class ListBase(SQLModel):
     name: str
@@ -76,6 +131,8 @@ class ListBase(SQLModel):
 
 class List(ListBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
+    # Bumped by triggers when the list or its households change, for its ETag
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     households: list[Household] = Relationship(back_populates="lists", link_model=ListHouseholdLink)
 
 
@@ -93,22 +150,27 @@ class ListRead(ListBase):
     household_count: int = 0
 
 
-class ListWithHouseholds(ListBase):
-    id: int
-    households: list[HouseholdRead] = []
-
-
-# Legacy Contact models (keeping for backwards compatibility during migration)
+# Contact models. /contacts serves members in this shape, through the contact
+# table, which maps contact IDs to the members the contacts became.
 class ContactBase(SQLModel):
     first_name: str
     last_name: str
-    email: str | None = None
+    email: str | None = Field(default=None, index=True)
     phone: str | None = None
     address: str | None = None
 
 
 class Contact(ContactBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
+    # Set by the contact migration job: the normalized address the contact
+    # was grouped by, and the household and member it was moved into. Once
+    # set, the member is read and written instead of the fields above, which
+    # contacts created through /contacts leave empty.
+    address_key: str | None = Field(default=None, index=True)
+    household_id: int | None = None
+    member_id: int | None = Field(default=None, index=True)
+    # Bumped by triggers when the row changes, for its ETag
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class ContactCreate(ContactBase):
@@ -121,3 +183,57 @@ class ContactUpdate(SQLModel):
     email: str | None = None
     phone: str | None = None
     address: str | None = None
+
+
+class ContactRead(ContactBase):
+    id: int
+
+
+# Write counter per table, bumped by triggers on every insert, update and delete
+class TableVersion(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    version: int = 0
+
+
+# Every insert, update and delete of a synced table, numbered in commit
+# order by triggers, see app/changes.py
+class ChangeLog(SQLModel, table=True):
+    # Sequence numbers are never reused, even after entries are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: int | None = Field(default=None, primary_key=True)
+    table_name: str
+    row_id: int
+    # For a list link, row_id is the list and this is the household
+    household_id: int | None = None
+    deleted: bool = False
+
+
+# Progress of a resumable batch job: the last row done and running totals
+class JobCheckpoint(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    last_id: int = 0
+    processed: int = 0
+    households: int = 0
+    seconds: float = 0.0
+    started_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: datetime | None = None
+
+
+# Geocoder results by normalized address, see app/geocoding.py. An address
+# the geocoder couldn't place is kept without coordinates, so it isn't looked
+# up again.
+class GeocodedAddress(SQLModel, table=True):
+    address_key: str = Field(primary_key=True)
+    latitude: float | None = None
+    longitude: float | None = None
+    geocoder: str
+    geocoded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+# Schema migrations applied to the database, see app/migrations.py
+class SchemaMigration(SQLModel, table=True):
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import Engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session
+
+from app import contact_migration, geocoding
+from app.contact_migration import ContactMigrationStatus
+from app.database import create_db_engine, db_endpoint, get_session, run_in_session
+from app.geocoding import GeocodingStatus
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def job_engine(session: Session) -> Engine:
+    """A sync engine on the session's database, for jobs run on their own thread."""
+    bind = session.get_bind()
+    if not bind.dialect.is_async:
+        return bind
+    # The async driver can only be used from the event loop
+    url = bind.url.set(drivername=bind.url.get_backend_name())
+    return create_db_engine(url, poolclass=NullPool)
+
+
+@router.post("/contact-migration", response_model=ContactMigrationStatus, status_code=202)
+async def start_contact_migration(response: Response, session: Session = Depends(get_session)):
+    """Start moving legacy contacts into households in the background.
+
+    A run that was interrupted resumes from its last checkpoint. Answers 409
+    if the job is already running.
+    """
+    engine = await run_in_session(session, job_engine)
+    # Read before starting, so the job's first batch doesn't wait on this request
+    status = await run_in_session(session, contact_migration.migration_status)
+    if not contact_migration.start_in_background(engine):
+        response.status_code = 409
+    status.running = True
+    return status
+
+
+@router.get("/contact-migration", response_model=ContactMigrationStatus)
+@db_endpoint
+def get_contact_migration(session: Session = Depends(get_session)):
+    """Progress and throughput of the contact migration job."""
+    return contact_migration.migration_status(session)
+
+
+@router.post("/geocoding", response_model=GeocodingStatus, status_code=202)
+async def start_geocoding(response: Response, session: Session = Depends(get_session)):
+    """Start geocoding the addresses of households without coordinates in the background.
+
+    Answers 409 if the job is already running, and 503 if no geocoder is
+    configured.
+    """
+    geocoder = geocoding.configured_geocoder()
+    if geocoder is None:
+        raise HTTPException(status_code=503, detail="No geocoder is configured")
+    engine = await run_in_session(session, job_engine)
+    status = await run_in_session(session, geocoding.geocoding_status)
+    if not geocoding.start_in_background(engine, geocoder):
+        response.status_code = 409
+    status.running = True
+    return status
+
+
+@router.get("/geocoding", response_model=GeocodingStatus)
+@db_endpoint
+def get_geocoding(session: Session = Depends(get_session)):
+    """How many households have coordinates, and how many addresses are cached."""
+    return geocoding.geocoding_status(session)
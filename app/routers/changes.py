@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session
+
+from app.changes import ChangeFeed, oldest_seq, read_changes
+from app.database import db_endpoint, get_session
+
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 5000
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+
+@router.get("", response_model=ChangeFeed)
+@db_endpoint
+def get_changes(
+    since: int = Query(default=0, ge=0, description="Sequence number already applied"),
+    limit: int = Query(default=DEFAULT_CHANGES_LIMIT, ge=1, le=MAX_CHANGES_LIMIT),
+    session: Session = Depends(get_session),
+):
+    """Changes to households, members, lists and list links after ``since``.
+
+    Each row appears once, as an upsert with its current columns or as a
+    tombstone. Pass ``next`` back as ``since`` while ``more`` is true. A
+    ``since`` older than the oldest entry kept is refused with 410 Gone, and
+    the client must reload in full.
+    """
+    if session.get_bind().dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="The change feed needs SQLite")
+    oldest = oldest_seq(session)
+    if oldest is not None and since < oldest - 1:
+        raise HTTPException(status_code=410, detail="Changes since this point have been pruned")
+    return read_changes(session, since, limit)
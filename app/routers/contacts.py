@@ -1,57 +1,243 @@
-from fastapi import APIRouter, Depends, HTTPException
+"""Contacts, in the shape of the old contacts API, backed by households and members.
+
+A contact's ID is its row in the legacy contact table, which keeps legacy
+IDs meaning the same person. Once the contact migration job has moved a
+contact into a household, it is read and written through the member it
+became, with its household's address; until then it is served from its
+own row. Creating a contact creates a household of one, and a contact row
+that only maps the new ID to its member: the member holds the details.
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import and_, case, func, or_
 from sqlmodel import Session, select
 
-from app.database import get_session
-from app.models import Contact, ContactCreate, ContactUpdate
+from app.cache import LISTS_KEY, cached, contact_key, household_key, invalidates
+from app.contact_migration import household_name
+from app.database import db_endpoint, get_session
+from app.etags import check_if_match, check_not_modified, make_etag, make_row_etag
+from app.events import publishes
+from app.models import Contact, ContactCreate, ContactRead, ContactUpdate, Household, Member
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
 router = APIRouter(prefix="/contacts", tags=["contacts"])
 
+# Tables every contact is read from
+CONTACT_TABLES = ["contact", "household", "member"]
+
+
+def moved_or_legacy(moved, legacy):
+    """A contact field: from its member once it has one, from its own row until then."""
+    return case((Contact.member_id.is_(None), legacy), else_=moved)
+
+
+CONTACT_COLUMNS = (
+    Contact.id,
+    moved_or_legacy(Member.first_name, Contact.first_name).label("first_name"),
+    moved_or_legacy(Member.last_name, Contact.last_name).label("last_name"),
+    moved_or_legacy(Member.email, Contact.email).label("email"),
+    moved_or_legacy(Member.phone, Contact.phone).label("phone"),
+    # Households without an address store an empty one
+    moved_or_legacy(func.nullif(Household.address, ""), Contact.address).label("address"),
+)
+
+
+def contact_statement():
+    return (
+        select(*CONTACT_COLUMNS)
+        .select_from(Contact)
+        .outerjoin(Member, Member.id == Contact.member_id)
+        .outerjoin(Household, Household.id == Member.household_id)
+        # Contacts not moved yet, and moved ones whose member still exists
+        .where(
+            or_(
+                and_(Contact.household_id.is_(None), Contact.member_id.is_(None)),
+                Member.id.is_not(None),
+            )
+        )
+    )
+
+
+def contact_etag(session: Session, contact_id: int) -> str | None:
+    """From the contact's row and, once it has been moved, its member's household."""
+    statement = (
+        contact_statement()
+        .with_only_columns(
+            Contact.version, func.coalesce(Household.version, 0), maintain_column_froms=True
+        )
+        .where(Contact.id == contact_id)
+    )
+    return make_row_etag(session, f"contact-{contact_id}", statement)
+
+
+def load_contact(session: Session, contact_id: int) -> dict | None:
+    row = session.exec(contact_statement().where(Contact.id == contact_id)).first()
+    return dict(row._mapping) if row else None
+
+
+def find_contact(session: Session, contact_id: int) -> tuple[Contact, Member | None]:
+    """The contact's row, and the member it became if it has been moved into a household."""
+    contact = session.get(Contact, contact_id)
+    if contact is None:
+        raise HTTPException(status_code=404, detail="Contact not found")
+    if contact.household_id is None:
+        return contact, None
+    member = session.get(Member, contact.member_id) if contact.member_id else None
+    if member is None:
+        raise HTTPException(status_code=404, detail="Contact not found")
+    return contact, member
+
 
-@router.post("/", response_model=Contact)
+def invalidated_keys(request: Request, **_) -> list[str]:
+    """The cache keys the handler recorded as affected."""
+    return request.state.cache_keys
+
+
+@router.post("/", response_model=ContactRead)
+@publishes("household")
+@db_endpoint
 def create_contact(contact: ContactCreate, session: Session = Depends(get_session)):
-    db_contact = Contact.model_validate(contact)
-    session.add(db_contact)
+    """Create a contact as the only member of a new household."""
+    household = Household(
+        name=household_name([contact.last_name]), address=(contact.address or "").strip()
+    )
+    session.add(household)
+    session.flush()
+    member = Member(household_id=household.id, **contact.model_dump(exclude={"address"}))
+    session.add(member)
+    session.flush()
+    # The legacy columns can't be null; the member is read instead of them
+    row = Contact(first_name="", last_name="", household_id=household.id, member_id=member.id)
+    session.add(row)
     session.commit()
-    session.refresh(db_contact)
-    return db_contact
+    return load_contact(session, row.id)
+
+
+@router.get("/", response_model=list[ContactRead])
+@db_endpoint
+def list_contacts(
+    request: Request,
+    response: Response,
+    after: int | None = Query(default=None, description="ID of the last contact already seen"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """List one page of contacts, ordered by ID.
 
+    When more contacts follow, the cursor for the next page is returned in
+    the ``X-Next-Cursor`` header.
+    """
+    etag = make_etag(session, "contacts", CONTACT_TABLES)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
 
-@router.get("/", response_model=list[Contact])
-def list_contacts(session: Session = Depends(get_session)):
-    contacts = session.exec(select(Contact)).all()
+    statement = contact_statement().order_by(Contact.id).limit(limit + 1)
+    if after is not None:
+        statement = statement.where(Contact.id > after)
+    contacts = [dict(row._mapping) for row in session.exec(statement)]
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        response.headers["X-Next-Cursor"] = str(contacts[-1]["id"])
     return contacts
 
 
-@router.get("/{contact_id}", response_model=Contact)
-def get_contact(contact_id: int, session: Session = Depends(get_session)):
-    contact = session.get(Contact, contact_id)
+@router.get("/{contact_id}", response_model=ContactRead)
+# Member and household writes change the contact's ETag, so they refresh its entry too
+@cached(
+    lambda contact_id, **_: contact_key(contact_id),
+    ContactRead,
+    etag=lambda session, contact_id, **_: contact_etag(session, contact_id),
+)
+@db_endpoint
+def get_contact(
+    contact_id: int, request: Request, response: Response, session: Session = Depends(get_session)
+):
+    etag = contact_etag(session, contact_id)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    contact = load_contact(session, contact_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
     return contact
 
 
-@router.patch("/{contact_id}", response_model=Contact)
+@router.patch("/{contact_id}", response_model=ContactRead)
+@publishes("household")
+@invalidates(invalidated_keys)
+@db_endpoint
 def update_contact(
-    contact_id: int, contact_update: ContactUpdate, session: Session = Depends(get_session)
+    contact_id: int,
+    contact_update: ContactUpdate,
+    request: Request,
+    session: Session = Depends(get_session),
 ):
-    contact = session.get(Contact, contact_id)
-    if not contact:
-        raise HTTPException(status_code=404, detail="Contact not found")
+    """Update a contact.
 
+    A new address is the household's address. If others live in the
+    household, the contact moves to a new household at that address instead.
+    """
+    contact, member = find_contact(session, contact_id)
+    check_if_match(request, contact_etag(session, contact_id))
     contact_data = contact_update.model_dump(exclude_unset=True)
-    contact.sqlmodel_update(contact_data)
-    session.add(contact)
+    if member is None:
+        # Not moved yet: the migration job will take the updated row
+        request.state.cache_keys = [contact_key(contact_id)]
+        contact.sqlmodel_update(contact_data)
+        session.add(contact)
+        session.commit()
+        return load_contact(session, contact_id)
+
+    request.state.cache_keys = [contact_key(contact_id), household_key(member.household_id)]
+    if "address" in contact_data:
+        address = (contact_data.pop("address") or "").strip()
+        household = session.get(Household, member.household_id)
+        alone = session.exec(
+            select(func.count()).select_from(Member).where(Member.household_id == household.id)
+        ).one() == 1
+        if alone:
+            household.address = address
+            session.add(household)
+        elif address != household.address:
+            last_name = contact_data.get("last_name", member.last_name)
+            moved_to = Household(name=household_name([last_name]), address=address)
+            session.add(moved_to)
+            session.flush()
+            member.household_id = moved_to.id
+            contact.household_id = moved_to.id
+            session.add(contact)
+    member.sqlmodel_update(contact_data)
+    session.add(member)
     session.commit()
-    session.refresh(contact)
-    return contact
+    return load_contact(session, contact_id)
 
 
 @router.delete("/{contact_id}")
-def delete_contact(contact_id: int, session: Session = Depends(get_session)):
-    contact = session.get(Contact, contact_id)
-    if not contact:
-        raise HTTPException(status_code=404, detail="Contact not found")
-
+@publishes("household")
+@invalidates(invalidated_keys)
+@db_endpoint
+def delete_contact(contact_id: int, request: Request, session: Session = Depends(get_session)):
+    """Delete a contact, and its household if nobody else is left in it."""
+    contact, member = find_contact(session, contact_id)
+    check_if_match(request, contact_etag(session, contact_id))
     session.delete(contact)
+    if member is None:
+        request.state.cache_keys = [contact_key(contact_id)]
+        session.commit()
+        return {"message": "Contact deleted successfully"}
+
+    request.state.cache_keys = [contact_key(contact_id), household_key(member.household_id)]
+    household_id = member.household_id
+    session.delete(member)
+    session.flush()
+    others = session.exec(
+        select(func.count()).select_from(Member).where(Member.household_id == household_id)
+    ).one()
+    if not others:
+        session.delete(session.get(Household, household_id))
+        # List pages count their households
+        request.state.cache_keys.append(LISTS_KEY)
     session.commit()
     return {"message": "Contact deleted successfully"}
@@ -1,32 +1,119 @@
-from fastapi import APIRouter, Depends, HTTPException
+from itertools import batched
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
 
-from app.database import get_session
+from app.cache import LISTS_KEY, cached, household_key, invalidates
+from app.database import db_endpoint, get_session, run_in_session
+from app.duplicates import (
+    DEFAULT_THRESHOLD,
+    DUPLICATE_HOUSEHOLDS,
+    DuplicateCheck,
+    DuplicateGroup,
+    find_address_duplicates,
+    find_duplicates,
+)
+from app.etags import check_if_match, check_not_modified, make_etag, make_row_etag
+from app.events import publishes
+from app.export import ExportFormat, export_response, export_statement
+from app.importer import HouseholdImporter, ImportFormat, ImportReport, iter_lines
+from app.search import search_household_ids
+from app.spatial import find_in_box, find_near
+from app.serialization import FAST_JSON, HOUSEHOLD_COLUMNS, household_dicts, json_response
 from app.models import (
+    BulkHouseholdsRequest,
     Household,
     HouseholdCreate,
+    HouseholdNearby,
     HouseholdRead,
     HouseholdUpdate,
     HouseholdWithMembersCreate,
+    HouseholdWithMembersUpdate,
     Member,
     MemberBase,
     MemberCreate,
     MemberUpdate,
 )
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Miles; larger circles are better served as bounding boxes
+MAX_RADIUS = 250
+
+# Bulk operations touch this many IDs per statement, which keeps each one
+# well under SQLite's bound-parameter limit.
+BULK_CHUNK_SIZE = 500
+
 router = APIRouter(prefix="/households", tags=["households"])
 
 
+# Tables every household representation is read from
+HOUSEHOLD_TABLES = ["household", "member"]
+
+
+def household_etag(session: Session, household_id: int) -> str | None:
+    return make_row_etag(
+        session,
+        f"household-{household_id}",
+        select(Household.version).where(Household.id == household_id),
+    )
+
+
+def load_household(session: Session, household_id: int) -> Household | None:
+    """Fetch a household with its members loaded, ready to serialize."""
+    return session.get(
+        Household,
+        household_id,
+        options=[selectinload(Household.members)],
+        populate_existing=True,
+    )
+
+
 @router.post("/", response_model=HouseholdRead)
+@publishes("household", lambda result, **_: [result.id])
+@db_endpoint
 def create_household(
-    household_data: HouseholdWithMembersCreate, session: Session = Depends(get_session)
+    household_data: HouseholdWithMembersCreate,
+    response: Response,
+    duplicates: DuplicateCheck | None = Query(
+        default=None, description="What to do when the address is taken (DUPLICATE_HOUSEHOLDS)"
+    ),
+    session: Session = Depends(get_session),
 ):
-    """Create a household with members in a single transaction."""
+    """Create a household with members in a single transaction.
+
+    Depending on ``duplicates``, a household whose address normalizes the
+    same as an existing one is created anyway (``allow``), created with the
+    existing IDs in the ``X-Duplicate-Of`` header (``flag``), or refused with
+    409 Conflict (``reject``). The household is inserted before duplicates
+    are looked for, so on SQLite the lookup holds the write lock and a
+    concurrent request for the same address sees this one. Other databases
+    don't serialize the two, and both can be created.
+    """
     # Create the household
     household = Household(name=household_data.name, address=household_data.address)
     session.add(household)
     session.flush()  # Flush to get the household ID
 
+    duplicates = duplicates or DUPLICATE_HOUSEHOLDS
+    if duplicates != "allow" and (
+        duplicate_ids := find_address_duplicates(
+            session, household_data.address, exclude=household.id
+        )
+    ):
+        duplicate_of = ", ".join(str(household_id) for household_id in duplicate_ids)
+        if duplicates == "reject":
+            session.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="A household with this address already exists",
+                headers={"X-Duplicate-Of": duplicate_of},
+            )
+        response.headers["X-Duplicate-Of"] = duplicate_of
+
     # Create all members
     for member_data in household_data.members:
         if member_data.first_name or member_data.last_name:  # Skip empty members
@@ -39,59 +126,366 @@ def create_household(
             )
             session.add(member)
 
+    household_id = household.id
     session.commit()
-    session.refresh(household)
-    return household
+    return load_household(session, household_id)
 
 
 @router.get("/", response_model=list[HouseholdRead])
-def list_households(session: Session = Depends(get_session)):
-    """List all households with their members."""
-    households = session.exec(select(Household)).all()
+@db_endpoint
+def list_households(
+    request: Request,
+    response: Response,
+    after: int | None = Query(default=None, description="ID of the last household already seen"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """List one page of households with their members, ordered by ID.
+
+    When more households follow, the cursor for the next page is returned in
+    the ``X-Next-Cursor`` header. Members for the whole page are loaded with a
+    single extra query.
+    """
+    etag = make_etag(session, "households", HOUSEHOLD_TABLES)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    if FAST_JSON:
+        statement = select(*HOUSEHOLD_COLUMNS)
+    else:
+        statement = select(Household).options(selectinload(Household.members))
+    # Fetch one extra row to know whether another page exists
+    statement = statement.order_by(Household.id).limit(limit + 1)
+    if after is not None:
+        statement = statement.where(Household.id > after)
+
+    households = session.exec(statement).all()
+    if len(households) > limit:
+        households = households[:limit]
+        response.headers["X-Next-Cursor"] = str(households[-1].id)
+    if FAST_JSON:
+        return json_response(household_dicts(session, households), response)
     return households
 
 
+@router.get("/search", response_model=list[HouseholdRead])
+@db_endpoint
+def search_households(
+    request: Request,
+    response: Response,
+    q: str = Query(min_length=1, description="Words to match against names, addresses and members"),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """Search households by name, address and member details, best match first.
+
+    Every word in ``q`` must match the start of a word somewhere in the
+    household. When more results follow, the offset of the next page is
+    returned in the ``X-Next-Offset`` header.
+    """
+    etag = make_etag(session, "household-search", HOUSEHOLD_TABLES)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    household_ids = search_household_ids(session, q, limit=limit + 1, offset=offset)
+    if len(household_ids) > limit:
+        household_ids = household_ids[:limit]
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    if not household_ids:
+        return []
+
+    if FAST_JSON:
+        statement = select(*HOUSEHOLD_COLUMNS)
+    else:
+        statement = select(Household).options(selectinload(Household.members))
+    households = session.exec(statement.where(Household.id.in_(household_ids))).all()
+    by_id = {household.id: household for household in households}
+    households = [by_id[household_id] for household_id in household_ids if household_id in by_id]
+    if FAST_JSON:
+        return json_response(household_dicts(session, households), response)
+    return households
+
+
+def require_spatial_index(session: Session):
+    if session.get_bind().dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Spatial queries need SQLite")
+
+
+def load_households(session: Session, household_ids: list[int]) -> list[Household]:
+    """Fetch households with their members loaded, in the order of ``household_ids``."""
+    households = session.exec(
+        select(Household)
+        .options(selectinload(Household.members))
+        .where(Household.id.in_(household_ids))
+    ).all()
+    by_id = {household.id: household for household in households}
+    return [by_id[household_id] for household_id in household_ids if household_id in by_id]
+
+
+@router.get("/near", response_model=list[HouseholdNearby])
+@db_endpoint
+def find_households_near(
+    request: Request,
+    response: Response,
+    lat: float = Query(ge=-90, le=90),
+    lng: float = Query(ge=-180, le=180),
+    radius: float = Query(gt=0, le=MAX_RADIUS, description="Miles"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """Households within ``radius`` miles of a point, nearest first, with their distance.
+
+    Only households whose address has been geocoded have coordinates.
+    """
+    require_spatial_index(session)
+    etag = make_etag(session, "households-near", HOUSEHOLD_TABLES)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    nearby = dict(find_near(session, lat, lng, radius, limit))
+    return [
+        HouseholdNearby.model_validate(
+            household, update={"distance": round(nearby[household.id], 3)}
+        )
+        for household in load_households(session, list(nearby))
+    ]
+
+
+@router.get("/within", response_model=list[HouseholdRead])
+@db_endpoint
+def find_households_within(
+    request: Request,
+    response: Response,
+    south: float = Query(ge=-90, le=90),
+    west: float = Query(ge=-180, le=180),
+    north: float = Query(ge=-90, le=90),
+    east: float = Query(ge=-180, le=180, description="Less than west to cross the antimeridian"),
+    after: int | None = Query(default=None, description="ID of the last household already seen"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """Households inside a bounding box, ordered by ID.
+
+    When more households follow, the cursor for the next page is returned in
+    the ``X-Next-Cursor`` header.
+    """
+    if south > north:
+        raise HTTPException(status_code=422, detail="south must not be north of north")
+    require_spatial_index(session)
+    etag = make_etag(session, "households-within", HOUSEHOLD_TABLES)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    household_ids = find_in_box(session, south, west, north, east, after, limit + 1)
+    if len(household_ids) > limit:
+        household_ids = household_ids[:limit]
+        response.headers["X-Next-Cursor"] = str(household_ids[-1])
+    return load_households(session, household_ids)
+
+
+@router.get("/duplicates", response_model=list[DuplicateGroup])
+@db_endpoint
+def find_duplicate_households(
+    request: Request,
+    response: Response,
+    threshold: float = Query(
+        default=DEFAULT_THRESHOLD,
+        gt=0,
+        le=1,
+        description="Similarity at which distinct addresses count as the same; 1 for exact only",
+    ),
+    after: str | None = Query(default=None, description="Cursor from X-Next-Cursor"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """List groups of households whose addresses are the same or nearly so.
+
+    When more groups follow, the cursor for the next page is returned in the
+    ``X-Next-Cursor`` header.
+    """
+    etag = make_etag(session, "household-duplicates", ["household"])
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    groups, cursor = find_duplicates(session, threshold, after, limit)
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+    return groups
+
+
+@router.post("/import", response_model=ImportReport)
+@publishes("household")
+async def import_households(
+    request: Request, format: ImportFormat = "ndjson", session: Session = Depends(get_session)
+):
+    """Import households from an NDJSON or CSV request body.
+
+    The body is read as it arrives and inserted in batches, each committed on
+    its own. Rows that fail validation are skipped and listed in the report.
+    """
+    importer = HouseholdImporter(format)
+    async for lines in iter_lines(request.stream()):
+        importer.feed(lines)
+        if importer.ready:
+            await run_in_session(session, importer.flush)
+    return await run_in_session(session, importer.finish)
+
+
+@router.get("/export")
+async def export_households(
+    format: ExportFormat = "ndjson", session: Session = Depends(get_session)
+):
+    """Stream every household and its members as NDJSON or CSV."""
+    return export_response(session, export_statement(), format, filename="households")
+
+
 @router.get("/{household_id}", response_model=HouseholdRead)
-def get_household(household_id: int, session: Session = Depends(get_session)):
+@cached(
+    lambda household_id, **_: household_key(household_id),
+    HouseholdRead,
+    etag=lambda session, household_id, **_: household_etag(session, household_id),
+)
+@db_endpoint
+def get_household(
+    household_id: int, request: Request, response: Response, session: Session = Depends(get_session)
+):
     """Get a single household with its members."""
-    household = session.get(Household, household_id)
+    etag = household_etag(session, household_id)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    household = load_household(session, household_id)
     if not household:
         raise HTTPException(status_code=404, detail="Household not found")
     return household
 
 
 @router.patch("/{household_id}", response_model=HouseholdRead)
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id)])
+@db_endpoint
 def update_household(
     household_id: int,
     household_update: HouseholdUpdate,
+    request: Request,
+    response: Response,
     session: Session = Depends(get_session),
 ):
     """Update household details (name, address)."""
     household = session.get(Household, household_id)
     if not household:
         raise HTTPException(status_code=404, detail="Household not found")
+    check_if_match(request, household_etag(session, household_id))
 
     household_data = household_update.model_dump(exclude_unset=True)
     household.sqlmodel_update(household_data)
     session.add(household)
     session.commit()
-    session.refresh(household)
-    return household
+    if etag := household_etag(session, household_id):
+        response.headers["ETag"] = etag
+    return load_household(session, household_id)
+
+
+@router.put("/{household_id}/full", response_model=HouseholdRead)
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id)])
+@db_endpoint
+def replace_household(
+    household_id: int,
+    household_data: HouseholdWithMembersUpdate,
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session),
+):
+    """Replace a household and its complete member set in one transaction.
+
+    Members with an ``id`` are updated, members without one are added, and
+    stored members left out of the request are removed. Only the members that
+    actually changed are written, with one statement per kind of change.
+    """
+    household = session.get(Household, household_id)
+    if not household:
+        raise HTTPException(status_code=404, detail="Household not found")
+    check_if_match(request, household_etag(session, household_id))
+
+    rows = session.exec(
+        select(Member.id, Member.first_name, Member.last_name, Member.email, Member.phone)
+        .where(Member.household_id == household_id)
+    ).all()
+    stored = {row.id: row._asdict() for row in rows}
+
+    added, changed, kept = [], [], set()
+    for member_data in household_data.members:
+        if not (member_data.first_name or member_data.last_name):  # Skip empty members
+            continue
+        if member_data.id is None:
+            added.append({"household_id": household_id, **member_data.model_dump(exclude={"id"})})
+            continue
+        if member_data.id not in stored:
+            raise HTTPException(status_code=404, detail="Member not found in this household")
+        kept.add(member_data.id)
+        values = member_data.model_dump()
+        if values != stored[member_data.id]:
+            changed.append(values)
+    removed = [member_id for member_id in stored if member_id not in kept]
+
+    household.sqlmodel_update(household_data.model_dump(include={"name", "address"}))
+    session.add(household)
+    if changed:
+        session.exec(update(Member), params=changed)
+    if added:
+        session.exec(insert(Member), params=added)
+    for chunk in batched(removed, BULK_CHUNK_SIZE):
+        session.exec(delete(Member).where(Member.id.in_(chunk)))
+
+    session.commit()
+    if etag := household_etag(session, household_id):
+        response.headers["ETag"] = etag
+    return load_household(session, household_id)
 
 
 @router.delete("/{household_id}")
-def delete_household(household_id: int, session: Session = Depends(get_session)):
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id), LISTS_KEY])
+@db_endpoint
+def delete_household(
+    household_id: int, request: Request, session: Session = Depends(get_session)
+):
     """Delete a household and all its members."""
     household = session.get(Household, household_id)
     if not household:
         raise HTTPException(status_code=404, detail="Household not found")
+    check_if_match(request, household_etag(session, household_id))
 
     session.delete(household)
     session.commit()
     return {"message": "Household deleted successfully"}
 
 
+@router.post("/bulk-delete")
+@publishes("household", lambda request, **_: request.household_ids)
+@invalidates(lambda request, **_: [*map(household_key, request.household_ids), LISTS_KEY])
+@db_endpoint
+def delete_households(request: BulkHouseholdsRequest, session: Session = Depends(get_session)):
+    """Delete multiple households in one transaction.
+
+    Members and list memberships are removed by the database's ``ON DELETE
+    CASCADE`` foreign keys.
+    """
+    deleted_count = 0
+    for chunk in batched(set(request.household_ids), BULK_CHUNK_SIZE):
+        result = session.exec(delete(Household).where(Household.id.in_(chunk)))
+        deleted_count += result.rowcount
+
+    session.commit()
+    return {"message": f"Deleted {deleted_count} households", "deleted": deleted_count}
+
+
 @router.post("/{household_id}/members", response_model=Member)
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id)])
+@db_endpoint
 def add_member(
     household_id: int, member_data: MemberBase, session: Session = Depends(get_session)
 ):
@@ -114,18 +508,26 @@ def add_member(
 
 
 @router.patch("/{household_id}/members/{member_id}", response_model=Member)
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id)])
+@db_endpoint
 def update_member(
     household_id: int,
     member_id: int,
     member_update: MemberUpdate,
+    request: Request,
     session: Session = Depends(get_session),
 ):
-    """Update a member's details."""
+    """Update a member's details.
+
+    ``If-Match`` is checked against the ETag of the member's household.
+    """
     member = session.get(Member, member_id)
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     if member.household_id != household_id:
         raise HTTPException(status_code=404, detail="Member not found in this household")
+    check_if_match(request, household_etag(session, household_id))
 
     member_data = member_update.model_dump(exclude_unset=True)
     member.sqlmodel_update(member_data)
@@ -136,15 +538,22 @@ def update_member(
 
 
 @router.delete("/{household_id}/members/{member_id}")
+@publishes("household", lambda household_id, **_: [household_id])
+@invalidates(lambda household_id, **_: [household_key(household_id)])
+@db_endpoint
 def remove_member(
-    household_id: int, member_id: int, session: Session = Depends(get_session)
+    household_id: int, member_id: int, request: Request, session: Session = Depends(get_session)
 ):
-    """Remove a member from a household."""
+    """Remove a member from a household.
+
+    ``If-Match`` is checked against the ETag of the member's household.
+    """
     member = session.get(Member, member_id)
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     if member.household_id != household_id:
         raise HTTPException(status_code=404, detail="Member not found in this household")
+    check_if_match(request, household_etag(session, household_id))
 
     session.delete(member)
     session.commit()
@@ -1,27 +1,100 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from sqlmodel import Session, select
+import base64
+import json
+from itertools import batched
+from typing import Literal
 
-from app.database import get_session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel
+from sqlalchemy import and_, delete, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, func, select
+
+from app.cache import LISTS_KEY, cached, invalidates
+from app.database import db_endpoint, get_session, run_in_session
+from app.etags import check_if_match, check_not_modified, make_etag, make_row_etag
+from app.events import publishes
+from app.export import ExportFormat, export_response, export_statement
+from app.search import household_match_ids
+from app.serialization import FAST_JSON, HOUSEHOLD_COLUMNS, household_dicts, json_response
 from app.models import (
+    BulkHouseholdsRequest,
     Household,
+    HouseholdRead,
     List,
     ListCreate,
     ListHouseholdLink,
     ListRead,
     ListUpdate,
-    ListWithHouseholds,
 )
 
 
-class BulkHouseholdsRequest(BaseModel):
-    household_ids: list[int]
+class BulkHouseholdsResult(BaseModel):
+    message: str
+    added: list[int]
+    already_present: list[int]
+    unknown: list[int]
+
+
+# IDs are looked up and inserted this many at a time, which keeps each
+# statement well under SQLite's bound-parameter limit.
+BULK_CHUNK_SIZE = 500
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+HouseholdSort = Literal["id", "name", "address"]
+SORT_COLUMNS = {"id": Household.id, "name": Household.name, "address": Household.address}
+
+
+# Tables the list summaries are read from
+LIST_TABLES = ["list", "listhouseholdlink"]
 
+# A page of a list's households also reads the households and their members
+LIST_HOUSEHOLD_TABLES = LIST_TABLES + ["household", "member"]
 
 router = APIRouter(prefix="/lists", tags=["lists"])
 
 
+def lists_etag(session: Session) -> str | None:
+    return make_etag(session, "lists", LIST_TABLES)
+
+
+def list_etag(session: Session, list_id: int) -> str | None:
+    return make_row_etag(session, f"list-{list_id}", select(List.version).where(List.id == list_id))
+
+
+def encode_cursor(sort: HouseholdSort, household) -> str:
+    """Encode the sort key of the last household on a page as an opaque cursor."""
+    if sort == "id":
+        return str(household.id)
+    key = json.dumps([getattr(household, sort), household.id])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(sort: HouseholdSort, cursor: str) -> tuple:
+    try:
+        if sort == "id":
+            return (int(cursor),)
+        value, household_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return (str(value), int(household_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+def count_households(session: Session, list_id: int) -> int:
+    """Count the households on a list without loading them."""
+    return session.exec(
+        select(func.count())
+        .select_from(ListHouseholdLink)
+        .where(ListHouseholdLink.list_id == list_id)
+    ).one()
+
+
 @router.post("/", response_model=ListRead)
+@publishes("list", lambda result, **_: [result.id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
 def create_list(list_data: ListCreate, session: Session = Depends(get_session)):
     """Create a new list."""
     new_list = List.model_validate(list_data)
@@ -39,43 +112,142 @@ def create_list(list_data: ListCreate, session: Session = Depends(get_session)):
 
 
 @router.get("/", response_model=list[ListRead])
-def list_lists(session: Session = Depends(get_session)):
+@cached(LISTS_KEY, list[ListRead], etag=lambda session, **_: lists_etag(session))
+@db_endpoint
+def list_lists(request: Request, response: Response, session: Session = Depends(get_session)):
     """Get all lists with household counts."""
-    lists = session.exec(select(List)).all()
-
-    result = []
-    for lst in lists:
-        household_count = len(lst.households)
-        result.append(
-            ListRead(
-                id=lst.id,
-                name=lst.name,
-                description=lst.description,
-                household_count=household_count,
-            )
+    etag = lists_etag(session)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
+
+    rows = session.exec(
+        select(List, func.count(ListHouseholdLink.household_id))
+        .outerjoin(ListHouseholdLink, ListHouseholdLink.list_id == List.id)
+        .group_by(List.id)
+        .order_by(List.id)
+    ).all()
+
+    return [
+        ListRead(
+            id=lst.id,
+            name=lst.name,
+            description=lst.description,
+            household_count=household_count,
         )
+        for lst, household_count in rows
+    ]
 
-    return result
 
+@router.get("/{list_id}", response_model=ListRead)
+@db_endpoint
+def get_list(
+    list_id: int, request: Request, response: Response, session: Session = Depends(get_session)
+):
+    """Get a single list with its household count.
+
+    The households themselves are paged through ``GET /lists/{id}/households``.
+    """
+    etag = list_etag(session, list_id)
+    if not_modified := check_not_modified(request, response, etag):
+        return not_modified
 
-@router.get("/{list_id}", response_model=ListWithHouseholds)
-def get_list(list_id: int, session: Session = Depends(get_session)):
-    """Get a single list with all its households."""
     lst = session.get(List, list_id)
     if not lst:
         raise HTTPException(status_code=404, detail="List not found")
 
-    return lst
+    return ListRead(
+        id=lst.id,
+        name=lst.name,
+        description=lst.description,
+        household_count=count_households(session, list_id),
+    )
+
+
+@router.get("/{list_id}/households", response_model=list[HouseholdRead])
+@db_endpoint
+def list_households_in_list(
+    list_id: int,
+    request: Request,
+    response: Response,
+    q: str | None = Query(default=None, description="Words to match against households"),
+    sort: HouseholdSort = "id",
+    order: Literal["asc", "desc"] = "asc",
+    after: str | None = Query(default=None, description="X-Next-Cursor from the previous page"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """List one page of the households on a list, with their members.
+
+    Pages are keyed on the sort column and the household ID, so every page
+    costs the same however deep it is. When more households follow, the
+    cursor for the next page is returned in the ``X-Next-Cursor`` header.
+    Members are loaded for the returned page only.
+    """
+    etag = make_etag(session, f"list-{list_id}-households", LIST_HOUSEHOLD_TABLES)
+    if not_modified := check_not_modified(
+        request, response, etag, exists=lambda: session.get(List, list_id) is not None
+    ):
+        return not_modified
+
+    if not session.get(List, list_id):
+        raise HTTPException(status_code=404, detail="List not found")
+
+    sort_key = (Household.id,) if sort == "id" else (SORT_COLUMNS[sort], Household.id)
+    if FAST_JSON:
+        statement = select(*HOUSEHOLD_COLUMNS)
+    else:
+        statement = select(Household).options(selectinload(Household.members))
+    statement = (
+        statement.join(ListHouseholdLink, ListHouseholdLink.household_id == Household.id)
+        .where(ListHouseholdLink.list_id == list_id)
+        .order_by(*(column.desc() if order == "desc" else column for column in sort_key))
+        .limit(limit + 1)  # Fetch one extra row to know whether another page exists
+    )
+    if q and (match_ids := household_match_ids(q)) is not None:
+        statement = statement.where(Household.id.in_(match_ids))
+    if after is not None:
+        position = tuple_(*sort_key)
+        cursor = tuple_(*decode_cursor(sort, after))
+        statement = statement.where(position < cursor if order == "desc" else position > cursor)
+
+    households = session.exec(statement).all()
+    if len(households) > limit:
+        households = households[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(sort, households[-1])
+    if FAST_JSON:
+        return json_response(household_dicts(session, households), response)
+    return households
+
+
+@router.get("/{list_id}/export")
+async def export_list(
+    list_id: int, format: ExportFormat = "ndjson", session: Session = Depends(get_session)
+):
+    """Stream the households on a list and their members as NDJSON or CSV."""
+    lst = await run_in_session(session, lambda sync_session: sync_session.get(List, list_id))
+    if not lst:
+        raise HTTPException(status_code=404, detail="List not found")
+
+    return export_response(
+        session, export_statement(list_id), format, filename=f"list-{list_id}"
+    )
 
 
 @router.patch("/{list_id}", response_model=ListRead)
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
 def update_list(
-    list_id: int, list_update: ListUpdate, session: Session = Depends(get_session)
+    list_id: int,
+    list_update: ListUpdate,
+    request: Request,
+    session: Session = Depends(get_session),
 ):
     """Update list details (name, description)."""
     lst = session.get(List, list_id)
     if not lst:
         raise HTTPException(status_code=404, detail="List not found")
+    check_if_match(request, list_etag(session, list_id))
 
     list_data = list_update.model_dump(exclude_unset=True)
     lst.sqlmodel_update(list_data)
@@ -87,57 +259,116 @@ def update_list(
         id=lst.id,
         name=lst.name,
         description=lst.description,
-        household_count=len(lst.households),
+        household_count=count_households(session, lst.id),
     )
 
 
 @router.delete("/{list_id}")
-def delete_list(list_id: int, session: Session = Depends(get_session)):
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
+def delete_list(list_id: int, request: Request, session: Session = Depends(get_session)):
     """Delete a list."""
     lst = session.get(List, list_id)
     if not lst:
         raise HTTPException(status_code=404, detail="List not found")
+    check_if_match(request, list_etag(session, list_id))
 
     session.delete(lst)
     session.commit()
     return {"message": "List deleted successfully"}
 
 
-@router.post("/{list_id}/households/bulk")
+@router.post("/{list_id}/households/bulk", response_model=BulkHouseholdsResult)
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
 def add_households_to_list(
     list_id: int,
     request: BulkHouseholdsRequest,
     session: Session = Depends(get_session),
 ):
-    """Add multiple households to a list."""
+    """Add multiple households to a list, skipping unknown IDs and existing members."""
     lst = session.get(List, list_id)
     if not lst:
         raise HTTPException(status_code=404, detail="List not found")
 
-    added_count = 0
-    for household_id in request.household_ids:
-        household = session.get(Household, household_id)
-        if not household:
-            continue
+    added, already_present, unknown = [], [], []
+    household_ids = list(dict.fromkeys(request.household_ids))  # Drop repeats, keep order
+    for chunk in batched(household_ids, BULK_CHUNK_SIZE):
+        # One query tells us which IDs exist and which are already on the list
+        rows = session.exec(
+            select(Household.id, ListHouseholdLink.list_id)
+            .outerjoin(
+                ListHouseholdLink,
+                and_(
+                    ListHouseholdLink.household_id == Household.id,
+                    ListHouseholdLink.list_id == list_id,
+                ),
+            )
+            .where(Household.id.in_(chunk))
+        ).all()
+        on_list = {household_id: linked is not None for household_id, linked in rows}
+
+        new_ids = []
+        for household_id in chunk:
+            if household_id not in on_list:
+                unknown.append(household_id)
+            elif on_list[household_id]:
+                already_present.append(household_id)
+            else:
+                new_ids.append(household_id)
+
+        if new_ids:
+            session.exec(
+                insert(ListHouseholdLink).on_conflict_do_nothing(),
+                params=[
+                    {"list_id": list_id, "household_id": household_id} for household_id in new_ids
+                ],
+            )
+            added.extend(new_ids)
+
+    session.commit()
+    return BulkHouseholdsResult(
+        message=f"Added {len(added)} households to list",
+        added=added,
+        already_present=already_present,
+        unknown=unknown,
+    )
+
+
+@router.post("/{list_id}/households/bulk-delete")
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
+def remove_households_from_list(
+    list_id: int,
+    request: BulkHouseholdsRequest,
+    session: Session = Depends(get_session),
+):
+    """Remove multiple households from a list in one transaction."""
+    lst = session.get(List, list_id)
+    if not lst:
+        raise HTTPException(status_code=404, detail="List not found")
 
-        # Check if already in list
-        existing = session.exec(
-            select(ListHouseholdLink).where(
+    removed_count = 0
+    for chunk in batched(set(request.household_ids), BULK_CHUNK_SIZE):
+        result = session.exec(
+            delete(ListHouseholdLink).where(
                 ListHouseholdLink.list_id == list_id,
-                ListHouseholdLink.household_id == household_id,
+                ListHouseholdLink.household_id.in_(chunk),
             )
-        ).first()
-
-        if not existing:
-            link = ListHouseholdLink(list_id=list_id, household_id=household_id)
-            session.add(link)
-            added_count += 1
+        )
+        removed_count += result.rowcount
 
     session.commit()
-    return {"message": f"Added {added_count} households to list"}
+    return {"message": f"Removed {removed_count} households from list", "removed": removed_count}
 
 
 @router.post("/{list_id}/households/{household_id}")
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
 def add_household_to_list(
     list_id: int, household_id: int, session: Session = Depends(get_session)
 ):
@@ -170,6 +401,9 @@ def add_household_to_list(
 
 
 @router.delete("/{list_id}/households/{household_id}")
+@publishes("list", lambda list_id, **_: [list_id])
+@invalidates(lambda **_: [LISTS_KEY])
+@db_endpoint
 def remove_household_from_list(
     list_id: int, household_id: int, session: Session = Depends(get_session)
 ):
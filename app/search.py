@@ -0,0 +1,131 @@
+import re
+
+from sqlalchemy import Integer, column, event, text
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel
+
+# Full-text index over households. Each row is keyed by the household ID and
+# holds the household name, its address and the text of all of its members.
+# Triggers keep it current on every insert, update and delete, so the routers
+# don't need to know it exists.
+MEMBERS_TEXT = """(
+    SELECT group_concat(
+        first_name || ' ' || last_name || ' ' || coalesce(email, '') || ' ' || coalesce(phone, ''),
+        ' '
+    )
+    FROM member WHERE household_id = {household_id}
+)"""
+
+SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS household_fts USING fts5(
+        name, address, members, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_fts_insert AFTER INSERT ON household BEGIN
+        INSERT INTO household_fts (rowid, name, address, members)
+        VALUES (new.id, new.name, new.address, '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_fts_update AFTER UPDATE OF name, address ON household
+    BEGIN
+        UPDATE household_fts SET name = new.name, address = new.address WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_fts_delete AFTER DELETE ON household BEGIN
+        DELETE FROM household_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_fts_insert AFTER INSERT ON member BEGIN
+        UPDATE household_fts SET members = {MEMBERS_TEXT.format(household_id="new.household_id")}
+        WHERE rowid = new.household_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_fts_update AFTER UPDATE ON member BEGIN
+        UPDATE household_fts SET members = {MEMBERS_TEXT.format(household_id="new.household_id")}
+        WHERE rowid = new.household_id;
+        UPDATE household_fts SET members = {MEMBERS_TEXT.format(household_id="old.household_id")}
+        WHERE rowid = old.household_id AND old.household_id != new.household_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS member_fts_delete AFTER DELETE ON member BEGIN
+        UPDATE household_fts SET members = {MEMBERS_TEXT.format(household_id="old.household_id")}
+        WHERE rowid = old.household_id;
+    END
+    """,
+]
+
+# Indexes the households in an ID range that aren't indexed yet; run in
+# batches by the migration that adopts databases created before the index
+SEARCH_BACKFILL = f"""
+    INSERT INTO household_fts (rowid, name, address, members)
+    SELECT household.id, household.name, household.address,
+           coalesce({MEMBERS_TEXT.format(household_id="household.id")}, '')
+    FROM household
+    WHERE household.id >= :start AND household.id < :end
+      AND household.id NOT IN (
+          SELECT rowid FROM household_fts WHERE rowid >= :start AND rowid < :end
+      )
+"""
+
+# Column weights for bm25(): a hit on the household name ranks above a hit on
+# the address, which ranks above a hit on a member.
+SEARCH_RANK = "bm25(household_fts, 10.0, 5.0, 1.0)"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def create_search_index(target, connection: Connection, **kw):
+    """Create the household search index and its triggers if they are missing.
+
+    Households already in an existing database are indexed by a migration.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+
+    for statement in SEARCH_DDL:
+        connection.execute(text(statement))
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    tokens = TOKEN_PATTERN.findall(query.lower())
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_household_ids(session: Session, query: str, limit: int, offset: int = 0) -> list[int]:
+    """Return the IDs of households matching ``query``, best match first."""
+    match_query = build_match_query(query)
+    if not match_query:
+        return []
+
+    rows = session.exec(
+        text(
+            "SELECT rowid FROM household_fts WHERE household_fts MATCH :query "
+            f"ORDER BY {SEARCH_RANK}, rowid LIMIT :limit OFFSET :offset"
+        ),
+        params={"query": match_query, "limit": limit, "offset": offset},
+    )
+    return [row[0] for row in rows]
+
+
+def household_match_ids(query: str):
+    """Select the IDs of households matching ``query``, to filter another query by.
+
+    Returns None when ``query`` has no words to match.
+    """
+    match_query = build_match_query(query)
+    if not match_query:
+        return None
+    return (
+        text("SELECT rowid FROM household_fts WHERE household_fts MATCH :query")
+        .bindparams(query=match_query)
+        .columns(column("rowid", Integer))
+    )
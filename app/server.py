@@ -0,0 +1,172 @@
+"""Production server: uvicorn workers forked from a warm supervisor.
+
+``run.py`` is for development. In production run::
+
+    python -m app.server --workers 4
+
+The supervisor imports the app, prepares the database and binds the
+listening socket once, then forks the workers, which share the socket and
+start with everything already imported. Pooled connections are not carried
+across the fork (see ``app.database.drop_inherited_connections``). A worker
+that dies is replaced. On SIGTERM or SIGINT the supervisor passes SIGTERM
+on: each worker stops accepting connections, lets requests in flight finish
+for up to the graceful timeout and exits.
+
+uvicorn picks uvloop and httptools when they are installed. Metrics are
+per worker. So are the in-memory response cache and event streams, which on
+SQLite each worker keeps current from the change log, whichever worker
+wrote. Other databases keep no change log, so there several workers need a
+shared cache (``CACHE_BACKEND=redis`` or ``none``), and a worker's event
+streams only report its own writes.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+
+import uvicorn
+
+from app import cache
+from app.database import engine
+from app.migrations import MIGRATE_ON_STARTUP, prepare_database
+
+logger = logging.getLogger(__name__)
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1)))
+# Connections the kernel queues while every worker is busy accepting
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+# Seconds an idle keep-alive connection is held open
+SERVER_KEEPALIVE = float(os.getenv("SERVER_KEEPALIVE", "5"))
+# Connections and tasks per worker before new requests get 503; unset means no limit
+SERVER_LIMIT_CONCURRENCY = int(os.getenv("SERVER_LIMIT_CONCURRENCY", "0")) or None
+# Seconds a stopping worker waits for requests in flight
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+
+# Exit code of a worker that could not start, e.g. because startup failed.
+# Starting another would fail the same way, so the supervisor gives up.
+WORKER_BOOT_ERROR = 3
+
+
+def server_config(args: argparse.Namespace) -> uvicorn.Config:
+    from app.main import app
+
+    return uvicorn.Config(
+        app,
+        host=args.host,
+        port=args.port,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keepalive,
+        limit_concurrency=args.limit_concurrency,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        loop="auto",
+        http="auto",
+        proxy_headers=True,
+    )
+
+
+def run_worker(config: uvicorn.Config, sockets: list) -> int:
+    """Serve on the supervisor's sockets until told to stop. Runs in the forked child."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(config)
+    server.run(sockets=sockets)
+    return 0 if server.started else WORKER_BOOT_ERROR
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.sockets = []
+        self.pids: set[int] = set()
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.config, self.sockets)
+            finally:
+                # Never return into the supervisor's code
+                os._exit(code)
+        self.pids.add(pid)
+
+    def stop(self, signum, frame):
+        if not self.stopping:
+            logger.info("Stopping %d workers", len(self.pids))
+        self.stopping = True
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        if self.workers > 1 and engine.dialect.name != "sqlite":
+            if cache.cache.name == "memory":
+                logger.error(
+                    "%d workers would each cache responses without hearing of the others' "
+                    "writes; set CACHE_BACKEND=redis or none, or run one worker",
+                    self.workers,
+                )
+                return 1
+            logger.warning("Each worker's /events streams only report that worker's writes")
+
+        # Load the app and check the schema once, before forking
+        self.config.load()
+        prepare_database(engine, migrate=MIGRATE_ON_STARTUP)
+        engine.dispose()
+        self.sockets = [self.config.bind_socket()]
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(
+            "Serving on http://%s:%d with %d workers",
+            self.config.host,
+            self.config.port,
+            self.workers,
+        )
+        for _ in range(self.workers):
+            self.spawn()
+
+        failed = False
+        while self.pids:
+            pid, status = os.wait()
+            self.pids.discard(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            if code == WORKER_BOOT_ERROR:
+                logger.error("Worker %d failed to start", pid)
+                failed = True
+                self.stop(signal.SIGTERM, None)
+                continue
+            logger.warning("Worker %d exited with %d, starting another", pid, code)
+            self.spawn()
+        for sock in self.sockets:
+            sock.close()
+        return 1 if failed else 0
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--backlog", type=int, default=SERVER_BACKLOG)
+    parser.add_argument("--keepalive", type=float, default=SERVER_KEEPALIVE)
+    parser.add_argument("--limit-concurrency", type=int, default=SERVER_LIMIT_CONCURRENCY)
+    parser.add_argument("--graceful-timeout", type=float, default=SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    return Supervisor(server_config(args), max(args.workers, 1)).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Household coordinates and the R*Tree index behind radius and bounding-box queries.
+
+A household's ``latitude`` and ``longitude`` come from the geocoding cache
+(``geocodedaddress``, filled by ``app.geocoding``), looked up by its
+normalized address. Triggers copy them in when a household is added or its
+address changes, so an address that has been geocoded once costs nothing
+again, and the routers don't need to know.
+
+``household_rtree`` indexes every household with coordinates as a point,
+and triggers keep it current. Queries are answered from the index alone,
+without reading the household table until the page of results is known.
+R*Tree bounds are 32-bit floats rounded outwards, which places a point
+within a metre of its stored coordinates; that is well inside the precision
+of a geocoded address.
+"""
+
+import math
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LATITUDE = 2 * math.pi * EARTH_RADIUS_MILES / 360
+
+# Radius in miles of the first box a nearest-households search reads. Each
+# box after it is twice as wide, so only a few times more households than
+# asked for are read wherever they are spread evenly.
+NEAR_FIRST_RADIUS = 1.0
+
+CACHED_COORDINATE = "(SELECT {column} FROM geocodedaddress WHERE address_key = new.address_key)"
+
+SPATIAL_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS household_rtree USING rtree(
+        id, min_latitude, max_latitude, min_longitude, max_longitude
+    )
+    """,
+    # Coordinates for households at addresses already geocoded
+    f"""
+    CREATE TRIGGER IF NOT EXISTS household_geocode_insert AFTER INSERT ON household
+    WHEN new.latitude IS NULL AND new.address_key IS NOT NULL BEGIN
+        UPDATE household SET
+            latitude = {CACHED_COORDINATE.format(column="latitude")},
+            longitude = {CACHED_COORDINATE.format(column="longitude")}
+        WHERE id = new.id AND EXISTS (
+            SELECT 1 FROM geocodedaddress
+            WHERE address_key = new.address_key AND latitude IS NOT NULL
+        );
+    END
+    """,
+    # A new address replaces the coordinates, with none if it isn't geocoded
+    # yet. Coordinates that stay the same aren't written, so nothing is logged.
+    f"""
+    CREATE TRIGGER IF NOT EXISTS household_geocode_update AFTER UPDATE OF address_key ON household
+    WHEN new.address_key IS NOT old.address_key BEGIN
+        UPDATE household SET
+            latitude = {CACHED_COORDINATE.format(column="latitude")},
+            longitude = {CACHED_COORDINATE.format(column="longitude")}
+        WHERE id = new.id AND (
+            latitude IS NOT {CACHED_COORDINATE.format(column="latitude")}
+            OR longitude IS NOT {CACHED_COORDINATE.format(column="longitude")}
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_rtree_insert AFTER INSERT ON household
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO household_rtree
+        VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_rtree_update
+    AFTER UPDATE OF latitude, longitude ON household BEGIN
+        DELETE FROM household_rtree WHERE id = old.id;
+        INSERT INTO household_rtree
+        SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS household_rtree_delete AFTER DELETE ON household BEGIN
+        DELETE FROM household_rtree WHERE id = old.id;
+    END
+    """,
+]
+
+BOX_QUERY = """
+    SELECT id, (min_latitude + max_latitude) / 2, (min_longitude + max_longitude) / 2
+    FROM household_rtree
+    WHERE max_latitude >= :south AND min_latitude <= :north
+      AND max_longitude >= :west AND min_longitude <= :east
+"""
+
+
+def create_spatial_triggers(connection: Connection):
+    for statement in SPATIAL_DDL:
+        connection.execute(text(statement))
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def create_spatial_index(target, connection: Connection, **kw):
+    """Create the R*Tree and the coordinate triggers if they are missing.
+
+    Databases whose households predate the coordinate columns get them from
+    the migration that adds the columns.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    columns = {column["name"] for column in inspect(connection).get_columns("household")}
+    if "latitude" in columns:
+        create_spatial_triggers(connection)
+
+
+def distance_miles(latitude: float, longitude: float, to_latitude: float, to_longitude: float):
+    """Great-circle distance between two points, by the haversine formula."""
+    phi1, phi2 = math.radians(latitude), math.radians(to_latitude)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(to_longitude - longitude)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def split_box(south: float, west: float, north: float, east: float) -> list[tuple]:
+    """``(south, west, north, east)`` boxes covering a box that may cross the antimeridian.
+
+    A box crosses it when ``west`` is greater than ``east``, or when either
+    lies beyond ±180.
+    """
+    if west > east or west < -180 or east > 180:
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+        if west > east:
+            return [(south, west, north, 180.0), (south, -180.0, north, east)]
+    return [(south, max(west, -180.0), north, min(east, 180.0))]
+
+
+def radius_boxes(latitude: float, longitude: float, radius: float) -> list[tuple]:
+    """Boxes covering every point within ``radius`` miles of a point."""
+    d_latitude = radius / MILES_PER_DEGREE_LATITUDE
+    south, north = max(latitude - d_latitude, -90.0), min(latitude + d_latitude, 90.0)
+    # Near a pole the circle takes in every longitude
+    farthest = max(abs(south), abs(north))
+    if farthest >= 90 or d_latitude >= 90:
+        return [(south, -180.0, north, 180.0)]
+    d_longitude = d_latitude / math.cos(math.radians(farthest))
+    if d_longitude >= 180:
+        return [(south, -180.0, north, 180.0)]
+    return split_box(south, longitude - d_longitude, north, longitude + d_longitude)
+
+
+def points_in_boxes(
+    session: Session, boxes: list[tuple], after: int | None = None, limit: int | None = None
+) -> list[tuple[int, float, float]]:
+    """``(household ID, latitude, longitude)`` inside any of ``boxes``.
+
+    With ``limit``, the first households in ID order after the ID ``after``.
+    """
+    sql = BOX_QUERY
+    if after is not None:
+        sql += " AND id > :after"
+    if limit is not None:
+        sql += " ORDER BY id LIMIT :limit"
+    points = []
+    for south, west, north, east in boxes:
+        params = {"south": south, "west": west, "north": north, "east": east}
+        points.extend(session.exec(text(sql), params={**params, "after": after, "limit": limit}))
+    if limit is not None:
+        points = sorted(points)[:limit]
+    return points
+
+
+def find_near(
+    session: Session, latitude: float, longitude: float, radius: float, limit: int
+) -> list[tuple[int, float]]:
+    """``(household ID, miles away)`` for the nearest households within ``radius`` miles.
+
+    Reads boxes of growing radius around the point until one holds ``limit``
+    households within its radius, which are then the nearest.
+    """
+    reach = min(NEAR_FIRST_RADIUS, radius)
+    while True:
+        nearby = []
+        for household_id, to_latitude, to_longitude in points_in_boxes(
+            session, radius_boxes(latitude, longitude, reach)
+        ):
+            distance = distance_miles(latitude, longitude, to_latitude, to_longitude)
+            if distance <= reach:
+                nearby.append((household_id, distance))
+        if len(nearby) >= limit or reach >= radius:
+            nearby.sort(key=lambda found: (found[1], found[0]))
+            return nearby[:limit]
+        reach = min(reach * 2, radius)
+
+
+def find_in_box(
+    session: Session,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    after: int | None,
+    limit: int,
+) -> list[int]:
+    """IDs of the households inside a box, in ID order, after the ID ``after``."""
+    boxes = split_box(south, west, north, east)
+    return [household_id for household_id, _, _ in points_in_boxes(session, boxes, after, limit)]
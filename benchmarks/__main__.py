@@ -0,0 +1,97 @@
+"""Run the benchmark suite and write the results as JSON.
+
+    python -m benchmarks --size 100k --output results.json
+    python -m benchmarks --suite load --concurrency 32 --duration 30
+    python -m benchmarks --scenario households. --scenario lists.get
+
+Compare two result files with ``python -m benchmarks.compare``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from app.main import app
+from benchmarks.books import SIZES, get_book, serve_book
+from benchmarks.load import run_load
+from benchmarks.micro import run_micro
+from benchmarks.scenarios import select_scenarios
+
+# Settings that change what is being measured, recorded with every run
+SETTINGS = ["DATABASE_URL", "DATABASE_ASYNC", "FAST_JSON", "CACHE_BACKEND"]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark the address book API.")
+    parser.add_argument("--size", default="1k", help="Households, or one of " + ", ".join(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suite", choices=["micro", "load", "all"], default="all")
+    parser.add_argument(
+        "--scenario", action="append", help="Only scenarios starting with this (repeatable)"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="Requests per micro-benchmark")
+    parser.add_argument("--concurrency", type=int, default=16, help="Load generator workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="Load test seconds")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="Share of load writes")
+    parser.add_argument("--output", type=Path, help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    scenarios = select_scenarios(args.scenario)
+    if not scenarios:
+        parser.error("no scenario matches --scenario")
+    book = get_book(args.size, args.seed)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "settings": {name: os.getenv(name) for name in SETTINGS},
+        "book": {"households": book.households, "lists": book.lists, "contacts": book.contacts},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        # Each suite starts from a fresh copy, so earlier writes don't skew it
+        if args.suite in ("micro", "all"):
+            print(f"Micro-benchmarks on {book.households} households...", file=sys.stderr)
+            with serve_book(app, book, Path(directory)):
+                results["micro"] = run_micro(app, scenarios, book, args.requests, seed=args.seed)
+        if args.suite in ("load", "all"):
+            print(f"Load test for {args.duration}s...", file=sys.stderr)
+            with serve_book(app, book, Path(directory)):
+                results["load"] = asyncio.run(
+                    run_load(
+                        app,
+                        scenarios,
+                        book,
+                        args.concurrency,
+                        args.duration,
+                        args.write_ratio,
+                        args.seed,
+                    )
+                )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+        print(f"✓ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
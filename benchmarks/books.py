@@ -0,0 +1,221 @@
+"""Synthetic address books for benchmarking.
+
+Books have the shape of ``populate_sample_data.py``, scaled up: households
+of one to six members drawn from the sample names and streets, some with
+email and phone, a handful of lists holding anything from a few dozen
+households to a third of the book, and some legacy contacts. Generation is
+seeded, so a size and seed always give the same book.
+
+Build one ahead of time with::
+
+    python -m benchmarks.books --households 100000
+
+Books are cached under ``benchmarks/.books`` and reused by later runs.
+"""
+
+import argparse
+import random
+import shutil
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import batched
+from pathlib import Path
+
+from sqlalchemy import insert, text
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import cache as response_cache
+from app.cache import create_cache
+from app.database import DATABASE_ASYNC, create_async_db_engine, create_db_engine, get_session
+from app.importer import HouseholdImporter
+from app.migrations import create_schema, upgrade
+from app.models import Contact, List, ListHouseholdLink
+from populate_sample_data import households as SAMPLE_HOUSEHOLDS
+
+BOOKS_DIR = Path(__file__).parent / ".books"
+
+# Named sizes accepted wherever a household count is
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# Members per household and how likely each count is
+MEMBER_COUNTS = [1, 2, 3, 4, 5, 6]
+MEMBER_WEIGHTS = [28, 34, 15, 13, 7, 3]
+
+FIRST_NAMES = sorted({m["first_name"] for h in SAMPLE_HOUSEHOLDS for m in h["members"]})
+LAST_NAMES = sorted({m["last_name"] for h in SAMPLE_HOUSEHOLDS for m in h["members"]})
+STREETS = sorted({h["address"].split(",")[0].split(" ", 1)[1] for h in SAMPLE_HOUSEHOLDS})
+CITIES = sorted({h["address"].split(",", 1)[1].strip() for h in SAMPLE_HOUSEHOLDS})
+NAME_PATTERNS = ["The {}'s", "The {} Family", "The {} Household"]
+
+LINK_BATCH_SIZE = 10_000
+
+
+@dataclass
+class Book:
+    path: Path
+    households: int
+    lists: int
+    contacts: int
+
+
+def parse_size(size: str | int) -> int:
+    if isinstance(size, int):
+        return size
+    return SIZES.get(size.lower()) or int(size)
+
+
+def list_count(households: int) -> int:
+    return max(3, min(50, households // 2_000))
+
+
+def contact_count(households: int) -> int:
+    return max(10, households // 20)
+
+
+def synthetic_households(count: int, rng: random.Random) -> Iterator[dict]:
+    for i in range(count):
+        last_name = rng.choice(LAST_NAMES)
+        members = []
+        for _ in range(rng.choices(MEMBER_COUNTS, MEMBER_WEIGHTS)[0]):
+            first_name = rng.choice(FIRST_NAMES)
+            members.append(
+                {
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "email": (
+                        f"{first_name}.{last_name}{i}@example.com".lower()
+                        if rng.random() < 0.4
+                        else None
+                    ),
+                    "phone": f"555-{rng.randrange(10_000):04d}" if rng.random() < 0.3 else None,
+                }
+            )
+        yield {
+            "name": rng.choice(NAME_PATTERNS).format(last_name),
+            "address": f"{rng.randrange(1, 10_000)} {rng.choice(STREETS)}, {rng.choice(CITIES)}",
+            "members": members,
+        }
+
+
+def generate_book(path: Path, households: int, seed: int = 0) -> Book:
+    """Write a book of ``households`` households, with lists and contacts, to ``path``."""
+    rng = random.Random(seed)
+    path.unlink(missing_ok=True)
+    engine = create_db_engine(f"sqlite:///{path}", poolclass=NullPool)
+    create_schema(engine)
+
+    with Session(engine) as session:
+        importer = HouseholdImporter(batch_size=5_000)
+        for line, household in enumerate(synthetic_households(households, rng), 1):
+            importer.add(household, line)
+            if importer.ready:
+                importer.flush(session)
+        importer.finish(session)
+
+        # A few big lists and many small ones, like real mailing lists
+        lists = list_count(households)
+        for list_id in range(1, lists + 1):
+            session.add(List(id=list_id, name=f"List {list_id}", description="Benchmark list"))
+            share = min(0.33, rng.paretovariate(1.2) / 100)
+            size = max(10, min(households, int(households * share)))
+            members = rng.sample(range(1, households + 1), size)
+            for chunk in batched(members, LINK_BATCH_SIZE):
+                session.exec(
+                    insert(ListHouseholdLink),
+                    params=[{"list_id": list_id, "household_id": h} for h in chunk],
+                )
+        contacts = contact_count(households)
+        session.exec(
+            insert(Contact),
+            params=[
+                {
+                    "first_name": rng.choice(FIRST_NAMES),
+                    "last_name": rng.choice(LAST_NAMES),
+                    "email": None,
+                    "phone": f"555-{rng.randrange(10_000):04d}",
+                    "address": None,
+                }
+                for _ in range(contacts)
+            ],
+        )
+        session.commit()
+        session.exec(text("ANALYZE"))
+
+    engine.dispose()
+    return Book(path, households, lists, contacts)
+
+
+def get_book(size: str | int, seed: int = 0, rebuild: bool = False) -> Book:
+    """Return the cached book of ``size`` households, generating it the first time."""
+    households = parse_size(size)
+    path = BOOKS_DIR / f"book-{households}-{seed}.db"
+    if rebuild or not path.exists():
+        BOOKS_DIR.mkdir(exist_ok=True)
+        building = path.with_suffix(".building")
+        generate_book(building, households, seed)
+        building.replace(path)
+    return Book(path, households, list_count(households), contact_count(households))
+
+
+@contextmanager
+def serve_book(app, book: Book, directory: Path):
+    """Point ``app`` at a scratch copy of ``book`` for the duration of a run.
+
+    Writes made during the run go to the copy, so the cached book stays as
+    generated. The copy is first migrated to the current schema. Sessions
+    are sync or async as ``DATABASE_ASYNC`` says, and the response cache
+    starts empty.
+    """
+    copy = directory / book.path.name
+    shutil.copyfile(book.path, copy)
+    url = f"sqlite:///{copy}"
+    schema_engine = create_db_engine(url, poolclass=NullPool)
+    upgrade(schema_engine)
+    schema_engine.dispose()
+
+    if DATABASE_ASYNC:
+        engine = create_async_db_engine(url, poolclass=NullPool)
+
+        async def get_book_session():
+            async with AsyncSession(engine) as session:
+                yield session
+
+    else:
+        engine = create_db_engine(url)
+
+        def get_book_session():
+            with Session(engine) as session:
+                yield session
+
+    app.dependency_overrides[get_session] = get_book_session
+    previous_cache, response_cache.cache = response_cache.cache, create_cache()
+    try:
+        yield
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+        response_cache.cache = previous_cache
+        if not DATABASE_ASYNC:
+            engine.dispose()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic address book.")
+    parser.add_argument("--households", default="1k", help="Count, or one of " + ", ".join(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate a cached book")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    book = get_book(args.households, args.seed, args.rebuild)
+    print(
+        f"✓ {book.path}: {book.households} households, {book.lists} lists, "
+        f"{book.contacts} contacts ({time.perf_counter() - started:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
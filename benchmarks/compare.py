@@ -0,0 +1,51 @@
+"""Compare two benchmark result files.
+
+    python -m benchmarks.compare before.json after.json
+
+Prints p50, p95, p99 and throughput for every scenario the two runs share,
+with the change from the first run to the second.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps"]
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def rows(before: dict, after: dict):
+    for name in sorted(before.get("micro", {}).keys() & after.get("micro", {}).keys()):
+        yield f"micro {name}", before["micro"][name], after["micro"][name]
+    if "load" in before and "load" in after:
+        yield "load overall", before["load"]["overall"], after["load"]["overall"]
+        shared = before["load"]["scenarios"].keys() & after["load"]["scenarios"].keys()
+        for name in sorted(shared):
+            old, new = before["load"]["scenarios"][name], after["load"]["scenarios"][name]
+            yield f"load {name}", old, new
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args(argv)
+
+    before = json.loads(args.before.read_text())
+    after = json.loads(args.after.read_text())
+    print(f"{before.get('commit') or args.before} -> {after.get('commit') or args.after}")
+    print(f"{'':<32}" + "".join(f"{metric:>24}" for metric in METRICS))
+    for label, old, new in rows(before, after):
+        cells = "".join(
+            f"{f'{old[m]} -> {new[m]} ({change(old[m], new[m])})':>24}" for m in METRICS
+        )
+        print(f"{label:<32}{cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""In-process load generator for mixed read/write workloads.
+
+A number of concurrent workers send requests straight to the ASGI app for a
+fixed time, each picking a scenario at random: a write scenario with
+probability ``write_ratio``, otherwise a read. No sockets are involved, so
+the numbers measure the app and the database, not the network stack.
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.books import Book
+from benchmarks.scenarios import Scenario
+from benchmarks.stats import summarize
+
+
+async def run_load(
+    app,
+    scenarios: list[Scenario],
+    book: Book,
+    concurrency: int = 16,
+    duration: float = 10.0,
+    write_ratio: float = 0.1,
+    seed: int = 0,
+) -> dict:
+    """Drive ``app`` with ``concurrency`` workers for ``duration`` seconds.
+
+    Returns an overall summary plus one per scenario.
+    """
+    reads = [s for s in scenarios if not s.write]
+    writes = [s for s in scenarios if s.write]
+    if not reads:
+        write_ratio = 1.0
+    elif not writes:
+        write_ratio = 0.0
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+
+    async def worker(client: httpx.AsyncClient, rng: random.Random, deadline: float):
+        while time.perf_counter() < deadline:
+            scenario = rng.choice(writes if rng.random() < write_ratio else reads)
+            call = scenario.make_call(rng, book)
+            started = time.perf_counter()
+            response = await client.request(call.method, call.url, json=call.json)
+            latencies[scenario.name].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[scenario.name] += 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(
+            *(worker(client, random.Random(seed + i), deadline) for i in range(concurrency))
+        )
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "write_ratio": write_ratio,
+        "overall": summarize(all_latencies, elapsed, sum(errors.values())),
+        "scenarios": {
+            name: summarize(values, elapsed, errors[name])
+            for name, values in sorted(latencies.items())
+        },
+    }
@@ -0,0 +1,43 @@
+"""Micro-benchmarks: each scenario run on its own, one request at a time.
+
+Requests go through ``TestClient``, so the numbers include routing,
+validation and serialization but no network.
+"""
+
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from benchmarks.books import Book
+from benchmarks.scenarios import Scenario
+from benchmarks.stats import summarize
+
+
+def run_scenario(
+    client: TestClient, scenario: Scenario, book: Book, requests: int, warmup: int, seed: int
+) -> dict:
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    for i in range(warmup + requests):
+        call = scenario.make_call(rng, book)
+        started = time.perf_counter()
+        response = client.request(call.method, call.url, json=call.json)
+        latency = time.perf_counter() - started
+        if i < warmup:
+            continue
+        latencies.append(latency)
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(latencies, sum(latencies), errors)
+
+
+def run_micro(
+    app, scenarios: list[Scenario], book: Book, requests: int = 200, warmup: int = 10, seed: int = 0
+) -> dict:
+    """Run every scenario in turn and summarize each one."""
+    client = TestClient(app)
+    return {
+        scenario.name: run_scenario(client, scenario, book, requests, warmup, seed)
+        for scenario in scenarios
+    }
@@ -0,0 +1,161 @@
+"""Query plans and timings for the app's lookups with and without the schema's indexes.
+
+Run with::
+
+    python -m benchmarks.query_plans --size 100k
+
+Works on two copies of a synthetic book: one with every index the models
+declare, one with those indexes dropped, as in a database created before
+they existed. For each query it prints SQLite's plan on both copies and the
+median time per run.
+"""
+
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel
+
+from app.database import create_db_engine
+from app.migrations import upgrade
+from benchmarks.books import LAST_NAMES, Book, get_book
+
+
+@dataclass
+class Query:
+    name: str
+    sql: str
+    params: Callable[[random.Random], dict]
+    # Writes run in a transaction that is rolled back, so every run sees the same book
+    write: bool = False
+
+
+def queries(book: Book) -> list[Query]:
+    def household_id(rng):
+        return {"household_id": rng.randint(1, book.households)}
+
+    return [
+        Query(
+            "members of a household",
+            "SELECT * FROM member WHERE household_id = :household_id",
+            household_id,
+        ),
+        Query(
+            "lists a household is on",
+            "SELECT list_id FROM listhouseholdlink WHERE household_id = :household_id",
+            household_id,
+        ),
+        Query(
+            "households by name",
+            "SELECT id FROM household WHERE name = :name",
+            lambda rng: {"name": f"The {rng.choice(LAST_NAMES)} Family"},
+        ),
+        Query(
+            "members by last name",
+            "SELECT id FROM member WHERE last_name = :last_name",
+            lambda rng: {"last_name": rng.choice(LAST_NAMES)},
+        ),
+        Query(
+            "contact by email",
+            "SELECT id FROM contact WHERE email = :email",
+            lambda rng: {"email": f"nobody{rng.randrange(1000)}@example.com"},
+        ),
+        Query(
+            "list page sorted by name",
+            "SELECT household.* FROM household "
+            "JOIN listhouseholdlink ON listhouseholdlink.household_id = household.id "
+            "WHERE listhouseholdlink.list_id = :list_id "
+            "ORDER BY household.name, household.id LIMIT 50",
+            lambda rng: {"list_id": rng.randint(1, book.lists)},
+        ),
+        Query(
+            "delete a household (cascades)",
+            "DELETE FROM household WHERE id = :household_id",
+            household_id,
+            write=True,
+        ),
+        Query(
+            "add a member (search trigger)",
+            "INSERT INTO member (first_name, last_name, household_id) "
+            "VALUES ('Bench', 'Mark', :household_id)",
+            household_id,
+            write=True,
+        ),
+    ]
+
+
+def query_plan(connection, query: Query, params: dict) -> list[str]:
+    with connection.begin():
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {query.sql}"), params).all()
+    return [detail for _, _, _, detail in rows]
+
+
+def median_ms(connection, query: Query, repeat: int, seed: int) -> float:
+    rng = random.Random(seed)
+    timings = []
+    for _ in range(repeat):
+        params = query.params(rng)
+        transaction = connection.begin()
+        started = time.perf_counter()
+        result = connection.execute(text(query.sql), params)
+        if not query.write:
+            result.all()
+        timings.append(time.perf_counter() - started)
+        transaction.rollback()
+    return statistics.median(timings) * 1000
+
+
+def prepare(book: Book, path: Path, indexed: bool):
+    shutil.copyfile(book.path, path)
+    engine = create_db_engine(f"sqlite:///{path}", poolclass=NullPool)
+    # Brings the copy up to the current schema, indexes included
+    upgrade(engine)
+    if not indexed:
+        with engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                for index in table.indexes:
+                    connection.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+            connection.execute(text("ANALYZE"))
+    return engine
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="100k", help="Households in the book")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=50, help="Runs per query")
+    args = parser.parse_args(argv)
+
+    book = get_book(args.size, args.seed)
+    print(f"{book.households} households, {book.lists} lists, {book.contacts} contacts")
+    with tempfile.TemporaryDirectory() as directory:
+        engines = {
+            "without indexes": prepare(book, Path(directory) / "before.db", indexed=False),
+            "with indexes": prepare(book, Path(directory) / "after.db", indexed=True),
+        }
+        for query in queries(book):
+            print(f"\n{query.name}")
+            timings = {}
+            for label, engine in engines.items():
+                with engine.connect() as connection:
+                    plan = query_plan(connection, query, query.params(random.Random(args.seed)))
+                    timings[label] = median_ms(connection, query, args.repeat, args.seed)
+                print(f"  {label}: {timings[label]:.3f} ms")
+                for step in plan:
+                    print(f"    {step}")
+            speedup = timings["without indexes"] / max(timings["with indexes"], 1e-9)
+            print(f"  {speedup:.1f}x faster with indexes")
+        for engine in engines.values():
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Per-row cost of counting the rows SQLite returns for request metrics.
+
+Run with::
+
+    python -m benchmarks.row_counting --rows 10000
+
+Fetches the same rows through an engine without instrumentation, one
+instrumented as by default (``METRICS_COUNT_ROWS`` off) and one counting
+rows, inside a request's metrics, and reports nanoseconds per row for each.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import create_engine, insert, text
+from sqlmodel import SQLModel
+from sqlmodel.pool import StaticPool
+
+from app import metrics
+from app.database import create_db_engine
+from app.metrics import RequestMetrics, current_metrics
+from app.models import Household
+
+QUERY = text("SELECT id, name, address FROM household")
+
+
+def time_per_row(engine, rows: int, repeat: int) -> float:
+    def fetch():
+        with engine.connect() as connection:
+            connection.execute(QUERY).all()
+
+    token = current_metrics.set(RequestMetrics())
+    try:
+        fetch()  # Warm up
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fetch()
+            best = min(best, time.perf_counter() - started)
+    finally:
+        current_metrics.reset(token)
+    return best / rows * 1e9
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000, help="Rows per query")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement")
+    args = parser.parse_args(argv)
+
+    engines = {"uninstrumented": create_engine("sqlite://", poolclass=StaticPool)}
+    for name, count_rows in (("off (default)", False), ("counting rows", True)):
+        metrics.METRICS_COUNT_ROWS = count_rows
+        engines[name] = create_db_engine("sqlite://", poolclass=StaticPool)
+    metrics.METRICS_COUNT_ROWS = False
+
+    results = {}
+    for name, engine in engines.items():
+        SQLModel.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                insert(Household.__table__),
+                [{"name": f"Household {i}", "address": f"{i} Row St"} for i in range(args.rows)],
+            )
+        results[name] = time_per_row(engine, args.rows, args.repeat)
+        engine.dispose()
+
+    print(f"{args.rows} rows per query (ns per row)")
+    for name, per_row in results.items():
+        print(f"{name:<16}{per_row:>10.0f}")
+    overhead = results["counting rows"] - results["off (default)"]
+    print(f"Counting rows adds {overhead:.0f} ns per row")
+
+
+if __name__ == "__main__":
+    main()
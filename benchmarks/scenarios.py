@@ -0,0 +1,120 @@
+"""The requests benchmarked against a book, one scenario per endpoint.
+
+Each scenario picks its targets at random from the book and returns the
+request to make, so the micro-benchmarks and the load generator exercise
+exactly the same calls.
+"""
+
+import random
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from benchmarks.books import LAST_NAMES, Book, synthetic_households
+
+
+@dataclass
+class Call:
+    method: str
+    url: str
+    json: dict | None = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    make_call: Callable[[random.Random, Book], Call]
+    write: bool = False
+
+
+def household_id(rng: random.Random, book: Book) -> int:
+    return rng.randint(1, book.households)
+
+
+def list_id(rng: random.Random, book: Book) -> int:
+    return rng.randint(1, book.lists)
+
+
+def contact_id(rng: random.Random, book: Book) -> int:
+    return rng.randint(1, book.contacts)
+
+
+def new_household(rng: random.Random) -> dict:
+    return next(synthetic_households(1, rng))
+
+
+SCENARIOS = [
+    # Households
+    Scenario("households.list", lambda rng, book: Call("GET", "/households/?limit=50")),
+    Scenario(
+        "households.list_deep",
+        lambda rng, book: Call("GET", f"/households/?after={household_id(rng, book)}&limit=50"),
+    ),
+    Scenario(
+        "households.get", lambda rng, book: Call("GET", f"/households/{household_id(rng, book)}")
+    ),
+    Scenario(
+        "households.search",
+        lambda rng, book: Call("GET", f"/households/search?q={rng.choice(LAST_NAMES)[:4]}"),
+    ),
+    Scenario(
+        "households.create",
+        lambda rng, book: Call("POST", "/households/", new_household(rng)),
+        write=True,
+    ),
+    Scenario(
+        "households.update",
+        lambda rng, book: Call(
+            "PATCH", f"/households/{household_id(rng, book)}", {"name": "Benchmark Household"}
+        ),
+        write=True,
+    ),
+    Scenario(
+        "households.replace",
+        lambda rng, book: Call(
+            "PUT", f"/households/{household_id(rng, book)}/full", new_household(rng)
+        ),
+        write=True,
+    ),
+    Scenario(
+        "members.add",
+        lambda rng, book: Call(
+            "POST",
+            f"/households/{household_id(rng, book)}/members",
+            {"first_name": "Bench", "last_name": "Mark"},
+        ),
+        write=True,
+    ),
+    # Lists
+    Scenario("lists.list", lambda rng, book: Call("GET", "/lists/")),
+    Scenario("lists.get", lambda rng, book: Call("GET", f"/lists/{list_id(rng, book)}")),
+    Scenario(
+        "lists.households",
+        lambda rng, book: Call("GET", f"/lists/{list_id(rng, book)}/households?sort=name"),
+    ),
+    Scenario(
+        "lists.add_household",
+        lambda rng, book: Call(
+            "POST", f"/lists/{list_id(rng, book)}/households/{household_id(rng, book)}"
+        ),
+        write=True,
+    ),
+    # Contacts
+    Scenario("contacts.list", lambda rng, book: Call("GET", "/contacts/")),
+    Scenario(
+        "contacts.get", lambda rng, book: Call("GET", f"/contacts/{contact_id(rng, book)}")
+    ),
+    Scenario(
+        "contacts.update",
+        lambda rng, book: Call(
+            "PATCH", f"/contacts/{contact_id(rng, book)}", {"phone": "555-0100"}
+        ),
+        write=True,
+    ),
+]
+
+
+def select_scenarios(patterns: list[str] | None) -> list[Scenario]:
+    """Scenarios whose names start with any of ``patterns`` (all of them by default)."""
+    if not patterns:
+        return SCENARIOS
+    return [s for s in SCENARIOS if any(s.name.startswith(p) for p in patterns)]
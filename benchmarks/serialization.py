@@ -0,0 +1,121 @@
+"""Per-row cost of the regular and FAST_JSON household listing paths.
+
+Run with::
+
+    python -m benchmarks.serialization --households 500 --members 2
+
+Times the serialization work alone (query, validation and encoding, as
+FastAPI does it) and the whole ``GET /households/`` request through a test
+client, and reports microseconds per household for each path.
+"""
+
+import argparse
+import json
+import time
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.database import create_db_engine, get_session
+from app.importer import import_lines
+from app.main import app
+from app.models import Household, HouseholdRead
+from app.routers import households as households_router
+from app.serialization import HOUSEHOLD_COLUMNS, household_dicts
+
+response_adapter = TypeAdapter(list[HouseholdRead])
+
+
+def regular_body(session: Session, limit: int) -> bytes:
+    households = session.exec(
+        select(Household)
+        .options(selectinload(Household.members))
+        .order_by(Household.id)
+        .limit(limit)
+    ).all()
+    # What FastAPI does with a response_model: validate, dump, then json.dumps
+    content = response_adapter.dump_python(
+        response_adapter.validate_python(households, from_attributes=True), mode="json"
+    )
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_body(session: Session, limit: int) -> bytes:
+    rows = session.exec(select(*HOUSEHOLD_COLUMNS).order_by(Household.id).limit(limit)).all()
+    return to_json(household_dicts(session, rows))
+
+
+def time_per_row(fn, rows: int, repeat: int) -> float:
+    fn()  # Warm up
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best / rows * 1e6
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--households", type=int, default=500, help="Households per response")
+    parser.add_argument("--members", type=int, default=2, help="Members per household")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement")
+    args = parser.parse_args(argv)
+
+    engine = create_db_engine("sqlite://", poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    lines = (
+        json.dumps(
+            {
+                "name": f"Household {i}",
+                "address": f"{i} Benchmark Street",
+                "members": [
+                    {
+                        "first_name": f"First {j}",
+                        "last_name": f"Last {i}",
+                        "email": f"{i}.{j}@example.com",
+                    }
+                    for j in range(args.members)
+                ],
+            }
+        )
+        for i in range(args.households)
+    )
+
+    with Session(engine) as session:
+        import_lines(session, lines)
+        assert regular_body(session, args.households) == fast_body(session, args.households)
+
+        app.dependency_overrides[get_session] = lambda: session
+        client = TestClient(app)
+        url = f"/households/?limit={args.households}"
+
+        results = {}
+        for name, body in (("regular", regular_body), ("fast", fast_body)):
+            results[name] = {
+                "serialize": time_per_row(
+                    lambda: body(session, args.households), args.households, args.repeat
+                )
+            }
+        for name, enabled in (("regular", False), ("fast", True)):
+            households_router.FAST_JSON = enabled
+            results[name]["request"] = time_per_row(
+                lambda: client.get(url).raise_for_status(), args.households, args.repeat
+            )
+        households_router.FAST_JSON = False
+        app.dependency_overrides.clear()
+
+    print(f"{args.households} households, {args.members} members each (µs per household)")
+    print(f"{'':<10}{'serialize':>12}{'request':>12}")
+    for name, timings in results.items():
+        print(f"{name:<10}{timings['serialize']:>12.1f}{timings['request']:>12.1f}")
+    speedup = results["regular"]["serialize"] / results["fast"]["serialize"]
+    print(f"Serialization is {speedup:.1f}x faster on the fast path")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-"""Populate the address book with sample household data."""
-import httpx
+"""Populate the address book with sample household data.
 
-BASE_URL = "http://localhost:8000"
+Writes straight to the configured database through the bulk importer, so
+the API server doesn't need to be running.
+"""
+from sqlmodel import Session
+
+from app.database import engine
+from app.importer import HouseholdImporter
+from app.migrations import prepare_database
 
 # Sample household data
 households = [
@@ -271,18 +277,16 @@ def populate():
     """Add all sample households to the database."""
     print(f"Adding {len(households)} households to the database...")
 
-    with httpx.Client() as client:
-        for i, household in enumerate(households, 1):
-            try:
-                response = client.post(f"{BASE_URL}/households/", json=household)
-                if response.status_code == 200:
-                    print(f"✓ Added: {household['name']} ({i}/{len(households)})")
-                else:
-                    print(f"✗ Failed to add {household['name']}: {response.status_code}")
-            except Exception as e:
-                print(f"✗ Error adding {household['name']}: {e}")
+    prepare_database(engine)
+    importer = HouseholdImporter()
+    for line, household in enumerate(households, 1):
+        importer.add(household, line)
+    with Session(engine) as session:
+        report = importer.finish(session)
 
-    print(f"\n✓ Done! Added {len(households)} households.")
+    for error in report.errors:
+        print(f"✗ Failed to add {households[error.line - 1]['name']}: {error.error}")
+    print(f"\n✓ Done! Added {report.households} households.")
 
 
 if __name__ == "__main__":
@@ -1,26 +1,54 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.pool import StaticPool
 
-from app.database import get_session
+from app.cache import MemoryCache
+from app.database import create_async_db_engine, create_db_engine, get_session
 from app.main import app
 
 
+@pytest.fixture(name="database_mode", params=["sync", "async"])
+def database_mode_fixture(request):
+    return request.param
+
+
+@pytest.fixture(name="database_url")
+def database_url_fixture(database_mode: str, tmp_path):
+    # The async engine can't share an in-memory database with the sync
+    # session the tests inspect, so async runs use a file
+    if database_mode == "async":
+        return f"sqlite:///{tmp_path / 'test.db'}"
+    return "sqlite://"
+
+
 @pytest.fixture(name="session")
-def session_fixture():
-    engine = create_engine(
-        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
-    )
+def session_fixture(database_url: str):
+    engine = create_db_engine(database_url, poolclass=StaticPool)
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
+    engine.dispose()
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
-    def get_session_override():
-        return session
+def client_fixture(database_mode: str, database_url: str, session: Session, monkeypatch):
+    # Cached responses must not outlive the test's database
+    monkeypatch.setattr("app.cache.cache", MemoryCache())
+
+    if database_mode == "async":
+        async_engine = create_async_db_engine(database_url, poolclass=NullPool)
+
+        async def get_session_override():
+            async with AsyncSession(async_engine) as async_session:
+                yield async_session
+
+    else:
+
+        def get_session_override():
+            return session
 
     app.dependency_overrides[get_session] = get_session_override
     client = TestClient(app)
@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from app.cache import LISTS_KEY, CacheEntry, MemoryCache, household_key, invalidate_change
+from app.database import create_db_engine
+from app.events import EventHub
+from app.models import Contact, Household, Member
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    run(cache.set("a", CacheEntry(b"1"), 0))
+    run(cache.set("b", CacheEntry(b"2"), 0))
+    assert run(cache.get("a")).body == b"1"  # "b" is now the oldest
+    run(cache.set("c", CacheEntry(b"3"), 0))
+
+    assert run(cache.get("b")) is None
+    assert run(cache.get("a")).body == b"1"
+    stats = run(cache.stats())
+    assert (stats.hits, stats.misses, stats.evictions, stats.entries) == (2, 1, 1, 2)
+
+
+def test_memory_cache_bounds_size_and_age(monkeypatch):
+    cache = MemoryCache(ttl=10, max_bytes=5)
+    run(cache.set("a", CacheEntry(b"123"), 0))
+    run(cache.set("b", CacheEntry(b"456"), 0))
+    run(cache.set("too-big", CacheEntry(b"123456"), 0))
+    assert run(cache.get("a")) is None
+    assert run(cache.get("too-big")) is None
+    assert run(cache.stats()).size_bytes == 3
+
+    now = time.monotonic()
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now + 11)
+    assert run(cache.get("b")) is None
+    stats = run(cache.stats())
+    assert (stats.expirations, stats.entries, stats.size_bytes) == (1, 0, 0)
+
+
+def test_memory_cache_drops_responses_read_before_an_invalidation():
+    cache = MemoryCache()
+    epoch = run(cache.epoch())
+    run(cache.invalidate(["a"]))
+    run(cache.set("a", CacheEntry(b"stale"), epoch))
+    assert run(cache.get("a")) is None
+
+
+def test_writes_by_other_workers_invalidate_the_memory_cache(tmp_path, monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr("app.cache.cache", cache)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'workers.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        households = [Household(name=name, address="3 Ash Ct") for name in ["A", "B"]]
+        session.add_all(households)
+        session.commit()
+        changed, unchanged = (household.id for household in households)
+
+    async def scenario():
+        for key in [household_key(changed), household_key(unchanged), LISTS_KEY]:
+            await cache.set(key, CacheEntry(b"{}"), 0)
+        hub = EventHub()
+        following = asyncio.create_task(
+            hub.follow(engine, interval=0.01, on_change=invalidate_change)
+        )
+        while not hub.following:
+            await asyncio.sleep(0.01)
+
+        # Written by another worker, whose invalidation this cache never sees
+        with Session(engine) as session:
+            session.add(Member(first_name="Ann", last_name="Lee", household_id=changed))
+            session.commit()
+        for _ in range(100):
+            if await cache.get(household_key(changed)) is None:
+                break
+            await asyncio.sleep(0.01)
+
+        assert await cache.get(household_key(changed)) is None
+        assert await cache.get(household_key(unchanged)) is not None
+        assert await cache.get(LISTS_KEY) is not None
+        following.cancel()
+
+    run(scenario())
+    engine.dispose()
+
+
+def test_get_household_is_cached(client: TestClient):
+    household_id = client.post(
+        "/households/",
+        json={
+            "name": "Cached",
+            "address": "1 Cache St",
+            "members": [{"first_name": "A", "last_name": "B"}],
+        },
+    ).json()["id"]
+
+    first = client.get(f"/households/{household_id}")
+    second = client.get(f"/households/{household_id}")
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+    stats = client.get("/api/cache").json()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    headers = {"If-None-Match": first.headers["etag"]}
+    assert client.get(f"/households/{household_id}", headers=headers).status_code == 304
+
+    client.post(f"/households/{household_id}/members", json={"first_name": "C", "last_name": "D"})
+    response = client.get(f"/households/{household_id}")
+    assert len(response.json()["members"]) == 2
+    assert response.headers["etag"] != first.headers["etag"]
+
+    client.delete(f"/households/{household_id}")
+    assert client.get(f"/households/{household_id}").status_code == 404
+
+
+def test_cached_household_is_read_again_when_its_etag_changes(client: TestClient, session: Session):
+    household_id = client.post(
+        "/households/", json={"name": "Before", "address": "1 Stale St", "members": []}
+    ).json()["id"]
+    first = client.get(f"/households/{household_id}")
+    assert client.get(f"/households/{household_id}").headers["etag"] == first.headers["etag"]
+
+    # Written behind the API's back, so no invalidation reaches the cache
+    household = session.get(Household, household_id)
+    household.name = "After"
+    session.add(household)
+    session.commit()
+
+    response = client.get(f"/households/{household_id}")
+    assert response.json()["name"] == "After"
+    assert response.headers["etag"] != first.headers["etag"]
+    headers = {"If-None-Match": first.headers["etag"]}
+    assert client.get(f"/households/{household_id}", headers=headers).status_code == 200
+    headers = {"If-None-Match": response.headers["etag"]}
+    assert client.get(f"/households/{household_id}", headers=headers).status_code == 304
+
+
+def test_list_counts_are_invalidated_by_household_writes(client: TestClient):
+    household_id = client.post(
+        "/households/", json={"name": "Listed", "address": "1 List St", "members": []}
+    ).json()["id"]
+    list_id = client.post("/lists/", json={"name": "Cached list"}).json()["id"]
+    assert client.get("/lists/").json()[0]["household_count"] == 0
+
+    client.post(f"/lists/{list_id}/households/{household_id}")
+    assert client.get("/lists/").json()[0]["household_count"] == 1
+    assert client.get("/lists/").json()[0]["household_count"] == 1  # Served from the cache
+
+    client.post("/households/bulk-delete", json={"household_ids": [household_id]})
+    assert client.get("/lists/").json()[0]["household_count"] == 0
+
+
+def test_get_contact_is_cached_until_its_contact_member_or_household_changes(
+    client: TestClient, session: Session
+):
+    contact_id = client.post(
+        "/contacts/", json={"first_name": "Ann", "last_name": "Lee"}
+    ).json()["id"]
+    assert client.get(f"/contacts/{contact_id}").json()["phone"] is None
+
+    assert client.get(f"/contacts/{contact_id}").json()["phone"] is None  # Served from the cache
+    stats = client.get("/api/cache").json()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    client.patch(f"/contacts/{contact_id}", json={"phone": "555-0100"})
+    assert client.get(f"/contacts/{contact_id}").json()["phone"] == "555-0100"
+
+    contact = session.get(Contact, contact_id)
+    member_url = f"/households/{contact.household_id}/members/{contact.member_id}"
+    client.patch(member_url, json={"email": "ann@example.com"})
+    assert client.get(f"/contacts/{contact_id}").json()["email"] == "ann@example.com"
+    client.patch(f"/households/{contact.household_id}", json={"address": "2 New St"})
+    assert client.get(f"/contacts/{contact_id}").json()["address"] == "2 New St"
+
+    client.delete(member_url)
+    assert client.get(f"/contacts/{contact_id}").status_code == 404
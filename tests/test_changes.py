@@ -0,0 +1,105 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.changes import prune_change_log
+
+
+def summarize(feed: dict) -> list[tuple]:
+    return [(change["table"], change["op"], change["key"]) for change in feed["changes"]]
+
+
+def test_changes_follow_writes(client: TestClient):
+    household = client.post(
+        "/households/",
+        json={
+            "name": "The Lees",
+            "address": "3 Ash Ct",
+            "members": [{"first_name": "Ann", "last_name": "Lee"}],
+        },
+    ).json()
+    member_id = household["members"][0]["id"]
+    list_id = client.post("/lists/", json={"name": "Party"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/{household['id']}")
+
+    feed = client.get("/changes", params={"since": 0}).json()
+    assert summarize(feed) == [
+        ("household", "upsert", {"id": household["id"]}),
+        ("member", "upsert", {"id": member_id}),
+        ("list", "upsert", {"id": list_id}),
+        ("listhouseholdlink", "upsert", {"list_id": list_id, "household_id": household["id"]}),
+    ]
+    assert feed["changes"][0]["data"] == {
+        "id": household["id"],
+        "name": "The Lees",
+        "address": "3 Ash Ct",
+        "latitude": None,
+        "longitude": None,
+    }
+    assert feed["next"] == feed["latest"] == 4
+    assert not feed["more"]
+
+    # Updates since the last sync come back once per row, as the row is now
+    client.patch(f"/households/{household['id']}", json={"name": "The Lee Family"})
+    client.patch(f"/households/{household['id']}", json={"address": "4 Ash Ct"})
+    feed = client.get("/changes", params={"since": 4}).json()
+    assert summarize(feed) == [("household", "upsert", {"id": household["id"]})]
+    assert feed["changes"][0]["data"]["name"] == "The Lee Family"
+    assert feed["changes"][0]["data"]["address"] == "4 Ash Ct"
+
+    # Deleting the household logs the rows its deletion cascaded to
+    client.delete(f"/households/{household['id']}")
+    feed = client.get("/changes", params={"since": feed["next"]}).json()
+    assert sorted(table for table, op, _ in summarize(feed) if op == "delete") == [
+        "household",
+        "listhouseholdlink",
+        "member",
+    ]
+
+    feed = client.get("/changes", params={"since": feed["next"]}).json()
+    assert feed["changes"] == []
+    assert not feed["more"]
+
+
+def test_changes_pages(client: TestClient):
+    for name in ["A", "B", "C"]:
+        client.post("/lists/", json={"name": name})
+
+    feed = client.get("/changes", params={"limit": 2}).json()
+    assert [change["data"]["name"] for change in feed["changes"]] == ["A", "B"]
+    assert feed["more"]
+    feed = client.get("/changes", params={"since": feed["next"], "limit": 2}).json()
+    assert [change["data"]["name"] for change in feed["changes"]] == ["C"]
+    assert not feed["more"]
+
+
+def test_changes_tombstone_for_row_deleted_later(client: TestClient):
+    list_id = client.post("/lists/", json={"name": "Gone"}).json()["id"]
+    client.post("/lists/", json={"name": "Kept"})
+    client.delete(f"/lists/{list_id}")
+
+    # The first page only holds the insert, but the list is already gone
+    feed = client.get("/changes", params={"limit": 1}).json()
+    assert summarize(feed) == [("list", "delete", {"id": list_id})]
+
+
+def test_pruned_changes_are_gone(client: TestClient, session: Session):
+    for name in ["A", "B", "C"]:
+        client.post("/lists/", json={"name": name})
+    assert prune_change_log(session.get_bind(), keep=1) == 2
+    assert prune_change_log(session.get_bind(), keep=0) == 0  # The newest entry stays
+
+    assert client.get("/changes", params={"since": 0}).status_code == 410
+    assert client.get("/changes", params={"since": 1}).status_code == 410
+    assert client.get("/changes", params={"since": 2}).json()["next"] == 3
+
+
+def test_internal_columns_are_not_logged(client: TestClient, session: Session):
+    household_id = client.post(
+        "/households/", json={"name": "Keys", "address": "1 Key St", "members": []}
+    ).json()["id"]
+    latest = client.get("/changes").json()["latest"]
+
+    session.exec(text(f"UPDATE household SET address_key = 'other' WHERE id = {household_id}"))
+    session.commit()
+    assert client.get("/changes", params={"since": latest}).json()["changes"] == []
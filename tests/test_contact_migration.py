@@ -0,0 +1,162 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app import contact_migration
+from app.addresses import normalize_address
+from app.contact_migration import JOB_NAME, migrate_batch, migrate_contacts
+from app.models import Contact, Household, JobCheckpoint, Member
+
+
+def add_contacts(session: Session, *addresses: str | None):
+    for number, address in enumerate(addresses):
+        session.add(
+            Contact(first_name=f"First{number}", last_name=f"Last{number}", address=address)
+        )
+    session.commit()
+
+
+def households_by_address(session: Session) -> dict[str, list[str]]:
+    households = session.exec(select(Household)).all()
+    return {
+        household.address: sorted(member.first_name for member in household.members)
+        for household in households
+    }
+
+
+def test_normalize_address():
+    assert normalize_address("12 Oak Street, Apt 4") == normalize_address("12  oak st. #4")
+    assert normalize_address("1 Crème Brûlée Ave") == "1 creme brulee ave"
+    assert normalize_address("  ") is None
+    assert normalize_address(None) is None
+
+
+def test_migrate_contacts_groups_by_normalized_address(session: Session):
+    add_contacts(session, "12 Oak Street", "9 Elm Rd", "12 oak st.", None, None)
+
+    status = migrate_contacts(session.get_bind(), batch_size=2)
+
+    assert status.processed == 5
+    assert status.remaining == 0
+    assert status.households == 4
+    assert status.finished
+    session.expire_all()
+    assert len(session.exec(select(Member)).all()) == 5
+    households = session.exec(select(Household)).all()
+    assert sorted(len(household.members) for household in households) == [1, 1, 1, 2]
+    oak = next(household for household in households if household.address == "12 Oak Street")
+    assert sorted(member.first_name for member in oak.members) == ["First0", "First2"]
+    # Named in the first batch, before the second contact at the address joined
+    assert oak.name == "The Last0 Household"
+    contacts = session.exec(select(Contact).order_by(Contact.id)).all()
+    assert contacts[0].household_id == contacts[2].household_id == oak.id
+    assert contacts[2].address_key == "12 oak st"
+
+
+def test_migrate_contacts_resumes_from_checkpoint(session: Session):
+    add_contacts(session, "1 Main St", "2 Main St")
+    assert migrate_batch(session, batch_size=1) == 1
+    checkpoint = session.get(JobCheckpoint, JOB_NAME)
+    assert checkpoint.processed == 1
+    assert checkpoint.finished_at is None
+
+    add_contacts(session, "1 Main Street")
+    status = migrate_contacts(session.get_bind(), batch_size=10)
+
+    # Nothing is moved twice, and a later contact joins the earlier household
+    assert status.processed == 3
+    assert status.households == 2
+    session.expire_all()
+    assert households_by_address(session) == {
+        "1 Main St": ["First0", "First0"],
+        "2 Main St": ["First1"],
+    }
+
+
+def test_contact_migration_endpoint(client: TestClient, session: Session):
+    add_contacts(session, "5 Pine Ln", "5 Pine Lane")
+
+    response = client.post("/admin/contact-migration")
+    assert response.status_code == 202
+    assert response.json()["total"] == 2
+    contact_migration.runner.join()
+
+    status = client.get("/admin/contact-migration").json()
+    assert status["processed"] == 2
+    assert status["households"] == 1
+    assert status["finished"]
+    assert not status["running"]
+    contacts = client.get("/contacts/").json()
+    assert [contact["address"] for contact in contacts] == ["5 Pine Ln", "5 Pine Ln"]
+
+
+def test_list_contacts_pages(client: TestClient):
+    for name in ["Ann", "Ben", "Cal"]:
+        client.post("/contacts/", json={"first_name": name, "last_name": "Lee"})
+
+    response = client.get("/contacts/", params={"limit": 2})
+    assert [contact["first_name"] for contact in response.json()] == ["Ann", "Ben"]
+    after = response.headers["x-next-cursor"]
+    response = client.get("/contacts/", params={"limit": 2, "after": after})
+    assert [contact["first_name"] for contact in response.json()] == ["Cal"]
+    assert "x-next-cursor" not in response.headers
+
+
+def test_contacts_keep_their_ids_through_the_migration(client: TestClient, session: Session):
+    # Members made before the migration take the IDs the contacts have
+    client.post(
+        "/households/",
+        json={
+            "name": "Others",
+            "address": "1 Elsewhere",
+            "members": [{"first_name": f"Other{i}", "last_name": "X"} for i in range(3)],
+        },
+    )
+    add_contacts(session, "3 Ash Ct", "3 Ash Court", None)
+    ids = [contact.id for contact in session.exec(select(Contact).order_by(Contact.id))]
+
+    # Not moved yet: served from the contact table
+    assert client.get(f"/contacts/{ids[0]}").json()["first_name"] == "First0"
+    assert client.patch(f"/contacts/{ids[2]}", json={"email": "e@example.com"}).status_code == 200
+    assert migrate_batch(session, batch_size=1) == 1
+    assert [contact["first_name"] for contact in client.get("/contacts/").json()] == [
+        "First0",
+        "First1",
+        "First2",
+    ]
+
+    migrate_contacts(session.get_bind())
+    contacts = client.get("/contacts/").json()
+    assert [(contact["id"], contact["first_name"]) for contact in contacts] == [
+        (ids[0], "First0"),
+        (ids[1], "First1"),
+        (ids[2], "First2"),
+    ]
+    assert contacts[2]["email"] == "e@example.com"
+    assert client.get(f"/contacts/{ids[1]}").json()["address"] == "3 Ash Ct"
+
+    client.delete(f"/contacts/{ids[0]}")
+    others = client.get("/households/").json()[0]["members"]
+    assert [member["first_name"] for member in others] == ["Other0", "Other1", "Other2"]
+    assert client.get(f"/contacts/{ids[0]}").status_code == 404
+
+
+def test_contact_address_change_moves_out_of_shared_household(
+    client: TestClient, session: Session
+):
+    add_contacts(session, "3 Ash Ct", "3 Ash Ct")
+    migrate_contacts(session.get_bind())
+    ann, ben = (contact["id"] for contact in client.get("/contacts/").json())
+    household_id = session.get(Contact, ann).household_id
+    assert client.get(f"/contacts/{ann}").json()["address"] == "3 Ash Ct"
+
+    response = client.patch(f"/contacts/{ann}", json={"address": "8 Birch Dr"})
+    assert response.json()["address"] == "8 Birch Dr"
+    members = client.get(f"/households/{household_id}").json()["members"]
+    assert [member["first_name"] for member in members] == ["First1"]
+    assert client.get(f"/contacts/{ben}").json()["address"] == "3 Ash Ct"
+
+    # Alone in the new household, so the household itself moves
+    client.patch(f"/contacts/{ann}", json={"address": "9 Birch Dr"})
+    client.delete(f"/contacts/{ann}")
+    households = client.get("/households/").json()
+    assert [h["id"] for h in households] == [household_id]
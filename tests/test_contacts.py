@@ -1,4 +1,7 @@
 from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.models import Contact, Member
 
 
 def test_read_root(client: TestClient):
@@ -29,6 +32,23 @@ def test_create_contact(client: TestClient):
     assert "id" in data
 
 
+def test_created_contact_is_stored_once_as_a_member(client: TestClient, session: Session):
+    contact_id = client.post(
+        "/contacts/", json={"first_name": "John", "last_name": "Doe", "email": "john@example.com"}
+    ).json()["id"]
+
+    row = session.get(Contact, contact_id)
+    member = session.get(Member, row.member_id)
+    assert (member.first_name, member.email) == ("John", "john@example.com")
+    assert member.household_id == row.household_id
+    # The contact row only maps the contact's ID to its member
+    fields = {"first_name", "last_name", "email", "phone", "address"}
+    assert row.model_dump(include=fields) == dict.fromkeys(fields) | {
+        "first_name": "",
+        "last_name": "",
+    }
+
+
 def test_create_contact_minimal(client: TestClient):
     response = client.post(
         "/contacts/",
@@ -76,6 +96,29 @@ def test_get_contact(client: TestClient):
     assert data["last_name"] == "Brown"
 
 
+def test_get_contact_conditional(client: TestClient):
+    create_response = client.post(
+        "/contacts/",
+        json={"first_name": "Frank", "last_name": "Hill"},
+    )
+    contact_id = create_response.json()["id"]
+    etag = client.get(f"/contacts/{contact_id}").headers["etag"]
+
+    response = client.get(f"/contacts/{contact_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.patch(
+        f"/contacts/{contact_id}", json={"phone": "555-0000"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+
+    response = client.patch(
+        f"/contacts/{contact_id}", json={"phone": "555-1111"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert response.json() == {"detail": "Resource has been modified"}
+
+
 def test_get_contact_not_found(client: TestClient):
     response = client.get("/contacts/999")
     assert response.status_code == 404
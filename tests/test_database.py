@@ -0,0 +1,110 @@
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel
+
+from app import database
+from app.cache import MemoryCache
+from app.database import create_db_engine
+from app.main import app
+from app.models import List
+
+
+def read_pragma(engine, name: str):
+    with engine.connect() as connection:
+        return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_engine_applies_sqlite_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+
+    assert read_pragma(engine, "journal_mode") == "wal"
+    assert read_pragma(engine, "synchronous") == 1  # NORMAL
+    assert read_pragma(engine, "foreign_keys") == 1
+    assert read_pragma(engine, "busy_timeout") == 5000
+    assert read_pragma(engine, "cache_size") == -64000
+    assert read_pragma(engine, "temp_store") == 2  # MEMORY
+    assert engine.echo is False
+    engine.dispose()
+
+
+def test_engine_reads_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'env.db'}")
+    monkeypatch.setenv("DATABASE_ECHO", "true")
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "3")
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT", "250")
+    monkeypatch.setenv("SQLITE_JOURNAL_MODE", "DELETE")
+
+    engine = create_db_engine()
+
+    assert engine.url.database.endswith("env.db")
+    assert engine.echo is True
+    assert engine.pool.size() == 3
+    assert read_pragma(engine, "busy_timeout") == 250
+    assert read_pragma(engine, "journal_mode") == "delete"
+    engine.dispose()
+
+
+def test_reads_go_to_replicas_unless_they_lag_behind_the_client(tmp_path, monkeypatch):
+    primary = create_db_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    SQLModel.metadata.create_all(primary)
+    primary.dispose()
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    replica = create_db_engine(f"sqlite:///{tmp_path / 'replica.db'}", read_only=True)
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    monkeypatch.setattr("app.cache.cache", MemoryCache())
+    writer, other = TestClient(app), TestClient(app)
+
+    response = writer.post("/lists/", json={"name": "Party"})
+    assert response.headers["x-commit-position"] == response.cookies["commit_position"]
+
+    # The replica hasn't seen the new list: others read it as it is, the
+    # writer is sent to the primary
+    assert other.get("/lists/").json() == []
+    assert [item["name"] for item in writer.get("/lists/").json()] == ["Party"]
+
+    primary.dispose()
+    replica.dispose()
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    # What the lagging replica served wasn't cached
+    assert [item["name"] for item in other.get("/lists/").json()] == ["Party"]
+    with Session(primary) as session:
+        session.add(List(name="Later"))
+        session.commit()
+
+    # Once the replica has caught up with the writer, it serves them again
+    assert [item["name"] for item in writer.get("/lists/").json()] == ["Party"]
+    with pytest.raises(OperationalError):
+        with replica.connect() as connection:
+            connection.execute(text("DELETE FROM list"))
+    primary.dispose()
+    replica.dispose()
+
+
+def test_reads_fall_back_to_the_primary_while_a_replica_is_down(tmp_path, monkeypatch):
+    primary = create_db_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    SQLModel.metadata.create_all(primary)
+    replica = create_db_engine(f"sqlite:///{tmp_path / 'gone' / 'replica.db'}", read_only=True)
+    event.listen(replica, "handle_error", database.replica_failed)
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    monkeypatch.setattr(database, "replica_down_until", {})
+    monkeypatch.setattr("app.cache.cache", MemoryCache())
+    writer, other = TestClient(app), TestClient(app, raise_server_exceptions=False)
+    writer.post("/lists/", json={"name": "Party"})
+
+    # The writer's read can't reach the replica to ask how far it has got,
+    # so the primary serves it, and everyone else while the replica is out
+    assert [item["name"] for item in writer.get("/lists/").json()] == ["Party"]
+    assert [item["name"] for item in other.get("/lists/").json()] == ["Party"]
+
+    # Tried again later, the replica fails the read that finds it still
+    # down, and is left out again
+    database.replica_down_until.clear()
+    assert other.get("/households/").status_code == 500
+    assert other.get("/households/").json() == []
+    primary.dispose()
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.duplicates import find_duplicates
+from app.models import Household
+
+
+def add_households(session: Session, *addresses: str):
+    for number, address in enumerate(addresses):
+        session.add(Household(name=f"Household {number}", address=address))
+    session.commit()
+
+
+def grouped_ids(groups) -> list[list[int]]:
+    return [[household.id for household in group.households] for group in groups]
+
+
+def test_find_duplicates_within_blocks(session: Session):
+    add_households(
+        session,
+        "12 Oak Street",
+        "12 oak st.",
+        "12 Oak St North",
+        "12 Oak Street, Apt 4",
+        "14 Oak Street",
+        "7 Elm Rd",
+        "",
+    )
+
+    groups, cursor = find_duplicates(session, threshold=0.9)
+    assert cursor is None
+    assert grouped_ids(groups) == [[1, 2, 3]]
+    assert groups[0].address_key == "12 oak st"
+    assert not groups[0].exact
+
+    groups, _ = find_duplicates(session, threshold=1)
+    assert grouped_ids(groups) == [[1, 2]]
+    assert groups[0].exact
+
+
+def test_address_key_follows_updates(client: TestClient, session: Session):
+    household = client.post(
+        "/households/", json={"name": "The Lees", "address": "3 Ash Ct", "members": []}
+    ).json()
+    client.patch(f"/households/{household['id']}", json={"address": "3 Ash Court, Unit 2"})
+
+    session.expire_all()
+    assert session.get(Household, household["id"]).address_key == "3 ash ct apt 2"
+
+
+def test_create_household_duplicate_check(client: TestClient):
+    body = {"name": "The Lees", "address": "3 Ash Ct", "members": []}
+    first = client.post("/households/", json=body).json()
+
+    response = client.post("/households/", json={**body, "address": "3 ash court"})
+    assert response.status_code == 200
+    assert "x-duplicate-of" not in response.headers
+
+    response = client.post("/households/?duplicates=flag", json=body)
+    assert response.status_code == 200
+    assert response.headers["x-duplicate-of"] == f"{first['id']}, {first['id'] + 1}"
+
+    response = client.post("/households/?duplicates=reject", json=body)
+    assert response.status_code == 409
+    assert response.json() == {"detail": "A household with this address already exists"}
+
+    response = client.post("/households/?duplicates=reject", json={**body, "address": "4 Ash Ct"})
+    assert response.status_code == 200
+
+
+def test_unknown_duplicate_setting_is_refused(tmp_path):
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'env.db'}",
+        "DUPLICATE_HOUSEHOLDS": "rejct",
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", "import app.duplicates"], env=env, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert "Unknown DUPLICATE_HOUSEHOLDS 'rejct'" in result.stderr
+
+
+def test_duplicates_endpoint_pages(client: TestClient, session: Session):
+    add_households(session, "1 Main St", "1 Main Street", "2 Main St", "2 main st", "3 Main St")
+
+    response = client.get("/households/duplicates", params={"threshold": 1, "limit": 1})
+    assert response.status_code == 200
+    assert [[h["id"] for h in group["households"]] for group in response.json()] == [[1, 2]]
+    cursor = response.headers["x-next-cursor"]
+
+    response = client.get(
+        "/households/duplicates", params={"threshold": 1, "limit": 1, "after": cursor}
+    )
+    assert [[h["id"] for h in group["households"]] for group in response.json()] == [[3, 4]]
+    cursor = response.headers["x-next-cursor"]
+
+    # "3 main st" is still unread, but has no duplicates
+    response = client.get(
+        "/households/duplicates", params={"threshold": 1, "limit": 1, "after": cursor}
+    )
+    assert response.json() == []
+    assert "x-next-cursor" not in response.headers
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from app import events
+from app.database import create_db_engine
+from app.events import EventHub
+from app.main import get_events
+from app.models import Household, List, Member
+
+
+async def take(stream, count: int) -> list[bytes]:
+    return [await anext(stream) for _ in range(count)]
+
+
+def parse(message: bytes) -> dict:
+    fields = dict(line.split(": ", 1) for line in message.decode().strip().splitlines())
+    return {**fields, "data": json.loads(fields["data"])}
+
+
+def test_hub_delivers_events():
+    async def scenario():
+        hub = EventHub()
+        stream = hub.stream()
+        retry, ready = await take(stream, 2)
+        assert retry == b"retry: 3000\n\n"
+        assert parse(ready)["event"] == "ready"
+
+        hub.publish("change", {"kind": "list", "ids": [1]})
+        hub.publish("change", {"kind": "household", "ids": []})
+        first, second = await take(stream, 2)
+        assert parse(first) == {
+            "id": f"{hub.instance}-1",
+            "event": "change",
+            "data": {"kind": "list", "ids": [1]},
+        }
+        assert parse(second)["id"] == hub.last_id == f"{hub.instance}-2"
+
+        hub.close()
+        await asyncio.sleep(0)
+        assert [message async for message in stream] == []
+        assert not hub.subscribers
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_is_told_to_resync():
+    async def scenario():
+        hub = EventHub(queue_size=3)
+        slow, fast = hub.stream(), hub.stream()
+        await take(slow, 2)
+        await take(fast, 2)
+
+        for number in range(5):
+            hub.publish("change", {"kind": "list", "ids": [number]})
+            await take(fast, 1)
+
+        # Event 3 overflowed the queue: the backlog was dropped for one
+        # resync, and later events follow it
+        resync, after = await take(slow, 2)
+        assert parse(resync)["event"] == "resync"
+        assert parse(after)["data"]["ids"] == [4]
+        assert hub.resyncs == 1
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_after_missed_events_resyncs():
+    async def scenario():
+        hub, restarted = EventHub(), EventHub()
+        hub.publish("change", {"kind": "list", "ids": [1]})
+        restarted.publish("change", {"kind": "list", "ids": [2]})
+        _, first = await take(hub.stream(last_event_id=hub.last_id), 2)
+        assert parse(first)["event"] == "ready"
+        _, first = await take(hub.stream(last_event_id=f"{hub.instance}-0"), 2)
+        assert parse(first)["event"] == "resync"
+        # An ID another process issued never matches
+        _, first = await take(restarted.stream(last_event_id=hub.last_id), 2)
+        assert parse(first)["event"] == "resync"
+
+    asyncio.run(scenario())
+
+
+def test_hubs_follow_the_change_log(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    SQLModel.metadata.create_all(engine)
+
+    async def scenario():
+        # Two workers, each following the log with its own hub
+        hubs = [EventHub(), EventHub()]
+        followers = [asyncio.create_task(hub.follow(engine, interval=0.01)) for hub in hubs]
+        while not all(hub.following for hub in hubs):
+            await asyncio.sleep(0.01)
+        streams = [hub.stream() for hub in hubs]
+        for stream in streams:
+            await take(stream, 2)
+
+        with Session(engine) as session:
+            household = Household(name="The Lees", address="3 Ash Ct")
+            session.add(household)
+            session.flush()
+            session.add(Member(first_name="Ann", last_name="Lee", household_id=household.id))
+            session.add(List(name="Party"))
+            session.commit()
+            household_id = household.id
+
+        for stream in streams:
+            changes = [parse(message) for message in await take(stream, 2)]
+            assert sorted(change["data"]["kind"] for change in changes) == ["household", "list"]
+            assert {"kind": "household", "ids": [household_id]} in [
+                change["data"] for change in changes
+            ]
+        # Positions mean the same in every worker
+        assert hubs[0].last_id == hubs[1].last_id == changes[-1]["id"]
+        _, first = await take(hubs[0].stream(last_event_id=changes[-1]["id"]), 2)
+        assert parse(first)["event"] == "ready"
+
+        for follower in followers:
+            follower.cancel()
+        await asyncio.gather(*followers, return_exceptions=True)
+        assert not any(hub.following for hub in hubs)
+
+    asyncio.run(scenario())
+    engine.dispose()
+
+
+def test_writes_publish_changes(client: TestClient, monkeypatch):
+    published = []
+    monkeypatch.setattr(events.hub, "publish", lambda event, data: published.append(data))
+
+    list_id = client.post("/lists/", json={"name": "Party"}).json()["id"]
+    household_id = client.post(
+        "/households/", json={"name": "The Lees", "address": "3 Ash Ct", "members": []}
+    ).json()["id"]
+    client.post(f"/lists/{list_id}/households/{household_id}")
+    client.get(f"/lists/{list_id}")
+    # A failed write announces nothing
+    client.delete("/households/999")
+
+    assert published == [
+        {"kind": "list", "ids": [list_id]},
+        {"kind": "household", "ids": [household_id]},
+        {"kind": "list", "ids": [list_id]},
+    ]
+
+
+def test_events_endpoint_streams(monkeypatch):
+    hub = EventHub()
+    monkeypatch.setattr("app.main.hub", hub)
+
+    async def scenario():
+        request = Request({"type": "http", "headers": [(b"last-event-id", hub.last_id.encode())]})
+        response = await get_events(request)
+        assert response.media_type == "text/event-stream"
+        assert response.headers["cache-control"] == "no-cache"
+
+        body = response.body_iterator
+        _, first = await take(body, 2)
+        assert parse(first)["event"] == "ready"
+        hub.publish("change", {"kind": "list", "ids": [1]})
+        assert parse(await anext(body))["data"] == {"kind": "list", "ids": [1]}
+        hub.close()
+        assert [message async for message in body] == []
+
+    asyncio.run(scenario())
+
+
+def test_events_endpoint_refuses_when_full(client: TestClient, monkeypatch):
+    hub = EventHub(max_clients=0)
+    monkeypatch.setattr("app.main.hub", hub)
+
+    response = client.get("/events")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
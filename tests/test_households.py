@@ -1,4 +1,12 @@
+import csv
+import io
+import json
+
 from fastapi.testclient import TestClient
+from sqlalchemy import Engine, event
+from sqlmodel import Session, func, select
+
+from app.models import ListHouseholdLink, Member
 
 
 def test_root(client: TestClient):
@@ -68,6 +76,207 @@ def test_list_households(client: TestClient):
     assert data[-1]["name"] == "Test Household"
 
 
+def test_list_households_paginated(client: TestClient):
+    for i in range(5):
+        client.post(
+            "/households/",
+            json={
+                "name": f"Page Household {i}",
+                "address": f"{i} Page St",
+                "members": [{"first_name": "Page", "last_name": str(i), "email": None, "phone": None}],
+            },
+        )
+
+    first_page = client.get("/households/", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert [h["name"] for h in first_page.json()] == ["Page Household 0", "Page Household 1"]
+    cursor = first_page.headers["X-Next-Cursor"]
+    assert cursor == str(first_page.json()[-1]["id"])
+
+    second_page = client.get("/households/", params={"limit": 2, "after": cursor})
+    assert [h["name"] for h in second_page.json()] == ["Page Household 2", "Page Household 3"]
+    assert len(second_page.json()[0]["members"]) == 1
+
+    last_page = client.get(
+        "/households/", params={"limit": 2, "after": second_page.headers["X-Next-Cursor"]}
+    )
+    assert [h["name"] for h in last_page.json()] == ["Page Household 4"]
+    assert "X-Next-Cursor" not in last_page.headers
+
+
+def test_list_households_limit_out_of_range(client: TestClient):
+    assert client.get("/households/", params={"limit": 0}).status_code == 422
+    assert client.get("/households/", params={"limit": 100000}).status_code == 422
+
+
+def test_list_households_loads_members_in_one_query(client: TestClient, session: Session):
+    for i in range(10):
+        client.post(
+            "/households/",
+            json={
+                "name": f"Query Household {i}",
+                "address": f"{i} Query St",
+                "members": [{"first_name": "Query", "last_name": str(i), "email": None, "phone": None}],
+            },
+        )
+    session.expunge_all()
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/households/")
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_statement)
+
+    assert len(response.json()) == 10
+    assert all(len(h["members"]) == 1 for h in response.json())
+    # Table versions for the ETag, the page of households, and their members
+    assert len(statements) == 3
+
+
+def test_get_household_not_modified(client: TestClient):
+    response = client.post(
+        "/households/", json={"name": "ETag Household", "address": "1 ETag St", "members": []}
+    )
+    household_id = response.json()["id"]
+
+    response = client.get(f"/households/{household_id}")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "no-cache"
+
+    response = client.get(f"/households/{household_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    client.post(
+        f"/households/{household_id}/members",
+        json={"first_name": "New", "last_name": "Member", "email": None, "phone": None},
+    )
+    response = client.get(f"/households/{household_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert len(response.json()["members"]) == 1
+
+
+def test_if_none_match_star_needs_the_resource_to_exist(client: TestClient):
+    household = client.post(
+        "/households/", json={"name": "Star", "address": "1 Star St", "members": []}
+    ).json()
+    star = {"If-None-Match": "*"}
+
+    assert client.get(f"/households/{household['id']}", headers=star).status_code == 304
+    assert client.get("/households/999999", headers=star).status_code == 404
+    assert client.get("/contacts/424242", headers=star).status_code == 404
+    assert client.get("/lists/424242", headers=star).status_code == 404
+    assert client.get("/lists/424242/households", headers=star).status_code == 404
+
+
+def test_list_households_not_modified(client: TestClient):
+    etag = client.get("/households/").headers["etag"]
+    assert client.get("/households/", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/households/", json={"name": "Another", "address": "2 ETag St", "members": []})
+    assert client.get("/households/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_update_household_if_match(client: TestClient):
+    response = client.post(
+        "/households/", json={"name": "Match Household", "address": "1 Match St", "members": []}
+    )
+    household_id = response.json()["id"]
+    etag = client.get(f"/households/{household_id}").headers["etag"]
+
+    response = client.patch(
+        f"/households/{household_id}", json={"name": "First"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    new_etag = response.headers["etag"]
+    assert new_etag != etag
+
+    # A second writer still holding the old ETag is refused
+    response = client.patch(
+        f"/households/{household_id}", json={"name": "Second"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    response = client.delete(f"/households/{household_id}", headers={"If-Match": etag})
+    assert response.status_code == 412
+
+    response = client.delete(f"/households/{household_id}", headers={"If-Match": new_etag})
+    assert response.status_code == 200
+
+
+def test_household_etags_ignore_writes_to_other_households(client: TestClient):
+    first, second = (
+        client.post(
+            "/households/",
+            json={
+                "name": name,
+                "address": f"1 {name} St",
+                "members": [{"first_name": name, "last_name": "X"}],
+            },
+        ).json()
+        for name in ["First", "Second"]
+    )
+    etag = client.get(f"/households/{first['id']}").headers["etag"]
+
+    client.patch(f"/households/{second['id']}", json={"name": "Changed"})
+    client.post(
+        f"/households/{second['id']}/members", json={"first_name": "New", "last_name": "Member"}
+    )
+    response = client.patch(
+        f"/households/{first['id']}", json={"name": "Mine"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+
+    # Its own members are part of it
+    etag = response.headers["etag"]
+    member_id = first["members"][0]["id"]
+    client.patch(f"/households/{first['id']}/members/{member_id}", json={"first_name": "Renamed"})
+    response = client.delete(f"/households/{first['id']}", headers={"If-Match": etag})
+    assert response.status_code == 412
+
+
+def test_fast_json_matches_regular_responses(client: TestClient, monkeypatch):
+    household_ids = [
+        client.post(
+            "/households/",
+            json={
+                "name": f"Fast Ünïcode {i}",
+                "address": f"{i} Fast St",
+                "members": [
+                    {"first_name": "Fast", "last_name": str(j), "email": None, "phone": "555"}
+                    for j in range(i)
+                ],
+            },
+        ).json()["id"]
+        for i in range(4)
+    ]
+    list_id = client.post("/lists/", json={"name": "Fast"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/bulk", json={"household_ids": household_ids})
+
+    urls = [
+        "/households/?limit=3",
+        "/households/search?q=fast&limit=3",
+        f"/lists/{list_id}/households?sort=name&limit=3",
+    ]
+    regular = [client.get(url) for url in urls]
+    monkeypatch.setattr("app.routers.households.FAST_JSON", True)
+    monkeypatch.setattr("app.routers.lists.FAST_JSON", True)
+    fast = [client.get(url) for url in urls]
+
+    for before, after in zip(regular, fast):
+        assert after.status_code == 200
+        assert after.content == before.content
+        assert after.headers["content-type"] == before.headers["content-type"]
+        for header in ("etag", "x-next-cursor", "x-next-offset"):
+            assert after.headers.get(header) == before.headers.get(header)
+
+
 def test_get_household(client: TestClient):
     # Create a household
     create_response = client.post(
@@ -131,6 +340,112 @@ def test_update_household_not_found(client: TestClient):
     assert response.status_code == 404
 
 
+def test_replace_household(client: TestClient):
+    create_response = client.post(
+        "/households/",
+        json={
+            "name": "Full Household",
+            "address": "1 Full St",
+            "members": [
+                {"first_name": "Keep", "last_name": "Same", "email": "keep@example.com", "phone": None},
+                {"first_name": "Old", "last_name": "Name", "email": None, "phone": "555-0001"},
+                {"first_name": "Gone", "last_name": "Soon", "email": None, "phone": None},
+            ],
+        },
+    )
+    household_id = create_response.json()["id"]
+    keep, rename, gone = create_response.json()["members"]
+
+    response = client.put(
+        f"/households/{household_id}/full",
+        json={
+            "name": "Renamed Household",
+            "address": "2 Full St",
+            "members": [
+                keep,
+                {**rename, "first_name": "New"},
+                {"first_name": "Added", "last_name": "Member", "email": None, "phone": None},
+                {"first_name": "", "last_name": "", "email": None, "phone": None},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["name"] == "Renamed Household"
+    assert data["address"] == "2 Full St"
+    assert [m["first_name"] for m in data["members"]] == ["Keep", "New", "Added"]
+    assert data["members"][0] == keep
+    assert data["members"][1] == {**rename, "first_name": "New"}
+    assert gone["id"] not in [m["id"] for m in data["members"]]
+    assert client.get(f"/households/{household_id}").json() == data
+
+
+def test_replace_household_writes_once(client: TestClient, session: Session):
+    create_response = client.post(
+        "/households/",
+        json={
+            "name": "Batch Household",
+            "address": "1 Batch St",
+            "members": [
+                {"first_name": str(i), "last_name": "Batch", "email": None, "phone": None}
+                for i in range(6)
+            ],
+        },
+    )
+    household_id = create_response.json()["id"]
+    members = create_response.json()["members"]
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0])
+
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.put(
+            f"/households/{household_id}/full",
+            json={
+                "name": "Batch Household",
+                "address": "1 Batch St",
+                "members": [{**m, "last_name": "Changed"} for m in members[:3]]
+                + [{"first_name": str(i), "last_name": "New"} for i in range(3)],
+            },
+        )
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_statement)
+
+    assert response.status_code == 200
+    assert len(response.json()["members"]) == 6
+    assert statements.count("UPDATE") == 1
+    assert statements.count("INSERT") == 1
+    assert statements.count("DELETE") == 1
+
+
+def test_replace_household_rejects_foreign_member(client: TestClient):
+    first = client.post(
+        "/households/",
+        json={"name": "First", "address": "1 St", "members": [{"first_name": "A", "last_name": "B"}]},
+    ).json()
+    second = client.post(
+        "/households/", json={"name": "Second", "address": "2 St", "members": []}
+    ).json()
+
+    response = client.put(
+        f"/households/{second['id']}/full",
+        json={"name": "Second", "address": "2 St", "members": first["members"]},
+    )
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Member not found in this household"}
+
+    # Nothing was written
+    assert client.get(f"/households/{first['id']}").json() == first
+
+    response = client.put(
+        "/households/999/full", json={"name": "Nobody", "address": "Nowhere", "members": []}
+    )
+    assert response.status_code == 404
+
+
 def test_delete_household(client: TestClient):
     # Create a household
     create_response = client.post(
@@ -320,3 +635,324 @@ def test_cascade_delete_members(client: TestClient):
     # Verify household is deleted
     get_response = client.get(f"/households/{household_id}")
     assert get_response.status_code == 404
+
+
+def test_bulk_delete_households(client: TestClient, session: Session):
+    household_ids = [
+        client.post(
+            "/households/",
+            json={
+                "name": f"Bulk Delete {i}",
+                "address": f"{i} Gone St",
+                "members": [{"first_name": "Gone", "last_name": str(i), "email": None, "phone": None}],
+            },
+        ).json()["id"]
+        for i in range(3)
+    ]
+    list_id = client.post("/lists/", json={"name": "Bulk Delete List"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/bulk", json={"household_ids": household_ids})
+
+    response = client.post(
+        "/households/bulk-delete", json={"household_ids": [*household_ids[:2], 99999]}
+    )
+    assert response.status_code == 200
+    assert response.json()["deleted"] == 2
+
+    assert client.get(f"/households/{household_ids[0]}").status_code == 404
+    assert client.get(f"/households/{household_ids[2]}").status_code == 200
+    # Members and list memberships went with their households
+    assert session.exec(select(func.count()).select_from(Member)).one() == 1
+    assert session.exec(select(func.count()).select_from(ListHouseholdLink)).one() == 1
+
+
+def test_delete_household_cascades_in_database(client: TestClient, session: Session):
+    household_id = client.post(
+        "/households/",
+        json={
+            "name": "Cascade In Database",
+            "address": "1 Cascade St",
+            "members": [{"first_name": "Only", "last_name": "Member", "email": None, "phone": None}],
+        },
+    ).json()["id"]
+    session.expunge_all()
+
+    assert client.delete(f"/households/{household_id}").status_code == 200
+    assert session.exec(select(func.count()).select_from(Member)).one() == 0
+
+
+def test_export_households_ndjson(client: TestClient, monkeypatch):
+    # Small batches so households straddle batch boundaries
+    monkeypatch.setattr("app.export.EXPORT_BATCH_SIZE", 2)
+    created = [
+        client.post(
+            "/households/",
+            json={
+                "name": f"Export {i}",
+                "address": f"{i} Export St",
+                "members": [
+                    {"first_name": "First", "last_name": str(i), "email": None, "phone": None},
+                    {"first_name": "Second", "last_name": str(i), "email": None, "phone": "555"},
+                ][:i],
+            },
+        ).json()
+        for i in range(3)
+    ]
+
+    response = client.get("/households/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="households.ndjson"' in response.headers["content-disposition"]
+
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert exported == created
+
+
+def test_export_households_csv(client: TestClient):
+    household = client.post(
+        "/households/",
+        json={
+            "name": "Export, CSV",
+            "address": "1 Comma Ct",
+            "members": [
+                {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "phone": None},
+                {"first_name": "Bo", "last_name": "Lee", "email": None, "phone": None},
+            ],
+        },
+    ).json()
+    empty = client.post(
+        "/households/", json={"name": "Empty", "address": "2 Empty Rd", "members": []}
+    ).json()
+
+    response = client.get("/households/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["household_name"], row["first_name"]) for row in rows] == [
+        ("Export, CSV", "Ann"),
+        ("Export, CSV", "Bo"),
+        ("Empty", ""),
+    ]
+    assert rows[0]["household_id"] == str(household["id"])
+    assert rows[0]["email"] == "ann@example.com"
+    assert rows[2]["household_id"] == str(empty["id"])
+
+
+def test_export_households_unknown_format(client: TestClient):
+    assert client.get("/households/export", params={"format": "xml"}).status_code == 422
+
+
+def create_search_fixtures(client: TestClient) -> dict[str, int]:
+    households = {
+        "smith": {
+            "name": "The Smith's",
+            "address": "12 Maple Avenue",
+            "members": [
+                {"first_name": "John", "last_name": "Smith", "email": "john@example.com", "phone": None},
+            ],
+        },
+        "garcia": {
+            "name": "The Garcia's",
+            "address": "99 Oak Street",
+            "members": [
+                {"first_name": "Maria", "last_name": "Garcia", "email": None, "phone": "555-867-5309"},
+                {"first_name": "Luis", "last_name": "Smithers", "email": None, "phone": None},
+            ],
+        },
+        "jones": {
+            "name": "The Jones's",
+            "address": "7 Birch Road",
+            "members": [],
+        },
+    }
+    return {
+        key: client.post("/households/", json=household).json()["id"]
+        for key, household in households.items()
+    }
+
+
+def test_search_households(client: TestClient):
+    ids = create_search_fixtures(client)
+
+    # Name match ranks ahead of a member-name match
+    response = client.get("/households/search", params={"q": "smith"})
+    assert response.status_code == 200
+    assert [h["id"] for h in response.json()] == [ids["smith"], ids["garcia"]]
+    assert len(response.json()[1]["members"]) == 2
+
+    assert [h["id"] for h in client.get("/households/search", params={"q": "oak"}).json()] == [
+        ids["garcia"]
+    ]
+    assert [h["id"] for h in client.get("/households/search", params={"q": "867"}).json()] == [
+        ids["garcia"]
+    ]
+    assert [
+        h["id"] for h in client.get("/households/search", params={"q": "john@example"}).json()
+    ] == [ids["smith"]]
+    # Every word has to match
+    assert client.get("/households/search", params={"q": "maria birch"}).json() == []
+    # Punctuation alone matches nothing
+    assert client.get("/households/search", params={"q": "\"*'"}).json() == []
+
+
+def test_search_households_requires_query(client: TestClient):
+    assert client.get("/households/search").status_code == 422
+    assert client.get("/households/search", params={"q": ""}).status_code == 422
+
+
+def test_search_households_tracks_changes(client: TestClient):
+    ids = create_search_fixtures(client)
+
+    client.patch(f"/households/{ids['jones']}", json={"name": "The Whitfields"})
+    assert client.get("/households/search", params={"q": "jones"}).json() == []
+    assert [h["id"] for h in client.get("/households/search", params={"q": "whitfield"}).json()] == [
+        ids["jones"]
+    ]
+
+    member = client.post(
+        f"/households/{ids['jones']}/members",
+        json={"first_name": "Priya", "last_name": "Whitfield", "email": None, "phone": None},
+    ).json()
+    assert [h["id"] for h in client.get("/households/search", params={"q": "priya"}).json()] == [
+        ids["jones"]
+    ]
+
+    client.patch(f"/households/{ids['jones']}/members/{member['id']}", json={"first_name": "Asha"})
+    assert client.get("/households/search", params={"q": "priya"}).json() == []
+    assert len(client.get("/households/search", params={"q": "asha"}).json()) == 1
+
+    client.delete(f"/households/{ids['jones']}/members/{member['id']}")
+    assert client.get("/households/search", params={"q": "asha"}).json() == []
+
+    client.delete(f"/households/{ids['garcia']}")
+    assert [h["id"] for h in client.get("/households/search", params={"q": "smith"}).json()] == [
+        ids["smith"]
+    ]
+
+
+def test_search_households_paginated(client: TestClient):
+    for i in range(5):
+        client.post(
+            "/households/",
+            json={"name": f"Lakeside {i}", "address": f"{i} Shore Dr", "members": []},
+        )
+
+    first_page = client.get("/households/search", params={"q": "lakeside", "limit": 3})
+    assert len(first_page.json()) == 3
+    assert first_page.headers["X-Next-Offset"] == "3"
+
+    second_page = client.get(
+        "/households/search", params={"q": "lakeside", "limit": 3, "offset": 3}
+    )
+    assert len(second_page.json()) == 2
+    assert "X-Next-Offset" not in second_page.headers
+    assert {h["id"] for h in first_page.json()}.isdisjoint(h["id"] for h in second_page.json())
+
+
+def test_import_households_ndjson(client: TestClient, monkeypatch):
+    monkeypatch.setattr("app.importer.IMPORT_BATCH_SIZE", 2)
+    lines = [
+        json.dumps(
+            {
+                "name": f"Imported {i}",
+                "address": f"{i} Import Way",
+                "members": [{"first_name": "Imp", "last_name": str(i), "email": None, "phone": None}],
+            }
+        )
+        for i in range(5)
+    ]
+    lines.insert(2, "{not json")
+    lines.insert(4, json.dumps({"name": "Missing address", "members": []}))
+    lines.append("")
+
+    response = client.post("/households/import", content="\n".join(lines))
+    report = response.json()
+
+    assert response.status_code == 200
+    assert report["households"] == 5
+    assert report["members"] == 5
+    assert report["error_count"] == 2
+    assert [error["line"] for error in report["errors"]] == [3, 5]
+    assert "address" in report["errors"][1]["error"]
+
+    households = client.get("/households/").json()
+    assert [h["name"] for h in households] == [f"Imported {i}" for i in range(5)]
+    assert households[4]["members"][0]["last_name"] == "4"
+    assert len(client.get("/households/search", params={"q": "imported"}).json()) == 5
+
+
+def test_import_households_csv_round_trip(client: TestClient):
+    client.post(
+        "/households/",
+        json={
+            "name": "Round, Trip",
+            "address": "1 Loop Rd",
+            "members": [
+                {"first_name": "Ann", "last_name": "Trip", "email": "ann@example.com", "phone": None},
+                {"first_name": "Bo", "last_name": "Trip", "email": None, "phone": "555-0100"},
+            ],
+        },
+    )
+    client.post("/households/", json={"name": "No Members", "address": "2 Loop Rd", "members": []})
+    exported = client.get("/households/export", params={"format": "csv"}).text
+
+    response = client.post("/households/import", params={"format": "csv"}, content=exported)
+    assert response.json()["households"] == 2
+    assert response.json()["members"] == 2
+
+    def without_ids(household):
+        return {
+            "name": household["name"],
+            "address": household["address"],
+            "members": [
+                {key: value for key, value in member.items() if key != "id"}
+                for member in household["members"]
+            ],
+        }
+
+    households = client.get("/households/").json()
+    assert [without_ids(h) for h in households[2:]] == [without_ids(h) for h in households[:2]]
+
+
+def test_import_csv_field_split_across_chunks(client: TestClient):
+    body = (
+        b"household_name,address,first_name,last_name,email,phone\n"
+        b'Two Lines,"12 Oak St\nApt 4",Ann,Oak,,\n'
+        b'Next,"3 Elm St",Bo,Elm,,\n'
+    )
+    split = body.index(b"Apt")
+
+    response = client.post(
+        "/households/import",
+        params={"format": "csv"},
+        content=iter([body[:split], body[split:]]),
+    )
+
+    assert response.json()["households"] == 2
+    assert response.json()["error_count"] == 0
+    households = client.get("/households/").json()
+    assert [(h["name"], h["address"]) for h in households] == [
+        ("Two Lines", "12 Oak St\nApt 4"),
+        ("Next", "3 Elm St"),
+    ]
+
+
+def test_import_csv_unterminated_quoted_field(client: TestClient):
+    body = (
+        b"household_name,address,first_name,last_name\n"
+        b"Whole,1 Good St,Al,Go\n"
+        b'X,"1 Unclosed St,Jo,Do\n'
+        b"Y,2 Lost St,Li,Lo\n"
+    )
+
+    response = client.post("/households/import", params={"format": "csv"}, content=body)
+
+    assert response.json()["households"] == 1
+    assert response.json()["errors"] == [{"line": 3, "error": "Unterminated quoted field"}]
+    assert [h["name"] for h in client.get("/households/").json()] == ["Whole"]
+
+    # Open in a member's column, the row takes its household with it
+    body = b'household_name,address,first_name,last_name\nZ,3 St,Al,Go\nZ,3 St,"Jo,Do\n'
+    response = client.post("/households/import", params={"format": "csv"}, content=body)
+    assert response.json()["households"] == 0
+    assert response.json()["error_count"] == 1
@@ -0,0 +1,40 @@
+import json
+
+from sqlmodel import Session, func, select
+
+from app import importer
+from app.database import create_db_engine
+from app.models import Household, Member
+
+
+def test_cli_imports_file(tmp_path, monkeypatch, capsys):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    monkeypatch.setattr(importer, "engine", engine)
+
+    path = tmp_path / "households.ndjson"
+    path.write_text(
+        "\n".join(
+            json.dumps(
+                {
+                    "name": f"CLI {i}",
+                    "address": f"{i} Command Ln",
+                    "members": [
+                        {"first_name": "A", "last_name": str(i), "email": None, "phone": None},
+                        {"first_name": "", "last_name": "", "email": None, "phone": None},
+                    ],
+                }
+            )
+            for i in range(25)
+        )
+        + "\n{}\n"
+    )
+
+    assert importer.main([str(path), "--batch-size", "10"]) == 1
+
+    output = capsys.readouterr().out
+    assert "Imported 25 households and 25 members" in output
+    assert "Line 26" in output
+    with Session(engine) as session:
+        assert session.exec(select(func.count()).select_from(Household)).one() == 25
+        assert session.exec(select(func.count()).select_from(Member)).one() == 25
+    engine.dispose()
@@ -1,3 +1,7 @@
+import csv
+import io
+import json
+
 from fastapi.testclient import TestClient
 
 
@@ -39,6 +43,29 @@ def test_list_lists(client: TestClient):
     assert len(data) >= 2
 
 
+def test_list_lists_household_counts(client: TestClient):
+    household_ids = [
+        client.post(
+            "/households/",
+            json={"name": f"Count {i}", "address": f"{i} Count St", "members": []},
+        ).json()["id"]
+        for i in range(3)
+    ]
+    full_id = client.post("/lists/", json={"name": "Full"}).json()["id"]
+    partial_id = client.post("/lists/", json={"name": "Partial"}).json()["id"]
+    empty_id = client.post("/lists/", json={"name": "Empty"}).json()["id"]
+
+    client.post(f"/lists/{full_id}/households/bulk", json={"household_ids": household_ids})
+    client.post(f"/lists/{partial_id}/households/{household_ids[0]}")
+
+    counts = {lst["id"]: lst["household_count"] for lst in client.get("/lists/").json()}
+    assert counts == {full_id: 3, partial_id: 1, empty_id: 0}
+
+    client.delete(f"/lists/{full_id}/households/{household_ids[1]}")
+    response = client.patch(f"/lists/{full_id}", json={"description": "Two left"})
+    assert response.json()["household_count"] == 2
+
+
 def test_get_list(client: TestClient):
     # Create a list
     create_response = client.post(
@@ -54,7 +81,112 @@ def test_get_list(client: TestClient):
     assert data["id"] == list_id
     assert data["name"] == "Get Test List"
     assert data["description"] == "Testing get"
-    assert "households" in data
+    assert data["household_count"] == 0
+    assert "households" not in data
+
+
+def test_get_list_not_modified(client: TestClient):
+    list_id = client.post("/lists/", json={"name": "ETag List"}).json()["id"]
+    household_id = client.post(
+        "/households/", json={"name": "Listed", "address": "1 List St", "members": []}
+    ).json()["id"]
+    client.post(f"/lists/{list_id}/households/{household_id}")
+
+    url = f"/lists/{list_id}/households"
+    etag = client.get(url).headers["etag"]
+    list_etag = client.get(f"/lists/{list_id}").headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/lists/{list_id}", headers={"If-None-Match": list_etag}).status_code == 304
+
+    # Renaming a household on the list changes its households but not its header
+    client.patch(f"/households/{household_id}", json={"name": "Renamed"})
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(f"/lists/{list_id}", headers={"If-None-Match": list_etag}).status_code == 304
+
+    client.delete(f"/lists/{list_id}/households/{household_id}")
+    assert client.get(f"/lists/{list_id}", headers={"If-None-Match": list_etag}).status_code == 200
+
+
+def test_update_list_if_match(client: TestClient):
+    list_id = client.post("/lists/", json={"name": "Match List"}).json()["id"]
+    etag = client.get(f"/lists/{list_id}").headers["etag"]
+
+    client.patch(f"/lists/{list_id}", json={"name": "Changed"})
+    response = client.patch(f"/lists/{list_id}", json={"name": "Stale"}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert client.delete(f"/lists/{list_id}", headers={"If-Match": etag}).status_code == 412
+    assert client.delete(f"/lists/{list_id}", headers={"If-Match": "*"}).status_code == 200
+
+
+def test_list_etags_ignore_writes_to_other_lists(client: TestClient):
+    list_id, other_id = (client.post("/lists/", json={"name": name}).json()["id"] for name in "AB")
+    etag = client.get(f"/lists/{list_id}").headers["etag"]
+
+    client.patch(f"/lists/{other_id}", json={"name": "Changed"})
+    response = client.patch(f"/lists/{list_id}", json={"name": "Mine"}, headers={"If-Match": etag})
+    assert response.status_code == 200
+
+
+def test_list_households_in_list_pages(client: TestClient):
+    names = ["Delta", "alpha", "Charlie", "Bravo", "Alpha", "Echo", "Charlie"]
+    household_ids = [
+        client.post(
+            "/households/",
+            json={
+                "name": name,
+                "address": f"{i} Page St",
+                "members": [{"first_name": name, "last_name": "Page"}],
+            },
+        ).json()["id"]
+        for i, name in enumerate(names)
+    ]
+    outsider = client.post(
+        "/households/", json={"name": "Outsider", "address": "Elsewhere", "members": []}
+    )
+    list_id = client.post("/lists/", json={"name": "Paged"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/bulk", json={"household_ids": household_ids})
+
+    def read_all(**params):
+        seen, after = [], None
+        while True:
+            response = client.get(
+                f"/lists/{list_id}/households",
+                params={**params, "limit": 2, **({"after": after} if after else {})},
+            )
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            assert all(len(h["members"]) == 1 for h in page)
+            seen.extend(page)
+            after = response.headers.get("x-next-cursor")
+            if after is None:
+                return seen
+
+    assert [h["id"] for h in read_all()] == household_ids
+    assert outsider.json()["id"] not in [h["id"] for h in read_all()]
+
+    by_name = read_all(sort="name")
+    assert [h["name"] for h in by_name] == sorted(names)
+    # Ties on the sort column are broken by ID
+    charlies = [h["id"] for h in by_name if h["name"] == "Charlie"]
+    assert charlies == sorted(charlies)
+
+    assert [h["name"] for h in read_all(sort="name", order="desc")] == sorted(names, reverse=True)
+    assert [h["id"] for h in read_all(order="desc")] == household_ids[::-1]
+
+    assert sorted(h["name"] for h in read_all(q="char")) == ["Charlie", "Charlie"]
+    assert [h["name"] for h in read_all(q="alpha", sort="name")] == ["Alpha", "alpha"]
+
+
+def test_list_households_in_list_errors(client: TestClient):
+    assert client.get("/lists/99999/households").status_code == 404
+
+    list_id = client.post("/lists/", json={"name": "Errors"}).json()["id"]
+    response = client.get(f"/lists/{list_id}/households", params={"sort": "name", "after": "nope"})
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Invalid cursor"}
+    response = client.get(f"/lists/{list_id}/households", params={"sort": "members"})
+    assert response.status_code == 422
 
 
 def test_get_list_not_found(client: TestClient):
@@ -62,6 +194,33 @@ def test_get_list_not_found(client: TestClient):
     assert response.status_code == 404
 
 
+def test_export_list(client: TestClient):
+    on_list = client.post(
+        "/households/",
+        json={
+            "name": "On List",
+            "address": "1 List St",
+            "members": [{"first_name": "Ada", "last_name": "List", "email": None, "phone": None}],
+        },
+    ).json()
+    client.post("/households/", json={"name": "Off List", "address": "2 List St", "members": []})
+    list_id = client.post("/lists/", json={"name": "Export"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/{on_list['id']}")
+
+    response = client.get(f"/lists/{list_id}/export")
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [on_list]
+
+    response = client.get(f"/lists/{list_id}/export", params={"format": "csv"})
+    assert f'filename="list-{list_id}.csv"' in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["household_name"], row["first_name"]) for row in rows] == [("On List", "Ada")]
+
+
+def test_export_list_not_found(client: TestClient):
+    assert client.get("/lists/99999/export").status_code == 404
+
+
 def test_update_list(client: TestClient):
     # Create a list
     create_response = client.post(
@@ -126,9 +285,9 @@ def test_add_household_to_list(client: TestClient):
     assert response.status_code == 200
 
     # Verify household is in list
-    list_data = client.get(f"/lists/{list_id}").json()
-    assert len(list_data["households"]) == 1
-    assert list_data["households"][0]["id"] == household_id
+    list_households = client.get(f"/lists/{list_id}/households").json()
+    assert len(list_households) == 1
+    assert list_households[0]["id"] == household_id
 
 
 def test_add_household_to_list_duplicate(client: TestClient):
@@ -192,8 +351,8 @@ def test_add_multiple_households_to_list(client: TestClient):
     assert "3" in data["message"]
 
     # Verify all households are in list
-    list_data = client.get(f"/lists/{list_id}").json()
-    assert len(list_data["households"]) == 3
+    list_households = client.get(f"/lists/{list_id}/households").json()
+    assert len(list_households) == 3
 
 
 def test_bulk_add_with_invalid_ids(client: TestClient):
@@ -218,6 +377,38 @@ def test_bulk_add_with_invalid_ids(client: TestClient):
     assert "1" in data["message"]
 
 
+def test_bulk_add_reports_outcome_per_id(client: TestClient, monkeypatch):
+    # Use a tiny chunk size so the request spans several chunks
+    monkeypatch.setattr("app.routers.lists.BULK_CHUNK_SIZE", 2)
+
+    household_ids = [
+        client.post(
+            "/households/",
+            json={"name": f"Bulk {i}", "address": f"{i} Bulk St", "members": []},
+        ).json()["id"]
+        for i in range(4)
+    ]
+    list_id = client.post("/lists/", json={"name": "Chunked"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/{household_ids[1]}")
+
+    response = client.post(
+        f"/lists/{list_id}/households/bulk",
+        json={"household_ids": [*household_ids, 99999, household_ids[0]]},
+    )
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["added"] == [household_ids[0], household_ids[2], household_ids[3]]
+    assert data["already_present"] == [household_ids[1]]
+    assert data["unknown"] == [99999]
+    assert client.get("/lists/").json()[0]["household_count"] == 4
+
+
+def test_bulk_add_to_nonexistent_list(client: TestClient):
+    response = client.post("/lists/99999/households/bulk", json={"household_ids": [1]})
+    assert response.status_code == 404
+
+
 def test_remove_household_from_list(client: TestClient):
     # Create household and list
     household_id = client.post(
@@ -234,8 +425,37 @@ def test_remove_household_from_list(client: TestClient):
     assert response.status_code == 200
 
     # Verify household is removed
-    list_data = client.get(f"/lists/{list_id}").json()
-    assert len(list_data["households"]) == 0
+    list_households = client.get(f"/lists/{list_id}/households").json()
+    assert len(list_households) == 0
+
+
+def test_bulk_remove_households_from_list(client: TestClient):
+    household_ids = [
+        client.post(
+            "/households/",
+            json={"name": f"Remove {i}", "address": f"{i} Remove St", "members": []},
+        ).json()["id"]
+        for i in range(3)
+    ]
+    list_id = client.post("/lists/", json={"name": "Bulk Remove"}).json()["id"]
+    client.post(f"/lists/{list_id}/households/bulk", json={"household_ids": household_ids})
+
+    response = client.post(
+        f"/lists/{list_id}/households/bulk-delete",
+        json={"household_ids": [household_ids[0], household_ids[1], 99999]},
+    )
+    assert response.status_code == 200
+    assert response.json()["removed"] == 2
+
+    list_households = client.get(f"/lists/{list_id}/households").json()
+    assert [h["id"] for h in list_households] == [household_ids[2]]
+    # The households themselves are untouched
+    assert client.get(f"/households/{household_ids[0]}").status_code == 200
+
+
+def test_bulk_remove_from_nonexistent_list(client: TestClient):
+    response = client.post("/lists/99999/households/bulk-delete", json={"household_ids": [1]})
+    assert response.status_code == 404
 
 
 def test_remove_household_not_in_list(client: TestClient):
@@ -288,8 +508,8 @@ def test_delete_household_removes_from_lists(client: TestClient):
     client.delete(f"/households/{household_id}")
 
     # Verify household is removed from both lists
-    list1_data = client.get(f"/lists/{list1_id}").json()
-    list2_data = client.get(f"/lists/{list2_id}").json()
+    list1_households = client.get(f"/lists/{list1_id}/households").json()
+    list2_households = client.get(f"/lists/{list2_id}/households").json()
 
-    assert len(list1_data["households"]) == 0
-    assert len(list2_data["households"]) == 0
+    assert len(list1_households) == 0
+    assert len(list2_households) == 0
@@ -0,0 +1,118 @@
+import logging
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app import metrics as metrics_module
+from app.database import create_db_engine
+from app.metrics import RequestMetrics, current_metrics, statement_shape
+from app.models import Household
+
+
+def create_household(client: TestClient, name: str = "Timed") -> int:
+    return client.post(
+        "/households/",
+        json={
+            "name": name,
+            "address": "1 Clock St",
+            "members": [
+                {"first_name": "A", "last_name": "B"},
+                {"first_name": "C", "last_name": "D"},
+            ],
+        },
+    ).json()["id"]
+
+
+def test_responses_carry_server_timing(client: TestClient, caplog):
+    household_id = create_household(client)
+
+    with caplog.at_level(logging.INFO, logger="app.requests"):
+        response = client.get(f"/households/{household_id}")
+
+    timing = response.headers["server-timing"]
+    assert timing.startswith("total;dur=")
+    assert "serialize;dur=" in timing
+    # The version lookup, the household and its members
+    assert 'desc="3 queries, ' in timing
+    [log] = [record.getMessage() for record in caplog.records if record.name == "app.requests"]
+    assert '"route": "/households/{household_id}"' in log
+    assert '"status": 200' in log
+
+
+def count_rows(session: Session) -> RequestMetrics:
+    for i in range(3):
+        session.add(Household(name=f"Row {i}", address=f"{i} Row St"))
+    session.commit()
+
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        session.exec(select(Household)).all()
+    finally:
+        current_metrics.reset(token)
+    return metrics
+
+
+def test_rows_fetched_are_counted(monkeypatch):
+    monkeypatch.setattr(metrics_module, "METRICS_COUNT_ROWS", True)
+    engine = create_db_engine("sqlite://", poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        metrics = count_rows(session)
+    engine.dispose()
+
+    assert (metrics.queries, metrics.rows) == (1, 3)
+
+
+def test_sqlite_rows_are_not_counted_by_default(session: Session):
+    # Counting them costs a Python call per row
+    metrics = count_rows(session)
+    assert (metrics.queries, metrics.rows) == (1, 0)
+
+
+def test_repeated_statements_are_flagged(session: Session):
+    households = [Household(name=f"Lazy {i}", address="1 Loop St") for i in range(12)]
+    session.add_all(households)
+    session.commit()
+    ids = [household.id for household in households]
+    session.expunge_all()
+
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        for household_id in ids:
+            session.get(Household, household_id)
+        session.exec(select(Household).where(Household.id.in_(ids[:2]))).all()
+        session.exec(select(Household).where(Household.id.in_(ids[:5]))).all()
+    finally:
+        current_metrics.reset(token)
+
+    [(shape, count)] = metrics.repeated_statements(threshold=10).items()
+    assert count == 12
+    assert "WHERE household.id = ?" in shape
+    assert len(metrics.shapes) == 2  # Both IN queries share one shape
+
+
+def test_statement_shape_collapses_in_lists():
+    assert statement_shape("SELECT a FROM t WHERE id IN (?, ?, ?)") == (
+        "SELECT a FROM t WHERE id IN (...)"
+    )
+    assert statement_shape("SELECT a FROM t WHERE id IN (%(p1)s, %(p2)s)") == (
+        "SELECT a FROM t WHERE id IN (...)"
+    )
+
+
+def test_metrics_endpoint(client: TestClient):
+    create_household(client)
+    client.get("/households/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_requests_total{method="GET",route="/households/",status="200"}' in body
+    assert 'http_request_queries_total{method="POST",route="/households/"}' in body
+    assert 'le="+Inf"' in body
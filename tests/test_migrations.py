@@ -0,0 +1,190 @@
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+
+from app import migrations
+from app.database import create_db_engine
+from app.migrations import SchemaVersionError, head, prepare_database, schema_version, upgrade
+from app.models import (
+    ChangeLog,
+    Contact,
+    Household,
+    ListHouseholdLink,
+    Member,
+    SchemaMigration,
+)
+from app.search import search_household_ids
+from app.spatial import find_in_box
+
+# The schema before migrations, foreign keys that cascade and secondary indexes
+LEGACY_SCHEMA = [
+    "CREATE TABLE household (name VARCHAR NOT NULL, address VARCHAR NOT NULL, "
+    "id INTEGER NOT NULL PRIMARY KEY)",
+    "CREATE TABLE list (name VARCHAR NOT NULL, description VARCHAR, id INTEGER NOT NULL, "
+    "PRIMARY KEY (id))",
+    "CREATE TABLE member (first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, email VARCHAR, "
+    "phone VARCHAR, id INTEGER NOT NULL PRIMARY KEY, household_id INTEGER NOT NULL, "
+    "FOREIGN KEY(household_id) REFERENCES household (id))",
+    "CREATE TABLE listhouseholdlink (list_id INTEGER NOT NULL, household_id INTEGER NOT NULL, "
+    "PRIMARY KEY (list_id, household_id), FOREIGN KEY(list_id) REFERENCES list (id), "
+    "FOREIGN KEY(household_id) REFERENCES household (id))",
+    "CREATE TABLE contact (first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, "
+    "email VARCHAR, phone VARCHAR, address VARCHAR, id INTEGER NOT NULL PRIMARY KEY)",
+]
+
+
+@pytest.fixture(name="legacy_engine")
+def legacy_engine_fixture(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = create_db_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("PRAGMA foreign_keys = OFF"))
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        for i in range(1, 8):
+            connection.execute(text(f"INSERT INTO household VALUES ('Old {i}', '{i} Old St', {i})"))
+        connection.execute(text("INSERT INTO member VALUES ('Zebulon', 'Old', NULL, NULL, 1, 1)"))
+        connection.execute(text("INSERT INTO list VALUES ('Old list', NULL, 1)"))
+        connection.execute(text("INSERT INTO listhouseholdlink VALUES (1, 1)"))
+        # Left behind by a household deleted before deletes cascaded
+        connection.execute(text("INSERT INTO listhouseholdlink VALUES (1, 99)"))
+    engine.dispose()
+
+    engine = create_db_engine(url)
+    yield engine
+    engine.dispose()
+
+
+def test_empty_database_is_created_at_the_latest_version(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'new.db'}")
+
+    prepare_database(engine)
+    prepare_database(engine)  # Already current: nothing to do
+
+    with Session(engine) as session:
+        versions = session.exec(select(SchemaMigration.version)).all()
+    assert versions == list(range(1, head() + 1))
+    engine.dispose()
+
+
+def test_outdated_database_is_refused(legacy_engine):
+    with pytest.raises(SchemaVersionError, match="version 0 but this code needs"):
+        prepare_database(legacy_engine)
+
+
+def test_newer_database_is_refused(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    prepare_database(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO schemamigration (version, description, applied_at) "
+                "VALUES (:version, 'From the future', '2100-01-01')"
+            ),
+            {"version": head() + 1},
+        )
+
+    with pytest.raises(SchemaVersionError):
+        prepare_database(engine, migrate=True)
+    engine.dispose()
+
+
+def test_upgrade_adopts_a_legacy_database(legacy_engine, monkeypatch):
+    # Several backfill batches, without waiting between them
+    monkeypatch.setattr(migrations, "MIGRATION_BATCH_SIZE", 3)
+    monkeypatch.setattr(migrations, "MIGRATION_BATCH_PAUSE", 0)
+
+    prepare_database(legacy_engine, migrate=True)
+
+    with legacy_engine.connect() as connection:
+        assert schema_version(connection) == head()
+    inspector = inspect(legacy_engine)
+    for table in ["member", "listhouseholdlink"]:
+        assert {fk["options"].get("ondelete") for fk in inspector.get_foreign_keys(table)} == {
+            "CASCADE"
+        }
+    assert {index["name"] for index in inspector.get_indexes("member")} == {
+        "ix_member_household_id",
+        "ix_member_last_name",
+    }
+    assert "ix_contact_email" in {index["name"] for index in inspector.get_indexes("contact")}
+    assert "ix_household_address_key" in {
+        index["name"] for index in inspector.get_indexes("household")
+    }
+
+    with Session(legacy_engine) as session:
+        assert session.exec(select(ListHouseholdLink)).all() == [
+            ListHouseholdLink(list_id=1, household_id=1)
+        ]
+        # Households already there were indexed in batches, and the member
+        # triggers survived the rebuild
+        assert search_household_ids(session, "zebulon", limit=10) == [1]
+        assert sorted(search_household_ids(session, "old", limit=10)) == list(range(1, 8))
+        assert session.get(Household, 2).address_key == "2 old st"
+        session.add(Member(first_name="Yolanda", last_name="New", household_id=7))
+        session.commit()
+        assert search_household_ids(session, "yolanda", limit=10) == [7]
+        # A new member changes its household's ETag
+        assert session.get(Household, 7).version == 1
+        assert session.exec(select(ChangeLog.table_name, ChangeLog.row_id)).all() == [
+            ("member", 2)
+        ]
+        # Coordinates set since the upgrade are indexed
+        household = session.get(Household, 3)
+        household.latitude, household.longitude = 41.08, -81.52
+        session.add(household)
+        session.commit()
+        assert find_in_box(session, 41, -82, 42, -81, None, 10) == [3]
+
+        session.delete(session.get(Household, 1))
+        session.commit()
+        assert session.exec(select(Member).where(Member.household_id == 1)).all() == []
+        assert session.exec(select(ListHouseholdLink)).all() == []
+
+    assert upgrade(legacy_engine) == []
+
+
+def test_interrupted_backfill_resumes(legacy_engine, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_BATCH_PAUSE", 0)
+    original = migrations.backfill_in_batches
+
+    def fail_after_first_batch(engine, table, sql, batch_size=None):
+        with engine.begin() as connection:
+            connection.execute(text(sql), {"start": 1, "end": 4})
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(migrations, "backfill_in_batches", fail_after_first_batch)
+    with pytest.raises(KeyboardInterrupt):
+        upgrade(legacy_engine)
+    with legacy_engine.connect() as connection:
+        assert schema_version(connection) == 0
+
+    monkeypatch.setattr(migrations, "backfill_in_batches", original)
+    assert upgrade(legacy_engine) == list(range(1, head() + 1))
+    with Session(legacy_engine) as session:
+        assert sorted(search_household_ids(session, "old", limit=10)) == list(range(1, 8))
+
+
+def test_contacts_moved_before_member_ids_are_matched_to_members(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'moved.db'}")
+    prepare_database(engine)
+    with Session(engine) as session:
+        household = Household(name="The Lee Household", address="3 Ash Ct")
+        session.add(household)
+        session.flush()
+        for first_name in ["Ann", "Ben"]:
+            session.add(Member(first_name=first_name, last_name="Lee", household_id=household.id))
+        # Moved by the job before it recorded members; Cal has been renamed since
+        for first_name in ["Ben", "Cal"]:
+            session.add(
+                Contact(first_name=first_name, last_name="Lee", household_id=household.id)
+            )
+        session.commit()
+
+    migrations.backfill_contact_members(engine)
+
+    with Session(engine) as session:
+        ben = session.exec(select(Member).where(Member.first_name == "Ben")).one()
+        contacts = session.exec(select(Contact).order_by(Contact.id)).all()
+        assert [contact.member_id for contact in contacts] == [ben.id, None]
+    engine.dispose()
@@ -0,0 +1,67 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from sqlalchemy import create_mock_engine, text
+
+from app import database, server
+from app.cache import MemoryCache
+from app.database import create_db_engine
+
+
+def test_forked_process_opens_its_own_connections(tmp_path, monkeypatch):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'fork.db'}")
+    monkeypatch.setattr(database, "engine", engine)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert engine.pool.checkedin() == 1
+
+    pid = os.fork()
+    if pid == 0:
+        # The parent's pooled connection must not be reused here
+        os._exit(0 if engine.pool.checkedin() == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert engine.pool.checkedin() == 1
+    engine.dispose()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_server_runs_workers_and_stops_on_sigterm(tmp_path):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port)]
+        + ["--workers", "2", "--graceful-timeout", "2"],
+        env={**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'server.db'}"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/lists/") as response:
+                    assert response.status == 200
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "server did not start"
+                time.sleep(0.1)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
+
+
+def test_several_workers_need_a_shared_cache_without_a_change_log(monkeypatch):
+    monkeypatch.setattr(server, "engine", create_mock_engine("postgresql://", executor=None))
+    monkeypatch.setattr("app.cache.cache", MemoryCache())
+
+    assert server.Supervisor(None, workers=2).run() == 1
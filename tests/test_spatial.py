@@ -0,0 +1,228 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import geocoding, spatial
+from app.geocoding import GeocodingError, LocalGeocoder, geocode_households
+from app.models import Household
+from app.spatial import distance_miles, find_near, radius_boxes, split_box
+
+# Akron, Ohio, and points around it
+PLACES = {
+    "1 Church St": (41.0814, -81.5190),
+    "2 Near Rd": (41.0900, -81.5100),
+    "3 Town Ave": (41.1300, -81.4400),
+    "4 Far Blvd": (41.4993, -81.6944),
+}
+
+
+class CountingGeocoder(LocalGeocoder):
+    def __init__(self, places):
+        super().__init__(places)
+        self.asked = []
+
+    def geocode(self, address):
+        self.asked.append(address)
+        return super().geocode(address)
+
+
+class FlakyGeocoder(CountingGeocoder):
+    def __init__(self, places, failing):
+        super().__init__(places)
+        self.failing = failing
+
+    def geocode(self, address):
+        if address in self.failing:
+            self.asked.append(address)
+            raise GeocodingError("Geocoder answered OVER_QUERY_LIMIT")
+        return super().geocode(address)
+
+
+def add_household(client: TestClient, name: str, address: str) -> dict:
+    return client.post(
+        "/households/", json={"name": name, "address": address, "members": []}
+    ).json()
+
+
+def test_addresses_are_geocoded_once(client: TestClient, session: Session):
+    first = add_household(client, "The Lees", "1 Church Street")
+    same = add_household(client, "The Parks", "1 church st.")
+    lost = add_household(client, "The Kims", "99 Nowhere Ln")
+    geocoder = CountingGeocoder(PLACES)
+
+    status = geocode_households(session.get_bind(), geocoder, batch_size=1)
+    assert sorted(geocoder.asked) == ["1 Church Street", "99 Nowhere Ln"]
+    assert (status.located, status.unlocated, status.not_found) == (2, 1, 1)
+    for household in (first, same):
+        located = client.get(f"/households/{household['id']}").json()
+        assert (located["latitude"], located["longitude"]) == PLACES["1 Church St"]
+    assert client.get(f"/households/{lost['id']}").json()["latitude"] is None
+
+    # Nothing is asked twice, and new households at known addresses are
+    # located as they are added
+    geocode_households(session.get_bind(), geocoder)
+    assert len(geocoder.asked) == 2
+    later = add_household(client, "The Ngs", "1 CHURCH ST")
+    assert later["latitude"] == PLACES["1 Church St"][0]
+
+    # A new address drops coordinates that no longer apply
+    moved = client.patch(f"/households/{later['id']}", json={"address": "2 Near Rd"}).json()
+    assert moved["latitude"] is None
+    geocode_households(session.get_bind(), geocoder)
+    assert client.get(f"/households/{later['id']}").json()["latitude"] == PLACES["2 Near Rd"][0]
+
+
+def test_geocoder_errors_leave_addresses_for_the_next_run(
+    client: TestClient, session: Session, monkeypatch
+):
+    for address in PLACES:
+        add_household(client, address, address)
+
+    status = geocode_households(
+        session.get_bind(), FlakyGeocoder(PLACES, {"2 Near Rd"}), batch_size=10
+    )
+    # The rest of the batch was kept
+    assert (status.located, status.unlocated, status.cached_addresses) == (3, 1, 3)
+    assert status.failed == 1
+    assert status.last_error == "Geocoder answered OVER_QUERY_LIMIT"
+
+    status = geocode_households(session.get_bind(), LocalGeocoder(PLACES))
+    assert (status.located, status.failed, status.last_error) == (4, 0, None)
+
+    # A geocoder that keeps failing stops the run
+    monkeypatch.setattr(geocoding, "GEOCODING_MAX_ERRORS", 2)
+    for number in range(5):
+        add_household(client, "Later", f"{number} Later St")
+    down = FlakyGeocoder({}, {f"{number} Later St" for number in range(5)})
+    status = geocode_households(session.get_bind(), down, batch_size=1)
+    assert len(down.asked) == status.failed == 2
+
+
+def test_households_near_a_point(client: TestClient, session: Session):
+    ids = {address: add_household(client, address, address)["id"] for address in PLACES}
+    add_household(client, "Not geocoded", "5 Unknown Way")
+    geocode_households(session.get_bind(), LocalGeocoder(PLACES))
+    church = PLACES["1 Church St"]
+
+    response = client.get(
+        "/households/near", params={"lat": church[0], "lng": church[1], "radius": 6}
+    )
+    assert response.status_code == 200
+    found = response.json()
+    assert [household["id"] for household in found] == [
+        ids["1 Church St"],
+        ids["2 Near Rd"],
+        ids["3 Town Ave"],
+    ]
+    assert found[0]["distance"] == 0
+    assert found[1]["distance"] == pytest.approx(0.757, abs=0.001)
+
+    nearest = client.get(
+        "/households/near", params={"lat": church[0], "lng": church[1], "radius": 50, "limit": 1}
+    ).json()
+    assert [household["id"] for household in nearest] == [ids["1 Church St"]]
+
+    # Moved away, a household leaves the index
+    with Session(session.get_bind()) as other:
+        household = other.get(Household, ids["2 Near Rd"])
+        household.latitude, household.longitude = 0.0, 0.0
+        other.add(household)
+        other.commit()
+    nearby = client.get(
+        "/households/near", params={"lat": church[0], "lng": church[1], "radius": 1}
+    ).json()
+    assert [household["id"] for household in nearby] == [ids["1 Church St"]]
+
+
+def test_nearest_households_at_a_large_radius(session: Session, monkeypatch):
+    church = PLACES["1 Church St"]
+    rng = random.Random(7)
+    # A dense town around the point, and many more households further out
+    for number in range(3000):
+        spread = 0.01 if number < 50 else 2.0
+        session.add(
+            Household(
+                name=f"H{number}",
+                address=f"{number} Test St",
+                latitude=church[0] + rng.uniform(-spread, spread),
+                longitude=church[1] + rng.uniform(-spread, spread),
+            )
+        )
+    session.commit()
+    read = []
+
+    def counting_points_in_boxes(*args, **kwargs):
+        points = points_in_boxes(*args, **kwargs)
+        read.extend(points)
+        return points
+
+    points_in_boxes = spatial.points_in_boxes
+    monkeypatch.setattr(spatial, "points_in_boxes", counting_points_in_boxes)
+
+    nearest = find_near(session, *church, radius=250, limit=10)
+    everything = sorted(
+        (distance_miles(*church, latitude, longitude), household_id)
+        for household_id, latitude, longitude in points_in_boxes(
+            session, radius_boxes(*church, 250)
+        )
+    )
+    assert [household_id for household_id, _ in nearest] == [
+        household_id for _, household_id in everything[:10]
+    ]
+    # The town was enough: the households further out weren't read
+    assert len(read) < 100
+
+    # Too few within reach of the first boxes: it widens to the whole radius
+    assert len(find_near(session, *church, radius=250, limit=5000)) == 3000
+
+
+def test_households_within_a_box(client: TestClient, session: Session):
+    ids = {address: add_household(client, address, address)["id"] for address in PLACES}
+    geocode_households(session.get_bind(), LocalGeocoder(PLACES))
+    box = {"south": 41.0, "west": -81.6, "north": 41.2, "east": -81.4, "limit": 2}
+
+    response = client.get("/households/within", params=box)
+    assert [household["id"] for household in response.json()] == [
+        ids["1 Church St"],
+        ids["2 Near Rd"],
+    ]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/households/within", params={**box, "after": cursor})
+    assert [household["id"] for household in response.json()] == [ids["3 Town Ave"]]
+    assert "X-Next-Cursor" not in response.headers
+
+    assert client.get("/households/within", params={**box, "south": 42}).status_code == 422
+
+
+def test_boxes_wrap_around_the_antimeridian():
+    assert split_box(-10, 170, 10, -170) == [(-10, 170, 10, 180.0), (-10, -180.0, 10, -170)]
+    assert split_box(0, -10, 1, 10) == [(0, -10, 1, 10)]
+
+    boxes = radius_boxes(0, 179.9, 50)
+    assert len(boxes) == 2
+    assert boxes[1][1] == -180.0
+    assert radius_boxes(89.9, 0, 50) == [(pytest.approx(89.17, abs=0.01), -180.0, 90.0, 180.0)]
+    # One degree of latitude
+    assert distance_miles(0, 0, 1, 0) == pytest.approx(69.09, abs=0.01)
+
+
+def test_geocoding_from_the_admin_endpoint(client: TestClient, monkeypatch):
+    add_household(client, "The Lees", "1 Church St")
+    monkeypatch.setattr(geocoding, "GEOCODER", "none")
+    assert client.post("/admin/geocoding").status_code == 503
+
+    monkeypatch.setattr(geocoding, "configured_geocoder", lambda: LocalGeocoder(PLACES))
+    response = client.post("/admin/geocoding")
+    assert response.status_code == 202
+    geocoding.runner.join(timeout=10)
+    assert client.get("/admin/geocoding").json() == {
+        "located": 1,
+        "unlocated": 0,
+        "cached_addresses": 1,
+        "not_found": 0,
+        "failed": 0,
+        "last_error": None,
+        "running": False,
+    }